@@ -0,0 +1,73 @@
+"""
+Call-graph benchmark: whole-program call-graph extraction on a synthetic
+program of --files translation units with --functions functions each,
+every function calling a few others anywhere in the program (plus a static
+helper per file, and library calls).
+
+It reports the end-to-end time of build_call_graph with 1 and with --jobs
+worker processes, and the time of merging the per-file summaries alone at
+a quarter, half and all of the files, which should grow linearly.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import c2flow
+import callgraph
+
+
+def write_program(workdir, files, functions, seed=0):
+    rng = random.Random(seed)
+    total = files * functions
+    paths = []
+    for f in range(files):
+        lines = ["int printf(const char *fmt, ...);", f"static int helper_{f}(int v) {{ return v * 2; }}"]
+        lines += [f"int func_{rng.randrange(total)}(int n);" for _ in range(4)]
+        for i in range(f * functions, (f + 1) * functions):
+            calls = [f"func_{rng.randrange(total)}(n - {k + 1})" for k in range(rng.randint(1, 4))]
+            lines.append(f"int func_{i}(int n) {{\n    if (n <= 0) return helper_{f}(n);\n"
+                         f"    printf(\"%d\", n);\n    return {' + '.join(calls)};\n}}")
+        path = os.path.join(workdir, f"unit_{f}.c")
+        with open(path, "w", encoding='utf-8') as out:
+            out.write("\n".join(lines) + "\n")
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark whole-program call-graph extraction.")
+    parser.add_argument("--files", type=int, default=200, help="Translation units. Default is 200.")
+    parser.add_argument("--functions", type=int, default=100, help="Functions per file. Default is 100.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Worker processes. Default is the CPU count.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = write_program(workdir, args.files, args.functions)
+        print(f"{args.files} files, {args.files * args.functions} functions")
+        for jobs in sorted({1, args.jobs}):
+            start = time.perf_counter()
+            graph, results = c2flow.build_call_graph(paths, jobs=jobs, preprocessor='builtin')
+            elapsed = time.perf_counter() - start
+            print(f"  jobs={jobs:<3} {elapsed:7.2f}s  {len(graph)} functions, {graph.call_count} calls, "
+                  f"{sum(not r['ok'] for r in results)} failed")
+
+        summaries = [c2flow.extract_file_calls(p, preprocessor='builtin')['summary'] for p in paths]
+        print("  merge only:")
+        for fraction in (4, 2, 1):
+            subset = summaries[:len(summaries) // fraction]
+            start = time.perf_counter()
+            graph = callgraph.CallGraph()
+            for summary in subset:
+                graph.merge(summary)
+            elapsed = time.perf_counter() - start
+            print(f"    {len(subset):>5} files {elapsed * 1000:8.1f}ms  ({elapsed / len(subset) * 1e6:.0f}us/file)")
+
+
+if __name__ == "__main__":
+    main()
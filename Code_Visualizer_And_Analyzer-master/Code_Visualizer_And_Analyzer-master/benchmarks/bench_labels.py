@@ -0,0 +1,97 @@
+"""
+Label benchmark: c2flow's LabelRenderer against the CGenerator path it
+replaced (a CGenerator visit per label, then ';' stripping, DOT escaping
+and Graphviz quoting of every occurrence).
+
+For each synthetic program (see cgen.py) it collects the nodes the visitor
+labels, then times producing their DOT 'label=...' attributes both ways and
+reports the best of --repeat runs. It also checks that both paths give the
+same labels, and with --max-label-length shows the effect of truncation.
+"""
+import argparse
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import c2flow
+import cgen
+
+# Nodes the visitor turns into labels: statements, conditions, increments and case values
+_LABELED = ('Assignment', 'Decl', 'FuncCall', 'UnaryOp', 'BinaryOp', 'Return', 'ExprList', 'Constant', 'ID')
+
+
+def labeled_nodes(ast):
+    nodes = []
+
+    def walk(node):
+        if node.__class__.__name__ in _LABELED:
+            nodes.append(node)
+            return
+        for _, child in node.children():
+            walk(child)
+    for ext in ast.ext:
+        if ext.__class__.__name__ == 'FuncDef':
+            walk(ext.body)
+    return nodes
+
+
+def old_labels(nodes):
+    graphviz = c2flow._import_graphviz()
+    c_gen = c2flow._import_pycparser().c_generator.CGenerator()
+    out = []
+    for node in nodes:
+        label = c_gen.visit(node).replace(';', '').strip()
+        out.append(graphviz.quoting.attr_list(c2flow._dot_escape(label)))
+    return out
+
+
+def new_labels(nodes, max_length=0):
+    c2flow._dot_label.cache_clear() # Measure a cold cache, as for the first file of a run
+    renderer = c2flow.LabelRenderer(max_length)
+    return [f" [{c2flow._dot_label(renderer.label(node))}]" for node in nodes]
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark flowchart label generation.")
+    parser.add_argument("--shapes", nargs='+', choices=cgen.SHAPES, default=list(cgen.SHAPES))
+    parser.add_argument("--size", type=int, default=4000, help="Approximate statements per program. Default is 4000.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per path (the best is reported). Default is 5.")
+    parser.add_argument("--max-label-length", type=int, default=0,
+                        help="Also time the new path with labels cut to this length.")
+    args = parser.parse_args()
+
+    print(f"{'shape':<10} {'labels':>7} {'distinct':>8} {'cgenerator':>11} {'renderer':>10} {'speedup':>8}"
+          + (f" {'cut':>10}" if args.max_label_length else ""))
+    for shape in args.shapes:
+        ast = c2flow.parse(cgen.generate(shape, args.size), filename=f"{shape}.c")
+        nodes = labeled_nodes(ast)
+        old_time, old = best_of(args.repeat, old_labels, nodes)
+        new_time, new = best_of(args.repeat, new_labels, nodes)
+        if old != new:
+            mismatch = next(i for i, (a, b) in enumerate(zip(old, new)) if a != b)
+            print(f"ERROR: {shape}: labels differ, e.g. {old[mismatch]!r} != {new[mismatch]!r}")
+            sys.exit(1)
+        line = (f"{shape:<10} {len(nodes):>7} {len(set(new)):>8} {old_time * 1000:9.1f}ms {new_time * 1000:8.1f}ms"
+                f" {old_time / new_time:7.1f}x")
+        if args.max_label_length:
+            cut_time, _ = best_of(args.repeat, new_labels, nodes, args.max_label_length)
+            line += f" {cut_time * 1000:8.1f}ms"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Memory benchmark for the flowchart graph representation.
+
+Generates a large C file (--functions functions of --statements control-flow
+blocks each), parses it once and measures with tracemalloc the memory
+retained by (and the peak while building):
+  cfg      - the compact controlflow.ControlFlowGraph (build_cfg)
+  cfg+dot  - the CFG plus the graphviz.Digraph rendered from it
+  compare  - an older c2flow.py's FlowchartVisitor building its Digraph
+             (only with --compare). Times include tracemalloc overhead. E.g.:
+  git show <rev>:Code_Visualizer_And_Analyzer-master/Code_Visualizer_And_Analyzer-master/c2flow.py > /tmp/c2flow_old.py
+  python benchmarks/bench_memory.py --compare /tmp/c2flow_old.py
+"""
+import argparse
+import gc
+import importlib.util
+import os
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import c2flow
+
+
+def generate_c(functions, statements):
+    """Returns C source without #include/#define, so it parses without preprocessing."""
+    lines = []
+    for f in range(functions):
+        lines.append(f"int func_{f}(int n, int *data) {{")
+        lines.append("    int total = 0;")
+        for s in range(statements):
+            lines.append(f"    for (int i = 0; i < n; i++) {{")
+            lines.append(f"        if (data[i] > {s}) {{ total += data[i] * {s}; }} else {{ total -= {s}; }}")
+            lines.append(f"        if (total > {1000 + s}) break;")
+            lines.append("    }")
+            lines.append(f"    while (total > {s}) {{ total = total / 2; n++; }}")
+        lines.append("    return total;")
+        lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def _load_script(path):
+    path = os.path.abspath(path)
+    saved_argv = sys.argv
+    sys.argv = ['c2flow'] # Older versions read sys.argv at import time
+    try:
+        spec = importlib.util.spec_from_file_location('c2flow_compare', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.argv = saved_argv
+    return module
+
+
+def measure(build):
+    """Returns (retained bytes, peak bytes, seconds, result) for build()."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    seconds = time.perf_counter() - start
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return retained, peak, seconds, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the memory used by the flowchart graph.")
+    parser.add_argument("--functions", type=int, default=200, help="Functions in the generated file. Default is 200.")
+    parser.add_argument("--statements", type=int, default=25,
+                        help="Control-flow blocks per function. Default is 25.")
+    parser.add_argument("--compare", metavar="OLD_C2FLOW", help="An older c2flow.py to measure against.")
+    args = parser.parse_args()
+
+    ast = c2flow.parse(generate_c(args.functions, args.statements), filename='<generated>')
+
+    def build_cfg_and_dot():
+        cfg = c2flow.build_cfg(ast)
+        return cfg, c2flow.cfg_to_digraph(cfg)
+
+    cases = {
+        'cfg': lambda: c2flow.build_cfg(ast),
+        'cfg+dot': build_cfg_and_dot,
+    }
+    if args.compare:
+        old = _load_script(args.compare)
+
+        def build_old():
+            visitor = old.FlowchartVisitor()
+            visitor.visit(ast)
+            return visitor.dot
+        cases['compare'] = build_old
+
+    nodes = len(c2flow.build_cfg(ast))
+    print(f"{args.functions} functions, {nodes} flowchart nodes")
+    print(f"{'case':<8} {'retained':>10} {'peak':>10} {'bytes/node':>10} {'time':>9}")
+    for case, build in cases.items():
+        retained, peak, seconds, result = measure(build)
+        del result
+        print(f"{case:<8} {retained / 2**20:8.2f}MB {peak / 2**20:8.2f}MB {retained / nodes:10.0f} {seconds * 1000:7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
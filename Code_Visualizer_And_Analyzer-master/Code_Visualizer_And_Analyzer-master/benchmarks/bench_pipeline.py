@@ -0,0 +1,165 @@
+"""
+Pipeline benchmark suite: per-stage time, throughput and memory of c2flow on
+synthetic C programs (see cgen.py for the shapes), with stored baselines and
+a regression check.
+
+Each shape is written to a temporary file and run through the batch
+pipeline (process_c_file) --repeat times. The report shows the best time
+of each stage: preprocess, parse, visit, write and, when Graphviz is
+installed and --render is given, render. The minimum is the least noisy
+estimate, as with timeit. It also shows the end-to-end throughput in
+source lines per second, and the peak Python memory of each stage from
+one extra tracemalloc run.
+
+Baselines are per machine. Record one before a change and check against
+it afterwards:
+  python benchmarks/bench_pipeline.py --save-baseline before
+  ... change the visitor, preprocessing or rendering ...
+  python benchmarks/bench_pipeline.py --check before
+--check exits with status 1 when a stage got slower (or used more memory)
+than the baseline by more than --tolerance and by more than --min-delta-ms.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import c2flow
+import cgen
+
+BASELINE_DIR = os.path.join(HERE, 'baselines')
+DEFAULT_SIZE = 2000
+STAGES = ('preprocess', 'parse', 'visit', 'write', 'render')
+
+
+def bench_shape(shape, size, repeat, preprocessor, image_format, workdir):
+    """Returns {'lines', 'stages': {stage: best s}, 'total', 'lines_per_s', 'peak_kb': {stage: KB}, 'graph_nodes'}."""
+    c_file = os.path.join(workdir, f"{shape}.c")
+    with open(c_file, "w", encoding='utf-8') as f:
+        f.write(cgen.generate(shape, size))
+    output_base = os.path.join(workdir, 'out', shape)
+
+    def run(profile_memory=False):
+        result = c2flow.process_c_file(c_file, output_base, image_format=image_format, preprocessor=preprocessor,
+                                       profile=True, profile_memory=profile_memory)
+        if not result['ok']:
+            raise RuntimeError(f"{shape}: {result['stage']} failed: {result['error']}")
+        return result['profile']
+
+    samples = [run() for _ in range(repeat)]
+    memory_profile = run(profile_memory=True)
+
+    stages = {stage: min(p['stages'][stage]['wall'] for p in samples)
+              for stage in STAGES if stage in samples[0]['stages']}
+    total = min(p['total_wall'] for p in samples)
+    lines = samples[0]['metrics']['preprocessed_lines']
+    return {
+        'lines': lines,
+        'graph_nodes': samples[0]['metrics']['graph_nodes'],
+        'stages': stages,
+        'total': total,
+        'lines_per_s': lines / total if total else None,
+        'peak_kb': {stage: s['peak_kb'] for stage, s in memory_profile['stages'].items() if 'peak_kb' in s},
+    }
+
+
+def print_report(results):
+    header = f"{'shape':<10} {'lines':>6} {'nodes':>6} " + " ".join(f"{s:>10}" for s in STAGES) \
+        + f" {'total':>10} {'lines/s':>9} {'peak':>9}"
+    print(header)
+    for shape, r in results.items():
+        cells = []
+        for stage in STAGES:
+            if stage not in r['stages']:
+                cells.append(f"{'-':>10}")
+                continue
+            cells.append(f"{r['stages'][stage] * 1000:8.1f}ms")
+        peak = max(r['peak_kb'].values(), default=0)
+        print(f"{shape:<10} {r['lines']:>6} {r['graph_nodes']:>6} " + " ".join(cells)
+              + f" {r['total'] * 1000:8.1f}ms {r['lines_per_s']:9.0f} {peak / 1024:7.1f}MB")
+
+
+def check_regressions(results, baseline, tolerance, min_delta):
+    """Returns a list of human-readable regressions of results against baseline."""
+    regressions = []
+    for shape, r in results.items():
+        base = baseline.get(shape)
+        if not base:
+            continue
+        timings = dict(r['stages'], total=r['total'])
+        base_timings = dict(base['stages'], total=base['total'])
+        for stage, seconds in timings.items():
+            old = base_timings.get(stage)
+            if old and seconds > old * (1 + tolerance) and seconds - old > min_delta:
+                regressions.append(f"{shape}/{stage}: {old * 1000:.1f}ms -> {seconds * 1000:.1f}ms ({seconds / old - 1:+.0%})")
+        for stage, kb in r['peak_kb'].items():
+            old = base['peak_kb'].get(stage)
+            if old and kb > old * (1 + tolerance) and kb - old > 64:
+                regressions.append(f"{shape}/{stage} memory: {old:.0f}KB -> {kb:.0f}KB ({kb / old - 1:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the c2flow pipeline on synthetic C programs.")
+    parser.add_argument("--shapes", nargs='+', choices=cgen.SHAPES, default=list(cgen.SHAPES),
+                        help="Program shapes to benchmark. Default is all of them.")
+    parser.add_argument("--size", type=int, default=DEFAULT_SIZE,
+                        help=f"Approximate statements per program. Default is {DEFAULT_SIZE}.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per shape (the best is reported). Default is 5.")
+    parser.add_argument("--preprocessor", choices=c2flow.PREPROCESSOR_BACKENDS, default='builtin',
+                        help="Preprocessor backend. Default is 'builtin' (no compiler-version noise).")
+    parser.add_argument("--render", metavar="FORMAT", choices=[f for f in c2flow.IMAGE_FORMATS if f != 'dot'],
+                        help="Also render images with Graphviz in this format (requires 'dot').")
+    parser.add_argument("--save-baseline", metavar="NAME", help=f"Store the results as {BASELINE_DIR}/NAME.json.")
+    parser.add_argument("--check", metavar="NAME", help="Compare against a stored baseline; exit 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative slowdown/memory growth for --check. Default is 0.25 (25%%).")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0,
+                        help="Ignore slowdowns smaller than this for --check (timer noise). Default is 2.0.")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.check:
+        with open(os.path.join(BASELINE_DIR, f"{args.check}.json"), "r", encoding='utf-8') as f:
+            stored = json.load(f)
+        baseline = stored['results']
+        if stored['settings'] != {'size': args.size, 'preprocessor': args.preprocessor, 'render': args.render}:
+            print(f"WARNING: Baseline '{args.check}' was recorded with {stored['settings']}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for shape in args.shapes:
+            start = time.perf_counter()
+            results[shape] = bench_shape(shape, args.size, args.repeat, args.preprocessor, args.render, workdir)
+            print(f"INFO: {shape} done in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    print_report(results)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        with open(path, "w", encoding='utf-8') as f:
+            json.dump({'settings': {'size': args.size, 'preprocessor': args.preprocessor, 'render': args.render},
+                       'machine': {'python': platform.python_version(), 'platform': platform.platform()},
+                       'recorded': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'results': results}, f, indent=1)
+        print(f"INFO: Baseline saved to {path}")
+
+    if baseline is not None:
+        regressions = check_regressions(results, baseline, args.tolerance, args.min_delta_ms / 1000)
+        if regressions:
+            print(f"\nFAILED: {len(regressions)} regression(s) against baseline '{args.check}':")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nOK: no regressions against baseline '{args.check}' (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Preprocessing benchmark: `<compiler> -E` against the builtin preprocessor.
+
+For each sample it reports the first call (the builtin backend still has to
+read and tokenize the headers) and the median of the following calls (headers
+already cached, as for every file after the first in a batch). It also checks
+that both backends yield the same function definitions (header typedefs can
+differ slightly, e.g. gcc predefines __SIZEOF_INT128__).
+
+The header-heavy samples need pycparser's fake_libc_include; set
+PYCPARSER_FAKE_LIBC_PATH if your pycparser install does not ship it.
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import c2flow
+
+with open(os.path.join(os.path.dirname(HERE), 'example.c'), encoding='utf-8') as _example:
+    EXAMPLE_C = _example.read()
+
+SAMPLES = {
+    'example.c': EXAMPLE_C,
+    'macros': '''
+#define SQUARE(x) ((x) * (x))
+#define CLAMP(v, lo, hi) ((v) < (lo) ? (lo) : (v) > (hi) ? (hi) : (v))
+#define LIMIT 100
+int f(int n) {
+    int total = 0;
+    for (int i = 0; i < LIMIT; i++) {
+#if LIMIT > 50
+        total += CLAMP(SQUARE(i), 0, n);
+#else
+        total += i;
+#endif
+    }
+    return total;
+}
+''',
+    'stdio+stdlib+string': '''
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+int main(int argc, char **argv) {
+    char *buf = malloc(strlen(argv[0]) + 1);
+    strcpy(buf, argv[0]);
+    printf("%s\\n", buf);
+    free(buf);
+    return EXIT_SUCCESS;
+}
+''',
+}
+
+
+def _measure(backend, source, repeat, compiler):
+    samples = []
+    output = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = c2flow.preprocess(source, compiler, [], backend)
+        samples.append(time.perf_counter() - start)
+    return samples[0], statistics.median(samples[1:] or samples), output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the compiler and builtin preprocessor backends.")
+    parser.add_argument("--repeat", type=int, default=20, help="Calls per sample and backend. Default is 20.")
+    parser.add_argument("--compiler", default="gcc", help="Compiler for the 'compiler' backend. Default is 'gcc'.")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()): # Discovery output
+        c2flow.get_pycparser_fake_libc_path()
+
+    print(f"{'sample':<22} {'backend':<9} {'first':>9} {'median':>9}  same functions")
+    for name, source in SAMPLES.items():
+        results = {}
+        for backend in c2flow.PREPROCESSOR_BACKENDS:
+            try:
+                results[backend] = _measure(backend, source, args.repeat, args.compiler)
+            except Exception as e:
+                print(f"{name:<22} {backend:<9} failed: {str(e).splitlines()[0]}")
+        if len(results) != len(c2flow.PREPROCESSOR_BACKENDS):
+            continue
+        generate = c2flow._import_pycparser().c_generator.CGenerator().visit
+        asts = {tuple(generate(ext) for ext in c2flow.parse(output).ext if type(ext).__name__ == 'FuncDef')
+                for _, _, output in results.values()}
+        for backend, (first, median, _) in results.items():
+            print(f"{name:<22} {backend:<9} {first * 1000:7.2f}ms {median * 1000:7.2f}ms  {len(asts) == 1}")
+
+
+if __name__ == "__main__":
+    main()
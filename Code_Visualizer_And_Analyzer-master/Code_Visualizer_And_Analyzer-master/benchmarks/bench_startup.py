@@ -0,0 +1,74 @@
+"""
+Startup-time benchmark for c2flow.
+
+Measures (median of --repeat fresh interpreters):
+  import  - `import c2flow` as a library
+  help    - `python c2flow.py --help`
+  run     - `python c2flow.py example.c` end to end (cache disabled when supported)
+
+Pass --compare with an older c2flow.py to benchmark both side by side, e.g.:
+  git show <rev>:Code_Visualizer_And_Analyzer-master/Code_Visualizer_And_Analyzer-master/c2flow.py > /tmp/c2flow_old.py
+  python benchmarks/bench_startup.py --compare /tmp/c2flow_old.py
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+C2FLOW = os.path.join(os.path.dirname(HERE), 'c2flow.py')
+EXAMPLE_C = os.path.join(os.path.dirname(HERE), 'example.c')
+
+
+def _time_command(cmd, cwd, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def bench_script(script, repeat):
+    """Returns {case: median seconds} for one copy of c2flow.py."""
+    script = os.path.abspath(script)
+    script_dir, module = os.path.split(os.path.splitext(script)[0])
+    with open(script, "r", encoding='utf-8') as f:
+        supports_no_cache = '--no-cache' in f.read()
+    # Older versions parse sys.argv[1] at import time, so give them a real file
+    import_code = (f"import sys; sys.argv = ['c2flow', {EXAMPLE_C!r}]; "
+                   f"sys.path.insert(0, {script_dir!r}); import {module}")
+    run_cmd = [sys.executable, script, EXAMPLE_C, '-o', 'bench_flowchart']
+    if supports_no_cache:
+        run_cmd.append('--no-cache')
+
+    with tempfile.TemporaryDirectory() as cwd:
+        return {
+            'import': _time_command([sys.executable, '-c', import_code], cwd, repeat),
+            'help': _time_command([sys.executable, script, '--help'], cwd, repeat),
+            'run': _time_command(run_cmd, cwd, repeat),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark c2flow import and CLI startup time.")
+    parser.add_argument("--repeat", type=int, default=10, help="Interpreter launches per case. Default is 10.")
+    parser.add_argument("--compare", metavar="OLD_C2FLOW", help="Another c2flow.py to benchmark against.")
+    args = parser.parse_args()
+
+    baseline = bench_script(args.compare, args.repeat) if args.compare else None
+    current = bench_script(C2FLOW, args.repeat)
+
+    print(f"{'case':<8} {'current':>10}" + (f" {'compare':>10} {'speedup':>8}" if baseline else ""))
+    for case, seconds in current.items():
+        line = f"{case:<8} {seconds * 1000:8.1f}ms"
+        if baseline:
+            line += f" {baseline[case] * 1000:8.1f}ms {baseline[case] / seconds:7.2f}x"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
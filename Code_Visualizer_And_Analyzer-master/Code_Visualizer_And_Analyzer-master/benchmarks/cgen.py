@@ -0,0 +1,96 @@
+"""
+Deterministic generators of synthetic C programs for the c2flow benchmarks.
+
+Each shape stresses a different part of the pipeline; `size` scales it
+roughly linearly in statements. The output needs no #include, so it can be
+parsed with or without preprocessing, and the same (shape, size, seed)
+always yields the same program.
+
+  functions  - many small functions with a little control flow each
+  nested     - deeply nested if/for/while blocks
+  straight   - long straight-line blocks of assignments and calls
+  switch     - huge switch statements with fallthrough and default
+  mixed      - a blend of all of the above, closest to real code
+"""
+import random
+
+SHAPES = ('functions', 'nested', 'straight', 'switch', 'mixed')
+
+_HEADER = "int sink(int v);\nint table[256];\n\n"
+
+
+def _expr(rng, names):
+    a, b = rng.choice(names), rng.choice(names)
+    return f"{a} {rng.choice('+-*^&|')} ({b} + {rng.randint(1, 99)})"
+
+
+def _cond(rng, names):
+    return f"{rng.choice(names)} {rng.choice(('<', '>', '==', '!='))} {rng.randint(0, 50)}"
+
+
+def _straight_block(rng, names, count, indent):
+    lines = []
+    for _ in range(count):
+        if rng.random() < 0.2:
+            lines.append(f"{indent}sink({_expr(rng, names)});")
+        else:
+            lines.append(f"{indent}{rng.choice(names)} = {_expr(rng, names)};")
+    return lines
+
+
+def _nested_block(rng, names, depth, indent):
+    if depth == 0:
+        return _straight_block(rng, names, 2, indent)
+    kind = rng.choice(('if', 'for', 'while'))
+    inner = _nested_block(rng, names, depth - 1, indent + "    ")
+    if kind == 'if':
+        return ([f"{indent}if ({_cond(rng, names)}) {{"] + inner + [f"{indent}}} else {{"]
+                + _straight_block(rng, names, 1, indent + "    ") + [f"{indent}}}"])
+    if kind == 'for':
+        return [f"{indent}for (int i{depth} = 0; i{depth} < n; i{depth}++) {{"] + inner + [f"{indent}}}"]
+    return ([f"{indent}while ({_cond(rng, names)}) {{"] + inner
+            + [f"{indent}    n--;", f"{indent}    if (n < 0) break;", f"{indent}}}"])
+
+
+def _switch_block(rng, names, cases, indent):
+    lines = [f"{indent}switch ({rng.choice(names)} & 255) {{"]
+    for case in range(cases):
+        lines.append(f"{indent}case {case}:")
+        lines += _straight_block(rng, names, rng.randint(1, 3), indent + "    ")
+        if rng.random() < 0.8: # The rest fall through
+            lines.append(f"{indent}    break;")
+    lines += [f"{indent}default:"] + _straight_block(rng, names, 1, indent + "    ") + [f"{indent}}}"]
+    return lines
+
+
+def _function(name, body):
+    return ([f"int {name}(int n, int a, int b) {{", "    int x = n, y = a, z = b;"]
+            + body + ["    return x + y + z;", "}", ""])
+
+
+def generate(shape, size=100, seed=0):
+    """Returns the C source of a program of the given shape and size."""
+    if shape not in SHAPES:
+        raise ValueError(f"Unknown shape {shape!r}; expected one of {', '.join(SHAPES)}")
+    rng = random.Random(f"{shape}-{size}-{seed}")
+    names = ['x', 'y', 'z', 'a', 'b', 'n']
+    lines = []
+    if shape == 'functions':
+        for f in range(max(1, size // 10)):
+            lines += _function(f"func_{f}", _nested_block(rng, names, 1, "    "))
+    elif shape == 'nested':
+        depth = 12
+        for f in range(max(1, size // (2 * depth))):
+            lines += _function(f"nested_{f}", _nested_block(rng, names, depth, "    "))
+    elif shape == 'straight':
+        for f in range(max(1, size // 200)):
+            lines += _function(f"straight_{f}", _straight_block(rng, names, 200, "    "))
+    elif shape == 'switch':
+        for f in range(max(1, size // 400)):
+            lines += _function(f"dispatch_{f}", _switch_block(rng, names, 200, "    "))
+    else:
+        for f in range(max(1, size // 40)):
+            body = (_straight_block(rng, names, 10, "    ") + _nested_block(rng, names, 4, "    ")
+                    + _switch_block(rng, names, 8, "    ") + _straight_block(rng, names, 5, "    "))
+            lines += _function(f"mixed_{f}", body)
+    return _HEADER + "\n".join(lines) + "\n"
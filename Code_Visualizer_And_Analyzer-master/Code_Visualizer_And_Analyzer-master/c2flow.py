@@ -1,60 +1,60 @@
 import sys
-import tempfile
 import subprocess
 import os
 import argparse # For command-line arguments
+import glob
+import time
+import hashlib
+import json
+import pickle
+import re
+import importlib.util
+import shutil
+import html
+import contextlib
+import copy
+import functools
 
+import controlflow # Sibling module: the compact CFG the visitor records into
+import callgraph # Sibling module: the whole-program call graph
 
 
 
 
 
-# Attempt to import pycparser to get its path
-try:
-    import pycparser
-    from pycparser import c_parser, c_ast, c_generator
-except ImportError:
-    print("ERROR: pycparser library not found. Please install it: pip install pycparser")
-    sys.exit(1)
-
-# Attempt to import graphviz Python library
-try:
-    from graphviz import Digraph
-except ImportError:
-    print("ERROR: graphviz Python library not found. Please install it: pip install graphviz")
-    print("Ensure you also have Graphviz (the software) installed and in your PATH.")
-    sys.exit(1)
-
-
-# --- Helper to find pycparser's fake_libc_include ---
-# --- Helper to find pycparser's fake_libc_include ---
-
-import sys
-from pycparser import parse_file
-
-filename = sys.argv[1] if len(sys.argv) > 1 else 'test.c'
-
-# Get filename from command-line argument
-
-ast = parse_file(filename, use_cpp=True, cpp_args=[
-    r'-IC:\Users\HP\AppData\Local\Packages\PythonSoftwareFoundation.Python.3.11_qbz5n2kfra8p0\LocalCache\local-packages\Python311\site-packages\pycparser\utils\fake_libc_include'
-])
-
-# Do something with the AST...
-print("Parsed successfully.")
-
 
+# --- Lazy imports of pycparser and graphviz ---
+# Both are imported on first use rather than at module import, so importing
+# c2flow as a library or running `c2flow.py --help` does not pay for loading
+# pycparser's parser tables, and a missing package is reported as ImportError
+# to the caller instead of exiting the interpreter.
+def _import_pycparser():
+    try:
+        import pycparser
+        import pycparser.c_parser, pycparser.c_ast, pycparser.c_generator
+    except ImportError:
+        raise ImportError("pycparser library not found. Please install it: pip install pycparser") from None
+    return pycparser
 
 
+def _import_graphviz():
+    try:
+        import graphviz
+    except ImportError:
+        raise ImportError("graphviz Python library not found. Please install it: pip install graphviz\n"
+                          "Ensure you also have Graphviz (the software) installed and in your PATH.") from None
+    return graphviz
 
 
-def get_pycparser_fake_libc_path():
+# --- Helper to find pycparser's fake_libc_include ---
+def _discover_fake_libc_path():
     """
     Finds the path to pycparser's fake_libc_include directory.
     Tries multiple methods for robustness.
     """
     # Method 1: Directly from pycparser installation path
     try:
+        pycparser = _import_pycparser()
         pycparser_dir = os.path.dirname(pycparser.__file__)
         path1 = os.path.join(pycparser_dir, 'utils', 'fake_libc_include')
         if os.path.isdir(path1):
@@ -126,25 +126,88 @@ def get_pycparser_fake_libc_path():
 
     return None
 
-# --- C Preprocessor (Modified to use fake_libc_include) ---
-def preprocess_c_code(c_code_string, c_compiler='gcc', include_paths=None):
+_UNRESOLVED = object()
+_fake_libc_path = _UNRESOLVED
+
+
+def _fake_libc_persist_key():
+    # The persisted path is only valid for the same pycparser install and env override
+    spec = importlib.util.find_spec('pycparser')
+    return {'pycparser': spec.origin if spec else None,
+            'env': os.environ.get('PYCPARSER_FAKE_LIBC_PATH')}
+
+
+def get_pycparser_fake_libc_path(persist_file=None):
     """
-    Preprocesses C code using a C compiler (like gcc -E)
-    and pycparser's fake_libc_include to handle common std types.
-    include_paths is a list of additional include directories.
+    Returns pycparser's fake_libc_include directory (or None), running the
+    discovery only once per process. With persist_file, the result is also
+    stored in that small JSON file and reused by later runs as long as the
+    pycparser installation and PYCPARSER_FAKE_LIBC_PATH are unchanged.
     """
-    fake_libc_path = get_pycparser_fake_libc_path()
-    # if not fake_libc_path: # Allow to proceed, but parsing will likely fail for stdlib
-    #     print("CRITICAL WARNING: pycparser's fake_libc_include directory not found.")
+    global _fake_libc_path
+    if _fake_libc_path is not _UNRESOLVED:
+        return _fake_libc_path
+
+    key = _fake_libc_persist_key() if persist_file else None
+    if persist_file:
+        try:
+            with open(persist_file, "r", encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('key') == key and saved.get('path') and os.path.isdir(saved['path']):
+                _fake_libc_path = saved['path']
+                return _fake_libc_path
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    _fake_libc_path = _discover_fake_libc_path()
+    if persist_file and _fake_libc_path:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(persist_file)), exist_ok=True)
+            _write_text(persist_file, json.dumps({'key': key, 'path': _fake_libc_path}))
+        except OSError as e:
+            print(f"WARNING: Could not save fake_libc_include location to {persist_file}: {e}")
+    return _fake_libc_path
+
+
+def set_pycparser_fake_libc_path(path):
+    """Sets the fake_libc_include directory for this process, skipping discovery (e.g. in pool workers)."""
+    global _fake_libc_path
+    _fake_libc_path = path
+
+
+# --- C Preprocessor (Modified to use fake_libc_include) ---
+# Time limits in seconds for the external programs, so a pathological input cannot hang a run
+DEFAULT_PREPROCESS_TIMEOUT = 60
+DEFAULT_RENDER_TIMEOUT = 120
+DEFAULT_FILE_TIMEOUT = 300 # Whole pipeline of one file in batch mode
+
+
+class StageTimeout(RuntimeError):
+    """The preprocessor or Graphviz ran longer than its time limit (and was killed)."""
 
-    temp_c_file_name = None # Ensure it's defined for the finally block
-    try:
-        # Create a temporary file in the current directory to handle relative includes if any
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.c', dir='.') as tmp_c_file:
-            tmp_c_file.write(c_code_string)
-            temp_c_file_name = tmp_c_file.name # Get full path
 
-        cmd = [c_compiler, '-E']
+class PreprocessError(RuntimeError):
+    """`<compiler> -E` failed; stderr keeps its diagnostics apart from the full report in the message."""
+    def __init__(self, message, stderr=''):
+        super().__init__(message)
+        self.stderr = stderr
+
+
+class Preprocessor:
+    """
+    Runs `<compiler> -E` with pycparser's fake_libc_include to handle common std types.
+    The command line is built once; each call feeds the source on stdin
+    (no temporary file), so per-file overhead is just the compiler run.
+    A run longer than `timeout` seconds is killed and raises StageTimeout.
+    """
+    def __init__(self, c_compiler='gcc', include_paths=None, timeout=DEFAULT_PREPROCESS_TIMEOUT):
+        self.c_compiler = c_compiler
+        self.timeout = timeout or None
+        fake_libc_path = get_pycparser_fake_libc_path()
+        # if not fake_libc_path: # Allow to proceed, but parsing will likely fail for stdlib
+        #     print("CRITICAL WARNING: pycparser's fake_libc_include directory not found.")
+
+        cmd = [c_compiler, '-E', '-x', 'c']
         if fake_libc_path:
             cmd.append(f'-I{fake_libc_path}')
             # Using -nostdinc can be too aggressive if the code truly needs
@@ -156,106 +219,669 @@ def preprocess_c_code(c_code_string, c_compiler='gcc', include_paths=None):
             for path in include_paths:
                 cmd.append(f'-I{os.path.abspath(path)}') # Ensure absolute paths for includes
 
-        # Add the directory of the temporary C file itself to include paths
-        # This helps if the original C code had relative includes like #include "myheader.h"
-        # and was passed as a string. If reading from a file, the original file's dir is better.
-        # For string input, we assume includes are relative to where c2flow.py is run or provided via -I.
-        cmd.append(f'-I{os.path.dirname(temp_c_file_name)}')
-
+        # Source read from stdin has no directory of its own, so relative includes
+        # like #include "myheader.h" are resolved against where c2flow.py is run
+        # (as they were when the source went through a temporary file there).
+        # If reading from a file, pass the original file's dir with -I.
+        cmd.append(f'-I{os.getcwd()}')
+        cmd.append('-') # Read the source from stdin
+        self.cmd = cmd
 
-        cmd.append(temp_c_file_name) # The file to preprocess
-
-        # print(f"DEBUG: Preprocessor command: {' '.join(cmd)}") # Uncomment for debugging
-
-        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8')
+    def __call__(self, c_code_string):
+        # print(f"DEBUG: Preprocessor command: {' '.join(self.cmd)}") # Uncomment for debugging
+        try:
+            result = subprocess.run(self.cmd, input=c_code_string, capture_output=True, text=True, encoding='utf-8',
+                                    timeout=self.timeout)
+        except FileNotFoundError:
+            print(f"Error: C compiler '{self.c_compiler}' not found. Ensure it's installed and in PATH.")
+            raise
+        except subprocess.TimeoutExpired:
+            raise StageTimeout(f"'{self.c_compiler} -E' did not finish within {self.timeout}s") from None
 
         if result.returncode != 0:
             error_message = (
                 f"Error during preprocessing (return code {result.returncode}):\n"
-                f"Command: {' '.join(cmd)}\n"
+                f"Command: {' '.join(self.cmd)}\n"
                 f"Stderr:\n{result.stderr}\n"
                 f"Stdout:\n{result.stdout}"
             )
-            raise RuntimeError(error_message)
+            raise PreprocessError(error_message, result.stderr)
         return result.stdout
 
+
+def _import_cpreprocessor():
+    import cpreprocessor # Sibling module, only loaded for the builtin backend
+    return cpreprocessor
+
+
+# 'compiler' runs `<compiler> -E`; 'builtin' is the in-process cpreprocessor.py,
+# which needs no compiler and avoids a process spawn per file.
+PREPROCESSOR_BACKENDS = ('compiler', 'builtin')
+
+_preprocessors = {}
+
+def get_preprocessor(c_compiler='gcc', include_paths=None, backend='compiler', timeout=DEFAULT_PREPROCESS_TIMEOUT):
+    """
+    Returns a preprocessor callable for these settings, reused across calls in this process.
+    A run longer than timeout seconds is stopped (the compiler is killed).
+    """
+    key = (backend, c_compiler, tuple(include_paths or ()), os.getcwd(), timeout)
+    preprocessor = _preprocessors.get(key)
+    if preprocessor is None:
+        if backend == 'builtin':
+            # Same search order as the compiler command line: fake_libc, user paths, working directory
+            fake_libc_path = get_pycparser_fake_libc_path()
+            search_paths = ([fake_libc_path] if fake_libc_path else []) + list(include_paths or []) + [os.getcwd()]
+            preprocessor = _import_cpreprocessor().BuiltinPreprocessor(search_paths, timeout=timeout)
+        elif backend == 'compiler':
+            preprocessor = Preprocessor(c_compiler, include_paths, timeout)
+        else:
+            raise ValueError(f"Unknown preprocessor backend '{backend}', expected one of {PREPROCESSOR_BACKENDS}")
+        _preprocessors[key] = preprocessor
+    return preprocessor
+
+
+def preprocess_c_code(c_code_string, c_compiler='gcc', include_paths=None, backend='compiler',
+                      timeout=DEFAULT_PREPROCESS_TIMEOUT):
+    """
+    Preprocesses C code using a C compiler (like gcc -E), or the builtin
+    preprocessor with backend='builtin', and pycparser's fake_libc_include
+    to handle common std types.
+    include_paths is a list of additional include directories.
+    """
+    timeout_errors = (_import_cpreprocessor().PreprocessorTimeout,) if backend == 'builtin' else ()
+    try:
+        return get_preprocessor(c_compiler, include_paths, backend, timeout)(c_code_string)
     except FileNotFoundError:
-        print(f"Error: C compiler '{c_compiler}' not found. Ensure it's installed and in PATH.")
         raise
+    except timeout_errors as e: # Reported like a compiler that was killed
+        raise StageTimeout(str(e)) from None
     except Exception as e:
         print(f"An unexpected error occurred during preprocessing: {e}")
         raise
-    finally:
-        if temp_c_file_name and os.path.exists(temp_c_file_name):
-            os.remove(temp_c_file_name)
+
+
+# --- Content-addressed cache for preprocessed C and parsed ASTs ---
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'c2flow')
+DEFAULT_CACHE_MAX_MB = 256
+CACHE_FORMAT_VERSION = 1
+FAKE_LIBC_PERSIST_FILE = 'fake_libc_path.json' # Stored inside the cache directory
+
+# gcc/clang linemarkers: '# 12 "path/to/file.h" 1'
+_LINEMARKER_RE = re.compile(r'^#\s*(?:line\s+)?\d+\s+"((?:[^"\\]|\\.)*)"', re.MULTILINE)
+
+
+def find_included_files(preprocessed_code):
+    """
+    Returns the sorted absolute paths of the headers the preprocessor read,
+    taken from the linemarkers in its output. The first linemarker names the
+    main file, which is skipped (the source is fed on stdin and is hashed as text).
+    """
+    names = _LINEMARKER_RE.findall(preprocessed_code)
+    files = set()
+    for name in set(names[1:]):
+        if name.startswith('<') or name == names[0]: # <built-in>, <command-line>, <stdin>
+            continue
+        files.add(os.path.abspath(name.replace('\\\\', '\\')))
+    return sorted(files)
+
+
+class FlowchartCache:
+    """
+    On-disk cache of preprocessed C text and parsed FileASTs.
+
+    Lookups work in two steps (like ccache's direct mode): a hash of the source
+    text, compiler and include search path (including the working directory) names a small JSON manifest listing the
+    headers the preprocessor read last time; the entry itself is keyed by that
+    hash plus the current contents of those headers, so editing a header
+    invalidates it. Entries are pickles, so only point cache_dir at a directory
+    you own. Least recently used entries are evicted past max_mb.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_mb=DEFAULT_CACHE_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._header_digests = {} # (path, mtime_ns, size) -> sha256, per process
+        self._size_estimate = None
+
+    def _input_key(self, c_code, c_compiler, include_paths, backend):
+        h = hashlib.sha256()
+        if backend == 'builtin':
+            compiler_path, compiler_stamp = 'builtin', _import_cpreprocessor().__version__
+        else:
+            compiler_path = shutil.which(c_compiler) or c_compiler
+            try:
+                compiler_stamp = os.stat(compiler_path).st_mtime_ns
+            except OSError:
+                compiler_stamp = 0
+        h.update(f"v{CACHE_FORMAT_VERSION}\0pycparser {_import_pycparser().__version__}\0".encode())
+        h.update(f"{compiler_path}\0{compiler_stamp}\0".encode())
+        # The whole include search: fake_libc, the include paths, and the working directory
+        # that both backends search last (quote includes from stdin resolve against it)
+        fake_libc_path = get_pycparser_fake_libc_path()
+        for path in ([fake_libc_path] if fake_libc_path else []) + list(include_paths or []) + [os.getcwd()]:
+            h.update(os.path.abspath(path).encode('utf-8', 'surrogateescape') + b'\0')
+        h.update(b'\0' + c_code.encode('utf-8', 'surrogateescape'))
+        return h.hexdigest()
+
+    def _header_digest(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stamp = (path, st.st_mtime_ns, st.st_size)
+        digest = self._header_digests.get(stamp)
+        if digest is None:
+            with open(path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            self._header_digests[stamp] = digest
+        return digest
+
+    def _entry_key(self, input_key, headers):
+        h = hashlib.sha256(input_key.encode())
+        for path in headers:
+            digest = self._header_digest(path)
+            if digest is None: # A header disappeared, the entry cannot be trusted
+                return None
+            h.update(f"\0{path}\0{digest}".encode('utf-8', 'surrogateescape'))
+        return h.hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.cache_dir, key[:2], key + ext)
+
+    def lookup(self, c_code, c_compiler='gcc', include_paths=None, backend='compiler'):
+        """Returns (preprocessed_code, ast) for a hit, or None."""
+        input_key = self._input_key(c_code, c_compiler, include_paths, backend)
+        manifest_path = self._path(input_key, '.json')
+        try:
+            with open(manifest_path, "r", encoding='utf-8') as f:
+                headers = json.load(f)['headers']
+            entry_key = self._entry_key(input_key, headers)
+            if entry_key is None:
+                return None
+            entry_path = self._path(entry_key, '.pkl')
+            with open(entry_path, 'rb') as f:
+                preprocessed_code, ast = pickle.load(f)
+        except (OSError, ValueError, KeyError, EOFError, pickle.UnpicklingError):
+            return None
+        # Mark as recently used for LRU eviction
+        for path in (manifest_path, entry_path):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return preprocessed_code, ast
+
+    def store(self, c_code, c_compiler, include_paths, preprocessed_code, ast, backend='compiler'):
+        """Stores a successful preprocess+parse result. Failures to cache are not errors."""
+        input_key = self._input_key(c_code, c_compiler, include_paths, backend)
+        headers = find_included_files(preprocessed_code)
+        entry_key = self._entry_key(input_key, headers)
+        if entry_key is None:
+            return False
+        try:
+            entry = pickle.dumps((preprocessed_code, ast), protocol=pickle.HIGHEST_PROTOCOL)
+        except (RecursionError, pickle.PicklingError, TypeError):
+            return False # Extremely deep ASTs are simply not cached
+        manifest = json.dumps({'headers': headers}).encode('utf-8')
+        written = 0
+        try:
+            for path, data in ((self._path(entry_key, '.pkl'), entry),
+                               (self._path(input_key, '.json'), manifest)):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path) # Atomic, so concurrent workers never see partial files
+                written += len(data)
+        except OSError as e:
+            print(f"WARNING: Could not write cache entry in {self.cache_dir}: {e}")
+            return False
+        self._account(written)
+        return True
+
+    def _entries(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _account(self, added_bytes):
+        # The directory is scanned once per process; afterwards the size is tracked incrementally
+        if self._size_estimate is None:
+            self._size_estimate = sum(size for _, size, _ in self._entries())
+        else:
+            self._size_estimate += added_bytes
+        if self._size_estimate > self.max_bytes:
+            self.evict()
+
+    def evict(self, target_bytes=None):
+        """Deletes least recently used files until the cache fits in target_bytes (default 90% of max)."""
+        if target_bytes is None:
+            target_bytes = int(self.max_bytes * 0.9)
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= target_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._size_estimate = total
+
+    def clear(self):
+        self.evict(target_bytes=0)
 
 
 # --- AST Visitor for Flowchart Generation (Same as refined version) ---
-class FlowchartVisitor(c_ast.NodeVisitor):
-    def __init__(self):
-        self.dot = Digraph(comment='C Code Flowchart', strict=True)
-        self.dot.attr(rankdir='TB')
-        self.node_count = 0
-        self.c_gen = c_generator.CGenerator()
-        self.current_block_end_node = None
-        self.loop_stack = [] # {'type': 'while/for', 'start_cond': node, 'inc_node': node_or_None, 'end_node': node}
+# Node types that never become flowchart nodes themselves; their children are still visited.
+_PASSTHROUGH_NODE_TYPES = frozenset((
+    'EmptyStatement',
+    'Typename', 'TypeDecl', 'IdentifierType',
+    'PtrDecl', 'ArrayDecl', 'FuncDecl',
+    'Constant', 'ID', 'BinaryOp', 'ExprList',
+))
+_STATEMENT_NODE_TYPES = frozenset(('Assignment', 'Decl', 'FuncCall'))
 
-    def _new_node_name(self):
-        name = f'node{self.node_count}'
-        self.node_count += 1
-        return name
 
-    def _add_node(self, label, shape='box', **kwargs):
-        name = self._new_node_name()
-        sane_label = str(label).replace('"', '\\"').replace('\n', '\\n')
-        self.dot.node(name, label=sane_label, shape=shape, **kwargs)
-        return name
+# --- Statement labels ---
+DEFAULT_MAX_LABEL_LENGTH = 0 # Longer labels are cut to this many characters ending in "..."; 0 keeps them whole
 
-    def _add_edge(self, src, dest, label=None, **kwargs):
-        if src and dest:
-            sane_label = str(label).replace('"', '\\"').replace('\n', '\\n') if label else None
-            self.dot.edge(src, dest, label=sane_label, **kwargs)
+# Nodes CGenerator never parenthesizes as operands
+_SIMPLE_EXPR_TYPES = frozenset(('Constant', 'ID', 'ArrayRef', 'StructRef', 'FuncCall'))
 
-    def _generate_stmt_label(self, node):
+
+class LabelRenderer:
+    """
+    Renders the flowchart label of a statement or expression: the C that
+    pycparser's CGenerator would print for it, without ';', cut to
+    max_length characters. The expression forms that make up almost all
+    labels are rendered in one direct pass (the rest go through CGenerator),
+    and finished labels are memoized by their text, so repeated statements
+    (i++, break, x = 0, ...) share one interned string. Declarations, the
+    one common label CGenerator is slow at, are looked up by a structural
+    key of their declarator (see _declarator_key) before rendering.
+    """
+    def __init__(self, max_length=DEFAULT_MAX_LABEL_LENGTH):
+        self.max_length = max_length
+        self.c_gen = _import_pycparser().c_generator.CGenerator()
+        self._labels = {}
+        self._declarators = {}
+        self._method_cache = {}
+
+    def clear(self):
+        """Forgets the memoized labels, e.g. once the graph holding them has been written out."""
+        self._labels.clear()
+        self._declarators.clear()
+
+    def label(self, node):
         try:
-            return self.c_gen.visit(node).replace(';', '').strip()
+            text = self._visit(node)
         except Exception:
             return f"<{type(node).__name__} (gen_error)>"
+        label = self._labels.get(text)
+        if label is None:
+            label = text.replace(';', '').strip() if ';' in text else text.strip()
+            if self.max_length and len(label) > self.max_length:
+                label = label[:max(self.max_length - 3, 1)] + "..."
+            label = self._labels[text] = sys.intern(label)
+        return label
+
+    def _visit(self, node):
+        if node is None:
+            return ''
+        method = self._method_cache.get(node.__class__)
+        if method is None:
+            method = getattr(self, '_visit_' + node.__class__.__name__, self.c_gen.visit)
+            self._method_cache[node.__class__] = method
+        return method(node)
+
+    def _visit_expr(self, node):
+        node_type = node.__class__.__name__
+        if node_type == 'InitList':
+            return '{' + self._visit(node) + '}'
+        if node_type in ('ExprList', 'Compound'):
+            return '(' + self._visit(node) + ')'
+        return self._visit(node)
+
+    def _operand(self, node):
+        text = self._visit_expr(node)
+        return text if node.__class__.__name__ in _SIMPLE_EXPR_TYPES else '(' + text + ')'
+
+    def _visit_Constant(self, node):
+        return node.value
+
+    def _visit_ID(self, node):
+        return node.name
+
+    def _visit_ArrayRef(self, node):
+        return self._operand(node.name) + '[' + self._visit(node.subscript) + ']'
+
+    def _visit_StructRef(self, node):
+        return self._operand(node.name) + node.type + self._visit(node.field)
+
+    def _visit_FuncCall(self, node):
+        return self._operand(node.name) + '(' + self._visit(node.args) + ')'
+
+    def _visit_UnaryOp(self, node):
+        if node.op == 'sizeof':
+            return 'sizeof(' + self._visit(node.expr) + ')'
+        operand = self._operand(node.expr)
+        if node.op == 'p++':
+            return operand + '++'
+        if node.op == 'p--':
+            return operand + '--'
+        return node.op + operand
+
+    def _visit_BinaryOp(self, node):
+        return self._operand(node.left) + ' ' + node.op + ' ' + self._operand(node.right)
+
+    def _visit_Assignment(self, node):
+        rvalue = self._visit_expr(node.rvalue)
+        if node.rvalue.__class__.__name__ == 'Assignment':
+            rvalue = '(' + rvalue + ')'
+        return self._visit(node.lvalue) + ' ' + node.op + ' ' + rvalue
+
+    def _visit_ExprList(self, node):
+        return ', '.join(self._visit_expr(expr) for expr in node.exprs)
+
+    def _visit_TernaryOp(self, node):
+        return ('(' + self._visit_expr(node.cond) + ') ? (' + self._visit_expr(node.iftrue)
+                + ') : (' + self._visit_expr(node.iffalse) + ')')
+
+    def _visit_Return(self, node):
+        return 'return ' + self._visit(node.expr) if node.expr else 'return'
+
+    def _visit_Decl(self, node):
+        key = self._declarator_key(node)
+        if key is None:
+            return self.c_gen.visit(node)
+        text = self._declarators.get(key)
+        if text is None:
+            declarator = copy.copy(node)
+            declarator.init = None
+            text = self._declarators[key] = self.c_gen.visit(declarator)
+        return text + ' = ' + self._visit_expr(node.init) if node.init else text
+
+    @staticmethod
+    def _declarator_key(node):
+        # The fields CGenerator prints of a declaration but its initializer, for plain
+        # declarations ('static const unsigned *p'); None for anything else
+        if node.bitsize or getattr(node, 'align', None):
+            return None
+        key = [node.name, tuple(node.quals), tuple(node.storage), tuple(node.funcspec)]
+        decl_type = node.type
+        while True:
+            type_name = decl_type.__class__.__name__
+            if type_name == 'PtrDecl':
+                key.append(('*',) + tuple(decl_type.quals))
+            elif type_name == 'TypeDecl' and not getattr(decl_type, 'align', None):
+                key.append((decl_type.declname,) + tuple(decl_type.quals))
+            elif type_name == 'IdentifierType':
+                key.append(tuple(decl_type.names))
+                return tuple(key)
+            else: # Arrays, function pointers, struct types, ...
+                return None
+            decl_type = decl_type.type
+
+
+# DOT presentation of the CFG node and edge kinds
+_DOT_NODE_ATTRS = {
+    controlflow.START: {'shape': 'ellipse'},
+    controlflow.END: {'shape': 'ellipse'},
+    controlflow.FUNCTION: {'shape': 'box', 'style': 'filled', 'fillcolor': 'lightgrey'},
+    controlflow.MAIN: {'shape': 'Mdiamond', 'style': '', 'fillcolor': ''},
+    controlflow.STATEMENT: {'shape': 'box', 'style': 'rounded'},
+    controlflow.DECL: {'shape': 'note', 'style': ''},
+    controlflow.CONDITION: {'shape': 'diamond'},
+    controlflow.STEP: {'shape': 'box'},
+    controlflow.MERGE: {'shape': 'point', 'width': '0.01', 'height': '0.01'},
+    controlflow.CASE: {'shape': 'box', 'style': 'filled', 'fillcolor': 'lightyellow'},
+    controlflow.LABEL: {'shape': 'box', 'style': 'dashed'},
+    controlflow.RETURN: {'shape': 'parallelogram', 'style': 'filled', 'fillcolor': 'lightblue'},
+    controlflow.BREAK: {'shape': 'box', 'style': 'filled', 'fillcolor': 'orange'},
+    controlflow.CONTINUE: {'shape': 'box', 'style': 'filled', 'fillcolor': 'yellow'},
+    controlflow.GOTO: {'shape': 'box', 'style': 'filled', 'fillcolor': 'plum'},
+}
+_DOT_EDGE_STYLES = (
+    (None, {}),                                     # EDGE_FLOW
+    ('True', {}),                                   # EDGE_TRUE
+    ('False', {}),                                  # EDGE_FALSE
+    ('Loop', {}),                                   # EDGE_LOOP
+    ('to loop exit', {'style': 'dashed'}),          # EDGE_BREAK
+    ('to loop inc/cond', {'style': 'dashed'}),      # EDGE_CONTINUE
+    (None, {}),                                     # EDGE_CASE
+    ('goto', {'style': 'dashed'}),                  # EDGE_GOTO
+)
+# The same as hashable (name, value) pairs, the form the DOT writer caches on
+_DOT_NODE_ATTR_ITEMS = {kind: tuple(attrs.items()) for kind, attrs in _DOT_NODE_ATTRS.items()}
+_DOT_EDGE_STYLE_ITEMS = tuple((label, tuple(attrs.items())) for label, attrs in _DOT_EDGE_STYLES)
+_DOT_CONNECTOR_ATTRS = (('shape', 'invhouse'), ('style', 'dashed')), (('shape', 'house'), ('style', 'dashed'))
+
+
+def _dot_escape(label):
+    return label.replace('"', '\\"').replace('\n', '\\n')
+
+
+@functools.lru_cache(maxsize=65536)
+def _dot_label(label):
+    # 'label=...' as graphviz.Digraph writes it; labels repeat a lot, so each is escaped and quoted once
+    return 'label=' + _import_graphviz().quoting.quote(_dot_escape(label))
+
+
+@functools.lru_cache(maxsize=None)
+def _dot_attr_text(attrs):
+    # attrs is a tuple of (name, value) pairs; sorted like graphviz.Digraph
+    quote = _import_graphviz().quoting.quote
+    return ' '.join(f'{quote(name)}={quote(value)}' for name, value in sorted(attrs))
+
+
+def _dot_attr_list(label, attrs):
+    parts = [_dot_label(label)] if label is not None else []
+    if attrs:
+        parts.append(_dot_attr_text(attrs))
+    return f" [{' '.join(parts)}]" if parts else ''
+
+
+def _dot_statements(first_id, nodes, edges, lo=0, hi=None, part_size=None):
+    """
+    Yields the DOT statements (as graphviz.Digraph writes them) of the nodes
+    lo..hi-1 (all of them when hi is None) out of nodes, which holds node ids
+    first_id on, followed by those of the edges touching that range.
+    Edges leaving or entering the range become off-page connector nodes
+    ("Continued in part N" / "From part N", where part N holds the node ids
+    from (N-1)*part_size on).
+    """
+    start = max(lo, first_id)
+    for node_id, node in enumerate(nodes[start - first_id:None if hi is None else hi - first_id], start):
+        yield f"\tnode{node_id}{_dot_attr_list(node.label, _DOT_NODE_ATTR_ITEMS[node.kind])}\n"
+
+    part_size = part_size or 1
+    connectors = set()
+    for src, dst, kind, label in edges:
+        src_inside = lo <= src and (hi is None or src < hi)
+        dst_inside = lo <= dst and (hi is None or dst < hi)
+        if not (src_inside or dst_inside):
+            continue
+        default_label, attrs = _DOT_EDGE_STYLE_ITEMS[kind]
+        label = label or default_label
+        src_name, dst_name = f'node{src}', f'node{dst}'
+        if not dst_inside:
+            dst_name = f'node{dst}_to'
+            if dst_name not in connectors:
+                connectors.add(dst_name)
+                yield f"\t{dst_name}{_dot_attr_list(f'Continued in part {dst // part_size + 1}', _DOT_CONNECTOR_ATTRS[0])}\n"
+        elif not src_inside:
+            src_name = f'node{src}_from'
+            if src_name not in connectors:
+                connectors.add(src_name)
+                yield f"\t{src_name}{_dot_attr_list(f'From part {src // part_size + 1}', _DOT_CONNECTOR_ATTRS[1])}\n"
+        yield f"\t{src_name} -> {dst_name}{_dot_attr_list(label, attrs)}\n"
+
+
+def cfg_to_digraph(cfg, lo=0, hi=None, part_size=None, edges=None):
+    """
+    DOT back end: builds a graphviz.Digraph from a ControlFlowGraph, or from
+    the nodes lo..hi-1 of it, with off-page connectors to the other parts
+    (see _dot_statements). edges, when given, are the cfg.edges() touching
+    that range; by default all of them are scanned.
+    """
+    Digraph = _import_graphviz().Digraph
+    dot = Digraph(comment='C Code Flowchart', strict=True)
+    dot.attr(rankdir='TB')
+    hi = len(cfg) if hi is None else hi
+    edges = cfg.edges() if edges is None else edges
+    dot.body.extend(_dot_statements(cfg.first_id, cfg.nodes, edges, lo, hi, part_size or (hi - lo)))
+    return dot
+
+
+def cfg_to_digraphs(cfg, max_nodes):
+    """
+    Splits a ControlFlowGraph into parts of at most max_nodes nodes (see
+    ControlFlowGraph.split_ranges) and returns the cfg_to_digraph of each.
+    The edges are bucketed by the parts they touch in one pass, so every part
+    only goes through its own edges.
+    """
+    ranges = cfg.split_ranges(max_nodes)
+    if len(ranges) == 1:
+        return [cfg_to_digraph(cfg, *ranges[0], max_nodes)]
+    first_id = cfg.first_id
+    buckets = [[] for _ in ranges]
+    for edge in cfg.edges():
+        src_part = (edge[0] - first_id) // max_nodes
+        dst_part = (edge[1] - first_id) // max_nodes
+        buckets[src_part].append(edge)
+        if dst_part != src_part:
+            buckets[dst_part].append(edge)
+    return [cfg_to_digraph(cfg, lo, hi, max_nodes, edges) for (lo, hi), edges in zip(ranges, buckets)]
+
+
+class FlowchartVisitor:
+    """
+    Walks a pycparser AST and records the flowchart as a compact
+    controlflow.ControlFlowGraph in `cfg`; `dot` renders it as a
+    graphviz.Digraph. Dispatch works like pycparser's c_ast.NodeVisitor
+    (visit_<ClassName>, falling back to generic_visit) but is keyed on class
+    names, so this module does not need pycparser at import time.
+    With a sink, what was recorded is drained from `cfg` and passed to
+    sink((first_id, nodes, edges)) after each function and at the end.
+    Labels come from label_renderer (a LabelRenderer), which can be shared
+    between visitors so its memo carries over.
+    """
+    def __init__(self, sink=None, label_renderer=None):
+        self.cfg = controlflow.ControlFlowGraph()
+        self.sink = sink
+        self.label_renderer = label_renderer or LabelRenderer()
+        self.current_block_end_node = None # Node id the next statement is chained from, or None when unreachable
+        # Innermost-last break/continue targets:
+        # {'type': 'while/do/for/switch', 'start_cond': node, 'inc_node': node_or_None, 'end_node': node, 'reached': bool}
+        self.loop_stack = []
+        self.switch_stack = [] # The loop_stack entries of the enclosing switch statements, for case/default
+        self.chain_from = [] # Nodes the next function (or "End") is chained from
+        self.function_exits = [] # Return nodes of the current function
+        self.labels = {} # Label name -> node id, per function (goto may refer to a label before it is seen)
+        self.defined_labels = set()
+        self.line = 0 # Source line of the AST node being visited
+        self._method_cache = {}
+
+    def visit(self, node):
+        visitor = self._method_cache.get(node.__class__)
+        if visitor is None:
+            visitor = getattr(self, 'visit_' + node.__class__.__name__, self.generic_visit)
+            self._method_cache[node.__class__] = visitor
+        if node.coord is not None: # Nodes created from here on get this source line
+            self.line = node.coord.line
+        return visitor(node)
+
+    def _visit_children(self, node):
+        for child in node:
+            self.visit(child)
+
+    @property
+    def dot(self):
+        return cfg_to_digraph(self.cfg)
+
+    @property
+    def node_count(self):
+        return len(self.cfg)
+
+    def _add_node(self, label, kind=controlflow.STATEMENT):
+        return self.cfg.add_node(kind, label, self.line)
+
+    def _add_edge(self, src, dest, kind=controlflow.EDGE_FLOW, label=None):
+        # Node ids start at 0, so test for None rather than truthiness. Returns whether the edge was added.
+        if src is not None and dest is not None:
+            self.cfg.add_edge(src, dest, kind, label)
+            return True
+        return False
+
+    def _generate_stmt_label(self, node):
+        return self.label_renderer.label(node)
+
+    def _label_node(self, name):
+        node = self.labels.get(name)
+        if node is None:
+            node = self.labels[name] = self._add_node(f"{name}:", controlflow.LABEL)
+        return node
+
+    def _end_loop(self, loop_info, reached):
+        # Continue after the loop's exit node if anything reaches it (its condition or a break)
+        self.loop_stack.pop()
+        self.current_block_end_node = loop_info['end_node'] if reached or loop_info['reached'] else None
 
     def visit_FileAST(self, node):
-        start_node = self._add_node("Start", shape='ellipse')
-        self.current_block_end_node = start_node
+        start_node = self._add_node("Start", controlflow.START)
+        self.chain_from = [start_node]
         for ext in node.ext:
-            if isinstance(ext, c_ast.FuncDef): # Only process function definitions at top level for now
+            if ext.__class__.__name__ == 'FuncDef': # Only process function definitions at top level for now
                 self.visit(ext)
             # elif isinstance(ext, c_ast.Decl): # Handle global declarations if needed
             #     self.visit(ext) # May need specific handling or be ignored for flowchart
-        end_node = self._add_node("End", shape='ellipse')
-        if self.current_block_end_node != start_node : # If something was processed
-             self._add_edge(self.current_block_end_node, end_node)
+        end_node = self._add_node("End", controlflow.END)
+        if self.chain_from != [start_node]: # If something was processed
+            for exit_node in self.chain_from:
+                self._add_edge(exit_node, end_node)
         elif not node.ext: # If the C file was empty or only had non-function externals
             self._add_edge(start_node, end_node)
+        if self.sink:
+            self.sink(self.cfg.drain())
 
 
     def visit_FuncDef(self, node):
         func_name = node.decl.name
         func_entry_label = f"Function: {func_name}()"
-        shape = 'Mdiamond' if func_name == "main" else 'box'
-        style = 'filled' if func_name != "main" else ''
-        fillcolor = 'lightgrey' if func_name != "main" else ''
+        kind = controlflow.MAIN if func_name == "main" else controlflow.FUNCTION
 
-        func_entry_node = self._add_node(func_entry_label, shape=shape, style=style, fillcolor=fillcolor)
+        func_entry_node = self._add_node(func_entry_label, kind)
 
-        # Connect from previous node (e.g., "Start" or previous function's logical end)
-        # For simplicity, we'll assume a linear flow of functions from "Start"
+        # Connect from the previous function's exits (or "Start"):
+        # for simplicity functions are laid out as a linear flow.
         # More complex scenarios might involve call graphs.
-        if self.current_block_end_node:
-            self._add_edge(self.current_block_end_node, func_entry_node)
-        
+        for exit_node in self.chain_from:
+            self._add_edge(exit_node, func_entry_node)
+
         self.current_block_end_node = func_entry_node
+        self.function_exits = []
+        self.labels = {}
+        self.defined_labels = set()
         self.visit(node.body)
-        # After visiting the body, self.current_block_end_node is the logical end of this function.
-        # It will either connect to the next FuncDef or the main "End" node in visit_FileAST.
+        for name in sorted(self.labels.keys() - self.defined_labels):
+            print(f"Warning: goto to undefined label '{name}' in {func_name}().")
+        # The function's exits are its return nodes plus the end of its body, if reachable.
+        # They connect to the next FuncDef or the main "End" node in visit_FileAST.
+        if self.current_block_end_node is not None:
+            self.function_exits.append(self.current_block_end_node)
+        self.chain_from = self.function_exits
+        if self.sink:
+            self.sink(self.cfg.drain())
 
     def visit_Compound(self, node):
         # current_block_end_node is the node *before* this compound block.
@@ -266,43 +892,63 @@ class FlowchartVisitor(c_ast.NodeVisitor):
 
     def visit_If(self, node):
         cond_label = self._generate_stmt_label(node.cond)
-        if_node = self._add_node(f"If ({cond_label})", shape='diamond')
+        if_node = self._add_node(f"If ({cond_label})", controlflow.CONDITION)
         self._add_edge(self.current_block_end_node, if_node)
 
-        merge_node = self._add_node(" ", shape='point', width='0.01', height='0.01') # Invisible merge
+        merge_node = self._add_node(" ", controlflow.MERGE) # Invisible merge
 
         # True branch
         self.current_block_end_node = if_node
         self.visit(node.iftrue)
-        self._add_edge(self.current_block_end_node, merge_node, label="True")
+        reached = self._add_edge(self.current_block_end_node, merge_node, controlflow.EDGE_TRUE)
 
         if node.iffalse:
             self.current_block_end_node = if_node
             self.visit(node.iffalse)
-            self._add_edge(self.current_block_end_node, merge_node, label="False")
+            reached |= self._add_edge(self.current_block_end_node, merge_node, controlflow.EDGE_FALSE)
         else:
-            self._add_edge(if_node, merge_node, label="False") # No 'else', so 'false' from condition goes to merge
+            reached |= self._add_edge(if_node, merge_node, controlflow.EDGE_FALSE) # No 'else', so 'false' from condition goes to merge
 
-        self.current_block_end_node = merge_node
+        # When both branches jump away (return/break/continue/goto), what follows is unreachable
+        self.current_block_end_node = merge_node if reached else None
 
     def visit_While(self, node):
         entry_to_while_cond = self.current_block_end_node
 
         cond_label = self._generate_stmt_label(node.cond)
-        while_cond_node = self._add_node(f"While ({cond_label})", shape='diamond')
+        while_cond_node = self._add_node(f"While ({cond_label})", controlflow.CONDITION)
         self._add_edge(entry_to_while_cond, while_cond_node)
 
-        after_loop_node = self._new_node_name()
-        self.dot.node(after_loop_node, label="", shape='point', width='0.01', height='0.01')
-        self.loop_stack.append({'type': 'while', 'start_cond': while_cond_node, 'inc_node': None, 'end_node': after_loop_node})
+        after_loop_node = self._add_node("", controlflow.MERGE)
+        loop_info = {'type': 'while', 'start_cond': while_cond_node, 'inc_node': None, 'end_node': after_loop_node, 'reached': False}
+        self.loop_stack.append(loop_info)
 
         self.current_block_end_node = while_cond_node
         self.visit(node.stmt) # Loop body
-        self._add_edge(self.current_block_end_node, while_cond_node, label="Loop")
+        self._add_edge(self.current_block_end_node, while_cond_node, controlflow.EDGE_LOOP)
 
-        self._add_edge(while_cond_node, after_loop_node, label="False")
-        self.current_block_end_node = after_loop_node
-        self.loop_stack.pop()
+        self._add_edge(while_cond_node, after_loop_node, controlflow.EDGE_FALSE)
+        self._end_loop(loop_info, True)
+
+    def visit_DoWhile(self, node):
+        # The body runs first, so the back edge targets a merge node at the top of the loop.
+        # The condition and exit nodes are created up front as continue/break targets.
+        do_node = self._add_node("", controlflow.MERGE)
+        self._add_edge(self.current_block_end_node, do_node)
+
+        cond_label = self._generate_stmt_label(node.cond)
+        do_cond_node = self._add_node(f"While ({cond_label})", controlflow.CONDITION)
+        after_loop_node = self._add_node("", controlflow.MERGE)
+        loop_info = {'type': 'do', 'start_cond': do_cond_node, 'inc_node': None, 'end_node': after_loop_node, 'reached': False}
+        self.loop_stack.append(loop_info)
+
+        self.current_block_end_node = do_node
+        self.visit(node.stmt) # Loop body
+        self._add_edge(self.current_block_end_node, do_cond_node)
+
+        self._add_edge(do_cond_node, do_node, controlflow.EDGE_LOOP)
+        self._add_edge(do_cond_node, after_loop_node, controlflow.EDGE_FALSE)
+        self._end_loop(loop_info, True)
 
     def visit_For(self, node):
         entry_to_for = self.current_block_end_node
@@ -310,145 +956,889 @@ class FlowchartVisitor(c_ast.NodeVisitor):
 
         if node.init:
             init_label = self._generate_stmt_label(node.init)
-            for_init_node = self._add_node(init_label)
+            for_init_node = self._add_node(init_label, controlflow.STEP)
             self._add_edge(current_node_in_for, for_init_node)
             current_node_in_for = for_init_node
 
         cond_label = self._generate_stmt_label(node.cond) if node.cond else "True"
-        for_cond_node = self._add_node(f"For ({cond_label})", shape='diamond')
+        for_cond_node = self._add_node(f"For ({cond_label})", controlflow.CONDITION)
         self._add_edge(current_node_in_for, for_cond_node)
 
-        after_loop_node = self._new_node_name()
-        self.dot.node(after_loop_node, label="", shape='point', width='0.01', height='0.01')
+        after_loop_node = self._add_node("", controlflow.MERGE)
 
         for_inc_node_name = for_cond_node # Default target for continue/body-end if no 'next'
         if node.next:
             inc_label = self._generate_stmt_label(node.next)
-            for_inc_node_name = self._add_node(inc_label)
+            for_inc_node_name = self._add_node(inc_label, controlflow.STEP)
             self._add_edge(for_inc_node_name, for_cond_node) # Increment back to condition
 
-        self.loop_stack.append({'type': 'for', 'start_cond': for_cond_node, 'inc_node': for_inc_node_name, 'end_node': after_loop_node})
+        loop_info = {'type': 'for', 'start_cond': for_cond_node, 'inc_node': for_inc_node_name, 'end_node': after_loop_node, 'reached': False}
+        self.loop_stack.append(loop_info)
 
         self.current_block_end_node = for_cond_node # Body starts after condition is true
         self.visit(node.stmt) # Loop body
         self._add_edge(self.current_block_end_node, for_inc_node_name) # End of body to increment/condition
 
-        self._add_edge(for_cond_node, after_loop_node, label="False")
-        self.current_block_end_node = after_loop_node
-        self.loop_stack.pop()
+        # for (;;) only exits through break
+        if node.cond:
+            self._add_edge(for_cond_node, after_loop_node, controlflow.EDGE_FALSE)
+        self._end_loop(loop_info, bool(node.cond))
+
+    def visit_Switch(self, node):
+        cond_label = self._generate_stmt_label(node.cond)
+        switch_node = self._add_node(f"Switch ({cond_label})", controlflow.CONDITION)
+        self._add_edge(self.current_block_end_node, switch_node)
+
+        after_switch_node = self._add_node("", controlflow.MERGE)
+        switch_info = {'type': 'switch', 'start_cond': switch_node, 'inc_node': None, 'end_node': after_switch_node,
+                       'reached': False, 'has_default': False}
+        self.loop_stack.append(switch_info)
+        self.switch_stack.append(switch_info)
+
+        # Each case/default is entered from the switch node (see visit_Case); code before the first one never runs
+        self.current_block_end_node = None
+        self.visit(node.stmt)
+        reached = self._add_edge(self.current_block_end_node, after_switch_node) # Last case falls out of the switch
+        if not switch_info['has_default']:
+            reached |= self._add_edge(switch_node, after_switch_node, controlflow.EDGE_CASE, "no match")
+
+        self.switch_stack.pop()
+        self._end_loop(switch_info, reached)
+
+    def _visit_case(self, label, stmts):
+        case_node = self._add_node(label, controlflow.CASE)
+        self._add_edge(self.current_block_end_node, case_node) # Fallthrough from the previous case
+        if self.switch_stack:
+            self._add_edge(self.switch_stack[-1]['start_cond'], case_node, controlflow.EDGE_CASE)
+        else:
+            print(f"Warning: {label} outside switch.")
+        self.current_block_end_node = case_node
+        for stmt in stmts or ():
+            self.visit(stmt)
+
+    def visit_Case(self, node):
+        self._visit_case(f"Case {self._generate_stmt_label(node.expr)}", node.stmts)
+
+    def visit_Default(self, node):
+        if self.switch_stack:
+            self.switch_stack[-1]['has_default'] = True
+        self._visit_case("Default", node.stmts)
+
+    def visit_Label(self, node):
+        label_node = self._label_node(node.name)
+        self.defined_labels.add(node.name)
+        self._add_edge(self.current_block_end_node, label_node)
+        self.current_block_end_node = label_node
+        self.visit(node.stmt)
+
+    def visit_Goto(self, node):
+        goto_node = self._add_node(f"Goto {node.name}", controlflow.GOTO)
+        self._add_edge(self.current_block_end_node, goto_node)
+        self._add_edge(goto_node, self._label_node(node.name), controlflow.EDGE_GOTO)
+        self.current_block_end_node = None # Jumps away; what follows is only reachable through a label
 
     def visit_Return(self, node):
         label = "Return"
         if node.expr:
             label += " " + self._generate_stmt_label(node.expr)
-        ret_node = self._add_node(label, shape='parallelogram', style='filled', fillcolor='lightblue')
+        ret_node = self._add_node(label, controlflow.RETURN)
         self._add_edge(self.current_block_end_node, ret_node)
-        self.current_block_end_node = ret_node
+        self.function_exits.append(ret_node)
+        self.current_block_end_node = None # Path ends here; the return is one of the function's exits
 
     def visit_Break(self, node):
-        break_node = self._add_node("Break", shape='box', style='filled', fillcolor='orange')
+        break_node = self._add_node("Break", controlflow.BREAK)
         self._add_edge(self.current_block_end_node, break_node)
         if self.loop_stack:
-            self._add_edge(break_node, self.loop_stack[-1]['end_node'], style='dashed', label='to loop exit')
+            self._add_edge(break_node, self.loop_stack[-1]['end_node'], controlflow.EDGE_BREAK)
+            self.loop_stack[-1]['reached'] = True
         else:
             print("Warning: Break outside loop.")
-        self.current_block_end_node = break_node # Path effectively ends here for this block
+        self.current_block_end_node = None # Path ends here for this block
 
     def visit_Continue(self, node):
-        continue_node = self._add_node("Continue", shape='box', style='filled', fillcolor='yellow')
+        continue_node = self._add_node("Continue", controlflow.CONTINUE)
         self._add_edge(self.current_block_end_node, continue_node)
-        if self.loop_stack:
-            loop_info = self.loop_stack[-1]
-            target_node = loop_info.get('inc_node') or loop_info['start_cond'] # For->inc, While->cond
-            self._add_edge(continue_node, target_node, style='dashed', label='to loop inc/cond')
+        loops = [loop_info for loop_info in self.loop_stack if loop_info['type'] != 'switch']
+        if loops:
+            loop_info = loops[-1]
+            target_node = loop_info['inc_node'] if loop_info['inc_node'] is not None else loop_info['start_cond'] # For->inc, While->cond
+            self._add_edge(continue_node, target_node, controlflow.EDGE_CONTINUE)
         else:
             print("Warning: Continue outside loop.")
-        self.current_block_end_node = continue_node # Path effectively ends here for this iteration
+        self.current_block_end_node = None # Path ends here for this iteration
 
     def generic_visit(self, node):
-        ignored_types = (
-            c_ast.Label, c_ast.Case, c_ast.Default, c_ast.EmptyStatement,
-            c_ast.Typename, c_ast.TypeDecl, c_ast.IdentifierType,
-            c_ast.PtrDecl, c_ast.ArrayDecl, c_ast.FuncDecl,
-            c_ast.Constant, c_ast.ID, c_ast.BinaryOp, c_ast.ExprList
-        )
-        if isinstance(node, ignored_types):
-            super().generic_visit(node)
+        node_type = node.__class__.__name__
+        if node_type in _PASSTHROUGH_NODE_TYPES:
+            self._visit_children(node)
             return
 
         label = None
         node_created = False
-        if isinstance(node, (c_ast.Assignment, c_ast.Decl, c_ast.FuncCall)):
+        if node_type in _STATEMENT_NODE_TYPES:
             label = self._generate_stmt_label(node)
-        elif isinstance(node, c_ast.UnaryOp) and node.op in ('p++', 'p--', '++', '--'):
+        elif node_type == 'UnaryOp' and node.op in ('p++', 'p--', '++', '--'):
             label = self._generate_stmt_label(node)
 
         if label and label.strip() and label.strip() != ';':
-            shape = 'note' if isinstance(node, c_ast.Decl) else 'box'
-            style = '' if isinstance(node, c_ast.Decl) else 'rounded'
-            
-            current_node = self._add_node(label, shape=shape, style=style)
-            if self.current_block_end_node:
-                self._add_edge(self.current_block_end_node, current_node)
+            kind = controlflow.DECL if node_type == 'Decl' else controlflow.STATEMENT
+
+            current_node = self._add_node(label, kind)
+            self._add_edge(self.current_block_end_node, current_node)
             self.current_block_end_node = current_node
             node_created = True
         
         if not node_created:
-            super().generic_visit(node)
+            self._visit_children(node)
 
 
-# --- Main Function to Generate Flowchart ---
-def create_flowchart(c_code_string, output_filename="flowchart", c_compiler='gcc', include_paths=None, view_image=False):
-    print(f"INFO: Using C compiler: {c_compiler}")
-    print("INFO: Preprocessing C code...")
+# --- Library API ---
+# preprocess() -> parse() -> build_flowchart() -> render() are the stages that
+# create_flowchart() and batch mode are assembled from; build_cfg() returns the
+# graph itself, for analyses and non-DOT back ends.
+_parser = None
+
+def _get_parser():
+    # CParser construction loads the PLY tables, so it is built once per process
+    global _parser
+    if _parser is None:
+        _parser = _import_pycparser().c_parser.CParser()
+    return _parser
+
+
+def preprocess(c_code_string, c_compiler='gcc', include_paths=None, backend='compiler', timeout=DEFAULT_PREPROCESS_TIMEOUT):
+    """Runs the C preprocessor over source text. Same as preprocess_c_code()."""
+    return preprocess_c_code(c_code_string, c_compiler, include_paths, backend, timeout)
+
+
+def parse(preprocessed_code, filename='<c_code_string>'):
+    """Parses preprocessed C into a pycparser FileAST. Raises pycparser's ParseError."""
+    return _get_parser().parse(preprocessed_code, filename=filename)
+
+
+# --- Parse recovery ---
+# A translation unit pycparser rejects (GCC extensions in a header, a typo in one
+# function) is split into its top-level declarations, and the ones that parse
+# are kept, so the functions that parse are still charted.
+
+# String and character literals, preprocessor lines, and the characters that delimit top-level declarations
+_TOP_LEVEL_TOKEN_RE = re.compile(r'"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'|^[ \t]*#[^\n]*|[{};]', re.MULTILINE)
+_DIRECTIVE_LINE_RE = re.compile(r'^[ \t]*#[^\n]*', re.MULTILINE)
+_LEADING_DIRECTIVES_RE = re.compile(r'(?:\s|(?<![^\n])[ \t]*#[^\n]*)*')
+_LINEMARKER_LINE_RE = re.compile(r'^#\s*(?:line\s+)?(\d+)\s+"((?:[^"\\]|\\.)*)"', re.MULTILINE)
+_TYPEDEF_RE = re.compile(r'\s*(?:__extension__\s+)?typedef\b')
+_TYPEDEF_NAME_RE = re.compile(r'\(\s*\*\s*(\w+)\s*\)|(\w+)\s*(?:\[[^\]]*\]\s*)*(?:__attribute__\s*\(\(.*\)\)\s*)?;\s*$', re.DOTALL)
+_CALL_NAME_RE = re.compile(r'(\w+)\s*\(')
+# 'int f(a, b) int a;': a declarator with an identifier list, then the first K&R parameter declaration
+_KNR_HEADER_RE = re.compile(r'[^;={}()]*\b[A-Za-z_]\w*\s*\(\s*[A-Za-z_]\w*(?:\s*,\s*[A-Za-z_]\w*)*\s*\)\s*[A-Za-z_][^;{}]*;$')
+_IDENTIFIER_RE = re.compile(r'[A-Za-z_]\w*')
+
+
+def split_top_level(preprocessed_code, filename='<c_code_string>'):
+    """
+    Splits preprocessed C into its top-level declarations and function
+    definitions. Returns [(source line, is_function, text), ...]; each text
+    starts with a linemarker, so it parses with its original coordinates on
+    its own. The parameter declarations of a K&R-style definition end in
+    ';', so they are split off at first and joined back once its body follows.
+    """
+    markers = [] # (offset, line in the preprocessed code, source line of the line after it, source file)
+    line, line_offset = 1, 0
+    for m in _LINEMARKER_LINE_RE.finditer(preprocessed_code):
+        line += preprocessed_code.count('\n', line_offset, m.start())
+        line_offset = m.start()
+        markers.append((m.start(), line, int(m.group(1)), m.group(2)))
+    line, line_offset = 1, 0
+    marker_index = -1
+    chunks = []
+    depth = 0
+    start = 0
+    brace = None # Offset of the current declaration's first '{'
+    knr_header = None # The state before the last chunk that looked like a K&R definition's header
+
+    def end_chunk(end, is_function):
+        nonlocal start, brace, line, line_offset, marker_index
+        body = _LEADING_DIRECTIVES_RE.match(preprocessed_code, start, end).end()
+        if body < end:
+            line += preprocessed_code.count('\n', line_offset, body)
+            line_offset = body
+            while marker_index + 1 < len(markers) and markers[marker_index + 1][0] < body:
+                marker_index += 1
+            if marker_index >= 0:
+                _, marker_line, next_line, source_file = markers[marker_index]
+                source_line = next_line + line - marker_line - 1
+            else:
+                source_line, source_file = line, filename
+            chunks.append((source_line, is_function,
+                           f'# {source_line} "{source_file}"\n{preprocessed_code[body:end]}\n'))
+        start, brace = end, None
+
+    for m in _TOP_LEVEL_TOKEN_RE.finditer(preprocessed_code):
+        token = m.group()
+        if token == '{':
+            if depth == 0 and brace is None:
+                brace = m.start()
+            depth += 1
+        elif token == '}':
+            depth = max(depth - 1, 0)
+            if depth == 0 and brace is not None:
+                # A function body ends the definition; a struct/union/enum body does not
+                header = _DIRECTIVE_LINE_RE.sub('', preprocessed_code[start:brace]).strip()
+                if header.endswith(')'):
+                    end_chunk(m.end(), True)
+                    knr_header = None
+                elif not header and knr_header:
+                    start, chunk_count, line, line_offset, marker_index = knr_header
+                    del chunks[chunk_count:]
+                    end_chunk(m.end(), True)
+                    knr_header = None
+        elif token == ';' and depth == 0:
+            state = (start, len(chunks), line, line_offset, marker_index)
+            declaration = _DIRECTIVE_LINE_RE.sub('', preprocessed_code[start:m.end()]).strip()
+            if brace is not None:
+                knr_header = None
+            elif _KNR_HEADER_RE.match(declaration):
+                knr_header = state
+            end_chunk(m.end(), False)
+    end_chunk(len(preprocessed_code), False)
+    return chunks
+
+
+def parse_recovering(preprocessed_code, filename='<c_code_string>'):
+    """
+    Parses preprocessed C like parse(). When that fails, parses the top-level
+    declarations (see split_top_level) in groups, halving the groups that
+    fail, and keeps what parses. The typedef names a group uses that were
+    declared before it (including a best guess for typedefs that failed) are
+    declared again ahead of it, since the C grammar depends on them.
+    Returns (FileAST, skipped), where skipped lists the declarations left out
+    as {'line', 'function' (None for other declarations), 'error'}. Raises
+    the original ParseError when no function definition parses.
+    """
+    pycparser = _import_pycparser()
     try:
-        preprocessed_code = preprocess_c_code(c_code_string, c_compiler, include_paths)
-        # print("--- Preprocessed Code (first 500 chars) ---")
-        # print(preprocessed_code[:500])
-        # print("-------------------------------------------")
-    except Exception as e:
-        print(f"FATAL: Failed to preprocess C code: {e}")
-        return
+        return parse(preprocessed_code, filename), []
+    except pycparser.c_parser.ParseError as e:
+        parse_error = e
+    chunks = split_top_level(preprocessed_code, filename)
+    typedef_names = {} # Ordered set
+    ext = []
+    skipped = []
+
+    def parse_group(lo, hi, known_bad=False):
+        if not known_bad:
+            group = ''.join(text for _, _, text in chunks[lo:hi])
+            used = set(_IDENTIFIER_RE.findall(group))
+            prelude = [name for name in typedef_names if name in used] # The typedefs this group could refer to
+            try:
+                ast = parse(''.join(f"typedef int {name};\n" for name in prelude) + group, filename)
+            except pycparser.c_parser.ParseError as e:
+                if hi - lo == 1:
+                    line, is_function, text = chunks[lo]
+                    declaration = text[text.index('\n') + 1:] # After the linemarker
+                    if _TYPEDEF_RE.match(declaration):
+                        name = _TYPEDEF_NAME_RE.search(declaration)
+                        if name:
+                            typedef_names[name.group(1) or name.group(2)] = True
+                    function = None
+                    if is_function:
+                        function = next((n for n in _CALL_NAME_RE.findall(declaration[:declaration.find('{')])
+                                         if not n.startswith('__')), None)
+                    skipped.append({'line': line, 'function': function, 'error': str(e)})
+                    return
+            else:
+                for node in ast.ext[len(prelude):]:
+                    if node.__class__.__name__ == 'Typedef':
+                        typedef_names[node.name] = True
+                    ext.append(node)
+                return
+        mid = (lo + hi) // 2
+        parse_group(lo, mid)
+        parse_group(mid, hi)
+
+    if len(chunks) > 1:
+        parse_group(0, len(chunks), known_bad=True)
+    if not any(node.__class__.__name__ == 'FuncDef' for node in ext):
+        raise parse_error
+    return pycparser.c_ast.FileAST(ext), skipped
+
+
+def load_c_code(c_code, result, c_compiler='gcc', include_paths=None, preprocessor='compiler', cache=None,
+                recover=True, preprocess_timeout=DEFAULT_PREPROCESS_TIMEOUT, filename='<c_code_string>', timed=None,
+                verify=None):
+    """
+    Preprocesses and parses C source, or takes both from the cache; every
+    entry point (flowcharts, batch, watch, call graph, metrics, server)
+    loads C through here. Progress goes into the dict `result`: 'stage' (the
+    stage running, left set when it raises), 'cached', and 'skipped' (see
+    parse_recovering; recover=False parses strictly). Each stage runs as
+    timed(stage, func, *args) when given. verify(preprocessed code), when
+    given, sees the preprocessed code before it is parsed or taken from the
+    cache, and can raise to reject it. Returns (preprocessed code, FileAST).
+    """
+    timed = timed or (lambda stage, func, *args, **kwargs: func(*args, **kwargs))
+    result['cached'], result['skipped'] = False, []
+    result['stage'] = 'cache'
+    cached = timed('cache', cache.lookup, c_code, c_compiler, include_paths, preprocessor) if cache else None
+    if cached:
+        result['cached'] = True
+        if verify:
+            verify(cached[0])
+        return cached
+    result['stage'] = 'preprocess'
+    preprocessed = timed('preprocess', preprocess, c_code, c_compiler, include_paths, preprocessor, preprocess_timeout)
+    if verify:
+        verify(preprocessed)
+    result['stage'] = 'parse'
+    if recover:
+        ast, result['skipped'] = timed('parse', parse_recovering, preprocessed, filename=filename)
+    else:
+        ast = timed('parse', parse, preprocessed, filename=filename)
+    if cache and not result['skipped']: # Partial ASTs are not cached, so the skipped list is reported every run
+        cache.store(c_code, c_compiler, include_paths, preprocessed, ast, preprocessor)
+    return preprocessed, ast
+
+
+def build_cfg(ast, max_label_length=DEFAULT_MAX_LABEL_LENGTH):
+    """Builds the control-flow graph of a FileAST as a controlflow.ControlFlowGraph."""
+    visitor = FlowchartVisitor(label_renderer=LabelRenderer(max_label_length))
+    visitor.visit(ast)
+    return visitor.cfg
+
+
+def build_flowchart(ast, max_label_length=DEFAULT_MAX_LABEL_LENGTH):
+    """Builds the flowchart of a FileAST and returns it as a graphviz.Digraph."""
+    visitor = FlowchartVisitor(label_renderer=LabelRenderer(max_label_length))
+    visitor.visit(ast)
+    return visitor.dot
+
+
+def stream_flowchart(ast, stream, max_label_length=DEFAULT_MAX_LABEL_LENGTH):
+    """
+    Writes the flowchart of a FileAST as DOT text to stream (any object with
+    write(str): a file, a socket's makefile('w'), ...) while it is built.
+    The statements of each function are written as soon as the function has
+    been visited, so the graph in memory (and the label memo) never holds
+    more than one function.
+    The output is the same graph as build_flowchart's. Returns (nodes, edges).
+    """
+    counts = [0, 0]
+    label_renderer = LabelRenderer(max_label_length)
+
+    def write_chunk(chunk):
+        first_id, nodes, edges = chunk
+        stream.write(''.join(_dot_statements(first_id, nodes, edges)))
+        counts[0] += len(nodes)
+        counts[1] += len(edges)
+        label_renderer.clear() # Like the nodes, the label memo only ever holds one function
+
+    stream.write("// C Code Flowchart\nstrict digraph {\n\trankdir=TB\n")
+    FlowchartVisitor(sink=write_chunk, label_renderer=label_renderer).visit(ast)
+    stream.write("}\n")
+    return tuple(counts)
+
+
+# --- Per-function flowcharts and graph splitting ---
+DEFAULT_MAX_NODES = 500 # Larger graphs are split into linked parts; 0 disables splitting
+
+
+def build_flowcharts(ast, per_function=False, max_nodes=DEFAULT_MAX_NODES, profiler=None,
+                     max_label_length=DEFAULT_MAX_LABEL_LENGTH):
+    """
+    Builds the flowcharts of a FileAST as [(name, node_count, [Digraph, ...]), ...].
+    By default there is one entry (name None) for the whole file; with
+    per_function=True there is one per function definition, in source order.
+    Graphs with more than max_nodes nodes are split into parts of consecutive
+    nodes (in source order) linked by off-page connectors (see cfg_to_digraph).
+    Graph sizes are counted into profiler's metrics when one is given.
+    Labels longer than max_label_length are cut (0 keeps them whole).
+    """
+    label_renderer = LabelRenderer(max_label_length)
+    if per_function:
+        FileAST = _import_pycparser().c_ast.FileAST
+        units = [(ext.decl.name, FileAST([ext])) for ext in ast.ext if ext.__class__.__name__ == 'FuncDef']
+    else:
+        units = [(None, ast)]
+
+    charts = []
+    for name, unit in units:
+        visitor = FlowchartVisitor(label_renderer=label_renderer)
+        visitor.visit(unit)
+        parts = cfg_to_digraphs(visitor.cfg, max_nodes)
+        charts.append((name, visitor.node_count, parts))
+        if profiler:
+            profiler.count(graphs=len(parts), graph_nodes=len(visitor.cfg), graph_edges=visitor.cfg.edge_count)
+    return charts
+
+
+def flowchart_output_bases(output_base, charts):
+    """Returns, for each chart, the output filename bases of its parts."""
+    all_bases = []
+    for name, _, parts in charts:
+        base = f"{output_base}_{name}" if name else output_base
+        if len(parts) == 1:
+            all_bases.append([base])
+        else:
+            all_bases.append([f"{base}_part{i}" for i in range(1, len(parts) + 1)])
+    return all_bases
+
+
+def write_flowchart_index(index_path, charts, all_bases, image_format=None):
+    """Writes an HTML page linking every flowchart and its parts."""
+    link_ext = image_format if image_format and image_format != 'dot' else 'dot'
+    title = html.escape(os.path.basename(index_path).rsplit('_index.html', 1)[0])
+    rows = []
+    for (name, node_count, _), bases in zip(charts, all_bases):
+        links = ' '.join(
+            f'<a href="{html.escape(os.path.basename(base))}.{link_ext}">'
+            f'{"graph" if len(bases) == 1 else f"part {i}"}</a>'
+            for i, base in enumerate(bases, 1))
+        rows.append(f"<tr><td>{html.escape(name or '(whole file)')}</td><td>{node_count}</td><td>{links}</td></tr>")
+    _write_text(index_path, (
+        "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+        f"<title>Flowcharts: {title}</title></head>\n<body>\n<h1>Flowcharts: {title}</h1>\n"
+        "<table border=\"1\" cellpadding=\"4\">\n<tr><th>Function</th><th>Nodes</th><th>Flowchart</th></tr>\n"
+        + "\n".join(rows) + "\n</table>\n</body></html>\n"))
+
+
+def write_flowcharts(charts, output_base, image_format=None):
+    """
+    Writes the .dot file of every chart part, plus <output_base>_index.html when
+    there is more than one graph. Images are not rendered here (see RenderQueue).
+    Returns (list of .dot paths, index path or None).
+    """
+    all_bases = flowchart_output_bases(output_base, charts)
+    dot_filepaths = []
+    for (_, _, parts), bases in zip(charts, all_bases):
+        for dot, base in zip(parts, bases):
+            dot_filepaths.append(render(dot, base, image_format=None))
+    index_path = None
+    if len(dot_filepaths) > 1:
+        index_path = f"{output_base}_index.html"
+        write_flowchart_index(index_path, charts, all_bases, image_format)
+    return dot_filepaths, index_path
+
 
-    print("INFO: Parsing C code...")
-    parser = c_parser.CParser()
+def _write_text(path, text):
+    with open(path, "w", encoding='utf-8') as f:
+        f.write(text)
+
+
+def render(dot, output_filename="flowchart", image_format='png', view_image=False, timeout=DEFAULT_RENDER_TIMEOUT):
+    """
+    Writes <output_filename>.dot and renders <output_filename>.<image_format>
+    from it with Graphviz (skipped when image_format is None).
+    dot is a Digraph or DOT source text. Returns the path of the last file written.
+    """
+    output_base = os.path.splitext(output_filename)[0]
+    out_dir = os.path.dirname(output_base)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    dot_filepath = f"{output_base}.dot"
+    _write_text(dot_filepath, getattr(dot, 'source', dot))
+    if not image_format:
+        return dot_filepath
+    # Render from the .dot just written instead of letting Digraph.render write the source again
+    return render_dot_file(dot_filepath, image_format, view_image, timeout)
+
+
+def render_dot_file(dot_filepath, image_format='png', view_image=False, timeout=DEFAULT_RENDER_TIMEOUT):
+    """
+    Renders an existing .dot file to <name>.<image_format> next to it. Returns the image path.
+    Raises subprocess.CalledProcessError when dot fails and StageTimeout when it
+    runs longer than `timeout` seconds.
+    """
+    img_filepath = f"{os.path.splitext(dot_filepath)[0]}.{image_format}"
+    # dot is run directly rather than through graphviz.render, which has no time limit
     try:
-        ast = parser.parse(preprocessed_code, filename='<c_code_string>')
-    except c_parser.ParseError as e:
-        print(f"FATAL: Error parsing C code: {e}")
-        # print("--- Problematic Preprocessed Code (first 2000 chars) ---")
-        # print(preprocessed_code[:2000])
-        return
-    except Exception as e:
-        print(f"FATAL: An unexpected error occurred during parsing: {e}")
-        return
+        subprocess.run(['dot', f'-T{image_format}', '-o', img_filepath, dot_filepath],
+                       capture_output=True, check=True, timeout=timeout or None)
+    except FileNotFoundError:
+        raise RuntimeError("Graphviz 'dot' not found. Ensure Graphviz is installed and in PATH.") from None
+    except subprocess.TimeoutExpired:
+        with contextlib.suppress(OSError): # Partly written
+            os.remove(img_filepath)
+        raise StageTimeout(f"dot did not finish {dot_filepath} within {timeout}s") from None
+    if view_image:
+        _import_graphviz().view(img_filepath)
+    return img_filepath
+
+
+# --- Structured CFG export (for the browser front end) ---
+# Not images but the graph itself, for client-side rendering: compact JSON or its binary equivalent
+EXPORT_FORMATS = ('json', 'cfgb')
+
+
+def export_cfg(cfg, output_base, export_format='json'):
+    """
+    Writes a ControlFlowGraph to <output_base>.json (compact JSON) or
+    <output_base>.cfgb (binary); see ControlFlowGraph.to_compact_dict and
+    to_bytes for the layouts. Returns the path written.
+    """
+    out_dir = os.path.dirname(output_base)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    path = f"{output_base}.{export_format}"
+    if export_format == 'json':
+        _write_text(path, cfg.to_compact_json())
+    else:
+        with open(path, "wb") as f:
+            f.write(cfg.to_bytes())
+    return path
+
+
+# --- Parallel rendering ---
+# 'dot' means DOT-only output: the .dot file is written and rasterization is skipped.
+IMAGE_FORMATS = ('png', 'svg', 'pdf', 'dot')
+
 
-    print("INFO: Generating flowchart DOT description...")
-    visitor = FlowchartVisitor()
+class RenderQueue:
+    """
+    Renders .dot files with a bounded pool of Graphviz `dot` processes.
+    Queued files are handed to dot in chunks (`dot -T<fmt> -O a.dot b.dot ...`),
+    so one process lays out several graphs and process start-up is paid once
+    per chunk rather than once per graph. Rendering runs in background threads
+    (the work happens in dot), so it overlaps with whatever queues the files.
+    A dot run longer than `timeout` seconds is killed; its files are then
+    retried one per run, so only the graphs that are too slow fail (listed in
+    `timed_out`).
+    """
+    def __init__(self, image_format='png', workers=None, chunk_size=8, dot_command='dot', timeout=DEFAULT_RENDER_TIMEOUT):
+        from concurrent.futures import ThreadPoolExecutor
+        self.image_format = image_format
+        self.timeout = timeout or None
+        self.timed_out = set()
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = max(1, chunk_size)
+        self.dot_command = dot_command
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._pending = []
+        self._futures = []
+        self._start = None
+
+    def submit(self, dot_filepath):
+        if self._start is None:
+            self._start = time.perf_counter()
+        self._pending.append(dot_filepath)
+        if len(self._pending) >= self.chunk_size:
+            self._flush(self._pending)
+            self._pending = []
+
+    def _flush(self, dot_filepaths):
+        self._futures.append(self._executor.submit(self._render_chunk, dot_filepaths))
+
+    def _render_chunk(self, dot_filepaths):
+        start = time.perf_counter()
+        cmd = [self.dot_command, f'-T{self.image_format}', '-O'] + dot_filepaths
+        try:
+            proc = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace',
+                                  timeout=self.timeout)
+            error = proc.stderr.strip() or f"dot exited with return code {proc.returncode}"
+        except FileNotFoundError:
+            error = f"Graphviz '{self.dot_command}' not found. Ensure Graphviz is installed and in PATH."
+        except subprocess.TimeoutExpired:
+            for dot_filepath in dot_filepaths: # The graph being laid out when dot was killed may be partly written
+                with contextlib.suppress(OSError):
+                    os.remove(f"{dot_filepath}.{self.image_format}")
+            if len(dot_filepaths) > 1:
+                return [outcome for dot_filepath in dot_filepaths for outcome in self._render_chunk([dot_filepath])]
+            self.timed_out.add(dot_filepaths[0])
+            error = f"StageTimeout: dot did not finish {dot_filepaths[0]} within {self.timeout}s"
+        seconds_per_file = (time.perf_counter() - start) / len(dot_filepaths)
+
+        results = []
+        for dot_filepath in dot_filepaths:
+            produced = f"{dot_filepath}.{self.image_format}" # -O names outputs a.dot.png
+            image_filepath = f"{os.path.splitext(dot_filepath)[0]}.{self.image_format}"
+            if os.path.exists(produced):
+                os.replace(produced, image_filepath)
+                results.append((dot_filepath, image_filepath, None, seconds_per_file))
+            else:
+                # Keep only the stderr lines about this file when dot names it
+                own_lines = [line for line in error.splitlines() if dot_filepath in line]
+                results.append((dot_filepath, None, '\n'.join(own_lines) or error, seconds_per_file))
+        return results
+
+    def close(self):
+        """
+        Waits for every queued render. Returns ({dot_filepath: (image_filepath,
+        error, seconds)}, wall-clock seconds from the first submit to completion).
+        """
+        # Spread the leftover files over the idle workers instead of one last chunk
+        leftover, self._pending = self._pending, []
+        size = max(1, -(-len(leftover) // self.workers))
+        for i in range(0, len(leftover), size):
+            self._flush(leftover[i:i + size])
+
+        results = {}
+        for future in self._futures:
+            for dot_filepath, image_filepath, error, seconds in future.result():
+                results[dot_filepath] = (image_filepath, error, seconds)
+        self._executor.shutdown()
+        elapsed = time.perf_counter() - self._start if self._start is not None else 0.0
+        return results, elapsed
+
+
+# --- Stage profiling ---
+DEFAULT_PROFILE_FILE = "c2flow_profile.jsonl"
+
+
+class StageProfiler:
+    """
+    Records per-stage wall and CPU time for one input (and the tracemalloc
+    peak with memory=True), together with pipeline metrics such as the
+    preprocessed size or the graph node count. Time a stage with
+    `with profiler.stage('parse'):` or profiler.run('parse', func, ...).
+    Each finished stage is passed to every hook as hook(profiler, stage, stage_record);
+    record() returns the whole profile as one JSON-serializable dict.
+    With cprofile=True each stage also runs under cProfile, and
+    dump_hottest() writes the profile of the slowest stage.
+    """
+    def __init__(self, label=None, memory=False, cprofile=False, hooks=()):
+        self.label = label
+        self.memory = memory
+        self.cprofile = cprofile
+        self.hooks = list(hooks)
+        self.stages = {}
+        self.metrics = {}
+        self._profiles = {}
+        self._started_tracemalloc = False
+        if memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.memory:
+            import tracemalloc
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        if self.cprofile:
+            import cProfile
+            profile = self._profiles.setdefault(name, cProfile.Profile())
+            profile.enable()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            if self.cprofile:
+                profile.disable()
+            stage_record = self.stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0})
+            stage_record['wall'] += wall # A stage that runs several times accumulates
+            stage_record['cpu'] += cpu
+            if self.memory:
+                peak_kb = (tracemalloc.get_traced_memory()[1] - memory_before) / 1024
+                stage_record['peak_kb'] = max(stage_record.get('peak_kb', 0.0), peak_kb)
+            for hook in self.hooks:
+                hook(self, name, stage_record)
+
+    def run(self, name, func, *args, **kwargs):
+        with self.stage(name):
+            return func(*args, **kwargs)
+
+    def add(self, **metrics):
+        self.metrics.update(metrics)
+
+    def count(self, **metrics):
+        for key, value in metrics.items():
+            self.metrics[key] = self.metrics.get(key, 0) + value
+
+    def hottest_stage(self):
+        return max(self.stages, key=lambda name: self.stages[name]['wall']) if self.stages else None
+
+    def dump_hottest(self, directory):
+        """Writes the cProfile stats of the slowest stage to directory; returns the path (None without cprofile)."""
+        stage = self.hottest_stage()
+        if stage not in self._profiles:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '_', os.path.normpath(self.label or 'c2flow')).strip('_.')
+        path = os.path.join(directory, f"{name}.{stage}.prof")
+        self._profiles[stage].dump_stats(path)
+        return path
+
+    def record(self):
+        return {'file': self.label, 'stages': self.stages, 'metrics': self.metrics,
+                'total_wall': sum(s['wall'] for s in self.stages.values()),
+                'hottest_stage': self.hottest_stage()}
+
+    def close(self):
+        if self._started_tracemalloc:
+            import tracemalloc
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+
+def _profiled(profiler, name):
+    # Stage context manager that is free when profiling is off
+    return profiler.stage(name) if profiler else contextlib.nullcontext()
+
+
+def count_ast_nodes(ast):
+    count, stack = 0, [ast]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node)
+    return count
+
+
+def profile_preprocessed(profiler, preprocessed_code, ast):
+    """Adds the input-size metrics of a preprocessed and parsed file."""
+    profiler.add(preprocessed_bytes=len(preprocessed_code.encode('utf-8')),
+                 preprocessed_lines=preprocessed_code.count('\n'),
+                 ast_nodes=count_ast_nodes(ast))
+
+
+def write_profile_records(path, records, mode):
+    """Appends profile records to a JSON-lines file, so several runs can be aggregated."""
+    run_id = f"{time.strftime('%Y-%m-%dT%H:%M:%S')}-{os.getpid()}"
+    with open(path, "a", encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(dict(record, run=run_id, mode=mode)) + "\n")
+
+
+def print_profile(record):
+    print("\n--- Profile ---")
+    print(f"  {'stage':<12} {'wall':>9} {'cpu':>9}" + (f" {'peak':>10}" if any('peak_kb' in s for s in record['stages'].values()) else ""))
+    for stage, s in record['stages'].items():
+        line = f"  {stage:<12} {s['wall'] * 1000:7.1f}ms {s['cpu'] * 1000:7.1f}ms"
+        if 'peak_kb' in s:
+            line += f" {s['peak_kb']:8.0f}KB"
+        print(line)
+    for key, value in record['metrics'].items():
+        print(f"  {key}: {value}")
+
+
+# --- Main Function to Generate Flowchart ---
+def create_flowchart(c_code_string, output_filename="flowchart", c_compiler='gcc', include_paths=None, view_image=False, cache=None,
+                     preprocessor='compiler', image_format='png', per_function=False, max_nodes=DEFAULT_MAX_NODES,
+                     profiler=None, stream=False, max_label_length=DEFAULT_MAX_LABEL_LENGTH, recover=True,
+                     preprocess_timeout=DEFAULT_PREPROCESS_TIMEOUT, render_timeout=DEFAULT_RENDER_TIMEOUT):
+    ParseError = _import_pycparser().c_parser.ParseError
+    if preprocessor == 'builtin':
+        print("INFO: Using the builtin preprocessor")
+    else:
+        print(f"INFO: Using C compiler: {c_compiler}")
+    load_messages = {'preprocess': "INFO: Preprocessing C code...", 'parse': "INFO: Parsing C code..."}
+
+    def timed(stage, func, *args, **kwargs):
+        if stage in load_messages:
+            print(load_messages[stage])
+        with _profiled(profiler, stage):
+            return func(*args, **kwargs)
+
+    load = {}
     try:
-        visitor.visit(ast)
+        preprocessed_code, ast = load_c_code(c_code_string, load, c_compiler, include_paths, preprocessor, cache,
+                                             recover, preprocess_timeout, timed=timed)
+    except ParseError as e:
+        print(f"FATAL: Error parsing C code: {e}")
+        return
     except Exception as e:
-        print(f"FATAL: Error during AST visitation for flowchart generation: {e}")
+        if load['stage'] == 'parse':
+            print(f"FATAL: An unexpected error occurred during parsing: {e}")
+        else:
+            print(f"FATAL: Failed to preprocess C code: {e}")
         return
+    if load['cached']:
+        print(f"INFO: Using cached preprocessed code and AST from {cache.cache_dir}")
+    if load['skipped']:
+        print(f"WARNING: The C code does not parse as a whole; charting what does, without {len(load['skipped'])} declaration(s):")
+        for item in load['skipped']:
+            what = f"function {item['function']}()" if item['function'] else "declaration"
+            print(f"WARNING:   {what} at line {item['line']}: {item['error']}")
+
+    if profiler:
+        profiler.add(cached=load['cached'])
+        profile_preprocessed(profiler, preprocessed_code, ast)
+
+    if image_format in EXPORT_FORMATS:
+        print(f"INFO: Exporting the control-flow graph as {image_format}...")
+        try:
+            with _profiled(profiler, 'visit'):
+                cfg = build_cfg(ast, max_label_length)
+            with _profiled(profiler, 'write'):
+                export_path = export_cfg(cfg, os.path.splitext(output_filename)[0], image_format)
+        except OSError as e:
+            print(f"ERROR: Could not write the {image_format} export: {e}")
+            return
+        except Exception as e:
+            print(f"FATAL: Error during AST visitation for flowchart generation: {e}")
+            return
+        if profiler:
+            profiler.count(graphs=1, graph_nodes=len(cfg), graph_edges=cfg.edge_count)
+        print(f"INFO: Control-flow graph ({len(cfg)} nodes, {len(cfg.function_ranges())} functions) saved to {export_path}")
+        return export_path
 
     dot_filename_base = os.path.splitext(output_filename)[0]
     dot_filepath = f"{dot_filename_base}.dot"
-    img_filepath = f"{dot_filename_base}.png" # Default to PNG
+    if stream:
+        # The .dot is written while the AST is visited and rendered from as is
+        print(f"INFO: Streaming flowchart DOT description to {dot_filepath}...")
+        try:
+            with _profiled(profiler, 'visit'): # Includes writing the .dot
+                if os.path.dirname(dot_filepath):
+                    os.makedirs(os.path.dirname(dot_filepath), exist_ok=True)
+                with open(dot_filepath, "w", encoding='utf-8') as f:
+                    node_count, edge_count = stream_flowchart(ast, f, max_label_length)
+        except OSError as e:
+            print(f"ERROR: Could not write DOT file {dot_filepath}: {e}")
+            return
+        except Exception as e:
+            print(f"FATAL: Error during AST visitation for flowchart generation: {e}")
+            return
+        if profiler:
+            profiler.count(graphs=1, graph_nodes=node_count, graph_edges=edge_count)
+        if max_nodes and node_count > max_nodes:
+            print(f"INFO: Streamed flowchart has {node_count} nodes; streamed flowcharts are not split (--max-nodes ignored).")
+        print(f"INFO: DOT source saved to {dot_filepath}")
+        if image_format in (None, 'dot'):
+            return dot_filepath
+        dot = None
+    else:
+        print("INFO: Generating flowchart DOT description...")
+        try:
+            with _profiled(profiler, 'visit'):
+                charts = build_flowcharts(ast, per_function, max_nodes, profiler, max_label_length)
+        except Exception as e:
+            print(f"FATAL: Error during AST visitation for flowchart generation: {e}")
+            return
 
-    try:
-        with open(dot_filepath, "w", encoding='utf-8') as f:
-            f.write(visitor.dot.source)
+        if not charts:
+            print("WARNING: No function definitions found, no flowchart written.")
+            return
+        if len(charts) > 1 or len(charts[0][2]) > 1:
+            return _write_flowchart_set(charts, dot_filename_base, image_format, profiler, render_timeout)
+        dot = charts[0][2][0]
+
+    if image_format in (None, 'dot'): # DOT-only mode, no Graphviz run
+        try:
+            with _profiled(profiler, 'write'):
+                render(dot, dot_filename_base, image_format=None)
+        except OSError as e:
+            print(f"ERROR: Could not write DOT file {dot_filepath}: {e}")
+            return
         print(f"INFO: DOT source saved to {dot_filepath}")
+        return dot_filepath
+    img_filepath = f"{dot_filename_base}.{image_format}"
 
-        # Use the Digraph object's render method
-        # It saves to output_filename (which becomes output_filename.png by default if format is png)
-        # The 'directory' argument specifies where to save the files.
-        rendered_path = visitor.dot.render(filename=dot_filename_base, directory='.', format='png', cleanup=False, quiet=False, view=view_image)
-        # rendered_path will be something like 'flowchart.png' if dot_filename_base is 'flowchart'
+    try:
+        with _profiled(profiler, 'render'): # Includes writing the .dot unless it was streamed
+            if dot is None:
+                rendered_path = render_dot_file(dot_filepath, image_format, view_image, render_timeout)
+            else:
+                rendered_path = render(dot, dot_filename_base, image_format=image_format, view_image=view_image,
+                                       timeout=render_timeout)
+                print(f"INFO: DOT source saved to {dot_filepath}")
         print(f"INFO: Flowchart image rendered to: {rendered_path}")
         if not os.path.exists(rendered_path):
              print(f"WARNING: Rendered path {rendered_path} does not exist. Check Graphviz output.")
-
+        return rendered_path
 
     except subprocess.CalledProcessError as e:
         print(f"ERROR: Graphviz 'dot' command failed (CalledProcessError): {e}")
@@ -456,25 +1846,1131 @@ def create_flowchart(c_code_string, output_filename="flowchart", c_compiler='gcc
         print("Ensure Graphviz is installed and accessible. The .dot file might still be useful.")
     except Exception as e:
         print(f"ERROR: Rendering Graphviz DOT or displaying image: {e}")
-        print(f"You can try to manually render the DOT file: dot -Tpng {dot_filepath} -o {img_filepath}")
+        print(f"You can try to manually render the DOT file: dot -T{image_format} {dot_filepath} -o {img_filepath}")
+
+
+def _write_flowchart_set(charts, output_base, image_format, profiler=None, render_timeout=DEFAULT_RENDER_TIMEOUT):
+    # Several graphs (per function and/or split parts): write them all, then render concurrently
+    try:
+        with _profiled(profiler, 'write'):
+            dot_filepaths, index_path = write_flowcharts(charts, output_base, image_format)
+    except OSError as e:
+        print(f"ERROR: Could not write DOT files for {output_base}: {e}")
+        return
+    split_count = sum(1 for _, _, parts in charts if len(parts) > 1)
+    print(f"INFO: {len(dot_filepaths)} DOT file(s) saved for {len(charts)} flowchart(s)"
+          + (f", {split_count} split into parts" if split_count else ""))
+    if index_path:
+        print(f"INFO: Index page: {index_path}")
+    if image_format in (None, 'dot'):
+        return index_path or dot_filepaths[0]
+
+    with _profiled(profiler, 'render'):
+        queue = RenderQueue(image_format, timeout=render_timeout)
+        for dot_filepath in dot_filepaths:
+            queue.submit(dot_filepath)
+        rendered, elapsed = queue.close()
+    errors = [error for _, error, _ in rendered.values() if error]
+    print(f"INFO: Rendered {len(rendered) - len(errors)}/{len(rendered)} {image_format.upper()} image(s) in {elapsed:.2f}s")
+    if errors:
+        print(f"ERROR: Graphviz failed for {len(errors)} graph(s): {errors[0].splitlines()[0]}")
+    return index_path or dot_filepaths[0]
+
+
+# --- Batch Mode (whole source trees across a process pool) ---
+C_SOURCE_EXTENSIONS = ('.c',)
+BATCH_STAGES = ('read', 'cache', 'preprocess', 'parse', 'visit', 'write', 'render')
+
+
+def collect_c_files(inputs):
+    """
+    Expands command-line inputs into a sorted list of C file paths.
+    Each input can be a C file, a directory (searched recursively),
+    a glob pattern, or '@list.txt' naming a file with one path per line.
+    """
+    found = []
+    for item in inputs:
+        if item.startswith('@'):
+            with open(item[1:], "r", encoding='utf-8') as f:
+                listed = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+            found.extend(collect_c_files(listed))
+        elif os.path.isdir(item):
+            for dirpath, dirnames, filenames in os.walk(item):
+                dirnames.sort()
+                for name in filenames:
+                    if name.endswith(C_SOURCE_EXTENSIONS):
+                        found.append(os.path.join(dirpath, name))
+        elif glob.has_magic(item):
+            found.extend(p for p in glob.glob(item, recursive=True) if os.path.isfile(p))
+        else:
+            found.append(item)
+    # Deduplicate while keeping a stable order
+    return sorted(set(os.path.normpath(p) for p in found))
+
+
+def batch_output_base(c_file, root, output_dir):
+    """
+    Maps a C file to its output filename base inside output_dir,
+    mirroring its location relative to root (e.g. src/a/b.c -> out/a/b).
+    """
+    rel_path = os.path.relpath(os.path.abspath(c_file), root)
+    return os.path.join(output_dir, os.path.splitext(rel_path)[0])
+
+
+def _timed(times, stage, func, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        times[stage] = time.perf_counter() - start
+
+
+def _read_c_file(c_file):
+    with open(c_file, "r", encoding='utf-8') as f:
+        return f.read()
+
+
+def _file_include_paths(c_file, include_paths):
+    # Same default as the single-file CLI: the file's own directory comes first
+    file_includes = [os.path.dirname(os.path.abspath(c_file))]
+    return file_includes + [p for p in (include_paths or []) if p not in file_includes]
+
+
+def _new_result(c_file, output_base):
+    # The result dict of process_c_file, before anything has run
+    return {'file': c_file, 'output': output_base, 'dots': [], 'exports': [], 'ok': False, 'cached': False,
+            'stage': None, 'error': None, 'error_type': None, 'skipped': [], 'times': {}}
+
+
+def process_c_file(c_file, output_base, c_compiler='gcc', include_paths=None, image_format='png', cache=None,
+                   preprocessor='compiler', render_images=True, per_function=False, max_nodes=DEFAULT_MAX_NODES,
+                   profile=False, profile_memory=False, cprofile_dir=None, max_label_length=DEFAULT_MAX_LABEL_LENGTH,
+                   recover=True, preprocess_timeout=DEFAULT_PREPROCESS_TIMEOUT, render_timeout=DEFAULT_RENDER_TIMEOUT):
+    """
+    Runs the full pipeline (preprocess -> parse -> visit -> write -> render) for one file.
+    Unlike create_flowchart it never prints or raises: it returns a result dict
+    with per-stage timings, and on failure the failing stage, error message and
+    error_type (the exception class name, e.g. 'ParseError' or 'StageTimeout').
+    With recover=True a file that does not parse as a whole is parsed one
+    top-level declaration at a time (see parse_recovering); it succeeds with
+    the declarations left out listed in 'skipped'.
+    With render_images=False only the .dot files are written (run_batch renders
+    the images separately through a RenderQueue).
+    With profile=True the result also carries a StageProfiler record under
+    'profile' (see StageProfiler for profile_memory and cprofile_dir).
+    """
+    result = _new_result(c_file, output_base)
+    times = result['times']
+    profiler = StageProfiler(c_file, memory=profile_memory, cprofile=bool(cprofile_dir)) if profile else None
+
+    def timed(stage, func, *args, **kwargs):
+        with _profiled(profiler, stage):
+            return _timed(times, stage, func, *args, **kwargs)
+
+    result['stage'] = 'read'
+    try:
+        c_code = timed('read', _read_c_file, c_file)
+        preprocessed, ast = load_c_code(c_code, result, c_compiler, _file_include_paths(c_file, include_paths),
+                                        preprocessor, cache, recover, preprocess_timeout, c_file, timed)
+        if profiler:
+            profiler.add(source_bytes=len(c_code.encode('utf-8')), cached=result['cached'])
+            profile_preprocessed(profiler, preprocessed, ast)
+
+        result['stage'] = stage = 'visit'
+        if image_format in EXPORT_FORMATS:
+            cfg = timed(stage, build_cfg, ast, max_label_length)
+            if profiler:
+                profiler.count(graphs=1, graph_nodes=len(cfg), graph_edges=cfg.edge_count)
+            result['stage'] = stage = 'write'
+            result['exports'].append(timed(stage, export_cfg, cfg, output_base, image_format))
+        else:
+            charts = timed(stage, build_flowcharts, ast, per_function, max_nodes, profiler, max_label_length)
+
+            result['stage'] = stage = 'write'
+            result['dots'], _ = timed(stage, write_flowcharts, charts, output_base, image_format)
+
+            if render_images and image_format and image_format != 'dot':
+                result['stage'] = stage = 'render'
+
+                def render_all():
+                    for dot_filepath in result['dots']:
+                        render_dot_file(dot_filepath, image_format, timeout=render_timeout)
+                timed(stage, render_all)
+
+        result['ok'], result['stage'] = True, None
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+        result['error_type'] = type(e).__name__
+    if profiler:
+        result['profile'] = profiler.record()
+        if cprofile_dir:
+            result['profile']['cprofile'] = profiler.dump_hottest(cprofile_dir)
+        profiler.close()
+    return result
+
+
+def print_batch_summary(results, elapsed, render_elapsed=None):
+    total = len(results)
+    failures = [r for r in results if not r['ok']]
+    print("\n--- Batch Summary ---")
+    print(f"Files: {total}, succeeded: {total - len(failures)}, failed: {len(failures)}")
+    cache_hits = sum(1 for r in results if r['cached'])
+    if cache_hits:
+        print(f"Cache hits: {cache_hits}/{total}")
+    if elapsed > 0:
+        print(f"Wall time: {elapsed:.2f}s ({total / elapsed:.1f} files/sec)")
+    if render_elapsed:
+        print(f"Rendering wall time: {render_elapsed:.2f}s (overlaps with parsing)")
+
+    # Stage times are summed across workers, so they can exceed the wall time
+    print("Per-stage time (total / mean per file):")
+    for stage in BATCH_STAGES:
+        stage_times = [r['times'][stage] for r in results if stage in r['times']]
+        if stage_times:
+            print(f"  {stage:<10} {sum(stage_times):8.3f}s / {sum(stage_times) / len(stage_times) * 1000:8.1f}ms")
+
+    partial = [r for r in results if r['ok'] and r['skipped']]
+    if partial:
+        print(f"Partly parsed: {len(partial)} file(s), {sum(len(r['skipped']) for r in partial)} declaration(s) skipped")
+
+    if failures:
+        print("Failures:")
+        for r in failures:
+            first_line = (r['error'] or '').strip().splitlines()[0] if r['error'] else ''
+            print(f"  {r['file']} [{r['stage']}]: {first_line}")
+
+
+def write_error_records(path, results):
+    """
+    Writes one JSON line per failed file and per declaration skipped by parse
+    recovery: {'file', 'kind': 'failed' or 'skipped', 'stage', 'error_type',
+    'error'}, plus 'line' and 'function' for skipped declarations.
+    Returns the number of records.
+    """
+    count = 0
+    with open(path, "w", encoding='utf-8') as f:
+        for r in results:
+            if not r['ok']:
+                records = [{'file': r['file'], 'kind': 'failed', 'stage': r['stage'], 'error_type': r['error_type'],
+                            'error': r['error']}]
+            else:
+                records = [{'file': r['file'], 'kind': 'skipped', 'stage': 'parse', 'error_type': 'ParseError',
+                            'error': item['error'], 'line': item['line'], 'function': item['function']}
+                           for item in r['skipped']]
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            count += len(records)
+    return count
+
+
+def _supervised_worker(conn, func, initializer, initargs):
+    # Worker process of SupervisedPool: runs (index, args) tasks until it gets None
+    if initializer:
+        initializer(*initargs)
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if task is None:
+            return
+        index, args = task
+        try:
+            outcome = (index, func(*args), None)
+        except Exception as e:
+            outcome = (index, None, (type(e).__name__, f"{type(e).__name__}: {e}"))
+        conn.send(outcome)
+
+
+class SupervisedPool:
+    """
+    Runs func(*args) for each task in `workers` worker processes, giving each
+    worker one task at a time, and yields (index, result, error) as tasks
+    finish. Unlike ProcessPoolExecutor, one bad input cannot stall or break
+    the pool: a worker still busy with a task after `timeout` seconds is
+    killed and replaced (error ('WorkerTimeout', message)), and a worker that
+    dies (crash, out of memory) only fails its own task ('WorkerCrash').
+    An exception raised by func gives (class name, message).
+    """
+    def __init__(self, func, workers, timeout=None, initializer=None, initargs=()):
+        import multiprocessing
+        self._context = multiprocessing.get_context()
+        self.func = func
+        self.workers = max(1, workers)
+        self.timeout = timeout or None
+        self.initializer = initializer
+        self.initargs = initargs
+
+    def _start_worker(self):
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_supervised_worker, daemon=True,
+                                        args=(child_conn, self.func, self.initializer, self.initargs))
+        process.start()
+        child_conn.close() # Only the worker holds its end, so the pipe reports EOF when the worker dies
+        return {'process': process, 'conn': conn, 'task': None, 'deadline': None}
+
+    @staticmethod
+    def _stop_worker(worker, kill=False):
+        if kill:
+            worker['process'].kill()
+        else:
+            with contextlib.suppress(OSError):
+                worker['conn'].send(None)
+        worker['process'].join(timeout=None if kill else 5)
+        if worker['process'].is_alive():
+            worker['process'].kill()
+            worker['process'].join()
+        worker['conn'].close()
+
+    def imap_unordered(self, tasks):
+        """Yields (index into tasks, result or None, error or None) for every args tuple in tasks."""
+        from multiprocessing.connection import wait
+        pending = list(enumerate(tasks))[::-1] # Popped from the end, in input order
+        workers = [self._start_worker() for _ in range(min(self.workers, len(pending)))]
+        try:
+            while True:
+                for worker in workers:
+                    if worker['task'] is None and pending:
+                        worker['task'] = pending.pop()
+                        worker['conn'].send(worker['task'])
+                        worker['deadline'] = time.monotonic() + self.timeout if self.timeout else None
+                busy = [worker for worker in workers if worker['task'] is not None]
+                if not busy:
+                    return
+                deadlines = [worker['deadline'] for worker in busy if worker['deadline'] is not None]
+                ready = wait([worker['conn'] for worker in busy],
+                             max(0.0, min(deadlines) - time.monotonic()) if deadlines else None)
+                for i, worker in enumerate(workers):
+                    if worker['task'] is None:
+                        continue
+                    index = worker['task'][0]
+                    if worker['conn'] in ready:
+                        try:
+                            outcome = worker['conn'].recv()
+                        except (EOFError, OSError):
+                            worker['process'].join()
+                            outcome = (index, None, ('WorkerCrash',
+                                                     f"Worker process died (exit code {worker['process'].exitcode})"))
+                            self._stop_worker(worker, kill=True)
+                            workers[i] = worker = self._start_worker()
+                        worker['task'] = None
+                        yield outcome
+                    elif worker['deadline'] is not None and time.monotonic() >= worker['deadline']:
+                        self._stop_worker(worker, kill=True)
+                        workers[i] = self._start_worker()
+                        yield index, None, ('WorkerTimeout', f"No result within {self.timeout}s; worker killed")
+        finally:
+            for worker in workers:
+                self._stop_worker(worker, kill=worker['task'] is not None)
+
+
+def run_batch(c_files, output_dir="flowcharts", jobs=None, c_compiler='gcc', include_paths=None, image_format='png', cache=None,
+              preprocessor='compiler', render_jobs=None, per_function=False, max_nodes=DEFAULT_MAX_NODES,
+              profile=False, profile_memory=False, cprofile_dir=None, max_label_length=DEFAULT_MAX_LABEL_LENGTH,
+              recover=True, preprocess_timeout=DEFAULT_PREPROCESS_TIMEOUT, render_timeout=DEFAULT_RENDER_TIMEOUT,
+              file_timeout=DEFAULT_FILE_TIMEOUT):
+    """
+    Generates one flowchart per C file, fanning the work out over a
+    SupervisedPool of `jobs` worker processes (default: CPU count). A file
+    that takes longer than file_timeout seconds has its worker killed and
+    fails on its own; with jobs=1 and no file_timeout the files are processed
+    in-process.
+    Workers only write .dot files; images are rendered concurrently by a
+    RenderQueue of `render_jobs` dot processes as the .dot files arrive
+    (image_format 'dot' or None skips rendering).
+    Outputs mirror the input tree under output_dir. Returns the result dicts
+    (with a 'profile' record each when profile=True, see process_c_file).
+    """
+    if not c_files:
+        print("WARNING: No C files to process.")
+        return []
+
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in c_files])
+    tasks = [(f, batch_output_base(f, root, output_dir)) for f in c_files]
+    jobs = jobs or os.cpu_count() or 1
+    print(f"INFO: Processing {len(tasks)} C file(s) with {jobs} worker(s) into {output_dir}")
+
+    render_queue = RenderQueue(image_format, render_jobs, timeout=render_timeout) \
+        if image_format in IMAGE_FORMATS and image_format != 'dot' else None
+    results = []
+    start = time.perf_counter()
+
+    def report(result):
+        results.append(result)
+        status = "OK" if result['ok'] else f"FAILED ({result['stage']})"
+        if result['ok'] and result['skipped']:
+            status = f"OK, {len(result['skipped'])} declaration(s) skipped"
+        print(f"[{len(results)}/{len(tasks)}] {status}: {result['file']}")
+        if render_queue and result['ok']:
+            for dot_filepath in result['dots']:
+                render_queue.submit(dot_filepath)
+
+    process = functools.partial(process_c_file, c_compiler=c_compiler, include_paths=include_paths,
+                                image_format=image_format, cache=cache, preprocessor=preprocessor, render_images=False,
+                                per_function=per_function, max_nodes=max_nodes, profile=profile,
+                                profile_memory=profile_memory, cprofile_dir=cprofile_dir,
+                                max_label_length=max_label_length, recover=recover,
+                                preprocess_timeout=preprocess_timeout, render_timeout=render_timeout)
+    if jobs == 1 and not file_timeout:
+        for c_file, output_base in tasks:
+            report(process(c_file, output_base))
+    else:
+        # Resolve fake_libc_include once here and hand it to the workers
+        pool = SupervisedPool(process, jobs, file_timeout, initializer=set_pycparser_fake_libc_path,
+                              initargs=(get_pycparser_fake_libc_path(),))
+        for index, result, error in pool.imap_unordered(tasks):
+            if error:
+                result = _new_result(*tasks[index])
+                result['stage'] = 'worker'
+                result['error_type'], result['error'] = error
+            report(result)
+
+    render_elapsed = None
+    if render_queue:
+        print(f"INFO: Waiting for {image_format.upper()} rendering to finish...")
+        rendered, render_elapsed = render_queue.close()
+        for result in results:
+            outcomes = [rendered[p] for p in result['dots'] if p in rendered]
+            if not outcomes:
+                continue
+            result['times']['render'] = sum(seconds for _, _, seconds in outcomes)
+            if 'profile' in result: # Rendered by dot processes: wall time only
+                result['profile']['stages']['render'] = {'wall': result['times']['render']}
+                result['profile']['total_wall'] += result['times']['render']
+            errors = [error for _, error, _ in outcomes if error]
+            if errors:
+                result['ok'] = False
+                result['stage'] = 'render'
+                result['error'] = errors[0]
+                result['error_type'] = 'StageTimeout' \
+                    if any(p in render_queue.timed_out for p in result['dots']) else 'RenderError'
+
+    elapsed = time.perf_counter() - start
+    results.sort(key=lambda r: r['file'])
+    print_batch_summary(results, elapsed, render_elapsed)
+    return results
+
+
+# --- Call graph (whole program, across translation units) ---
+_DOT_CALLGRAPH_ATTRS = {
+    'defined': (('shape', 'box'), ('style', 'rounded')),
+    'main': (('shape', 'Mdiamond'),),
+    'external': (('color', 'grey50'), ('fontcolor', 'grey30'), ('shape', 'ellipse'), ('style', 'dashed')),
+}
+
+
+def _load_c_file(c_file, result, c_compiler='gcc', include_paths=None, preprocessor='compiler', cache=None,
+                 recover=True, preprocess_timeout=DEFAULT_PREPROCESS_TIMEOUT):
+    # read -> load_c_code for the analysis modes; result['stage'] tracks the stage for error reports
+    result['stage'] = 'read'
+    c_code = _read_c_file(c_file)
+    return load_c_code(c_code, result, c_compiler, _file_include_paths(c_file, include_paths), preprocessor, cache,
+                       recover, preprocess_timeout, c_file)[1]
+
+
+def _new_file_result(c_file, **fields):
+    # The result dict of the analysis modes (extract_file_calls, file_metrics), before anything has run
+    return dict({'file': c_file, 'ok': False, 'stage': None, 'error': None, 'error_type': None, 'skipped': []},
+                **fields)
+
+
+def _map_files(func, c_files, jobs, file_timeout, new_result, initializer=None, initargs=()):
+    """
+    Yields func(c_file) for every C file, in input order. Like run_batch, the
+    files go to a SupervisedPool of `jobs` workers (in-process with jobs=1 and
+    no file_timeout), so a file that hangs or crashes its worker only fails
+    itself: it yields new_result(c_file) with stage 'worker' and the error.
+    """
+    if jobs == 1 and not file_timeout:
+        yield from map(func, c_files)
+        return
+    pool = SupervisedPool(func, jobs, file_timeout, initializer=initializer or set_pycparser_fake_libc_path,
+                          initargs=initargs or (get_pycparser_fake_libc_path(),))
+    done, next_index = {}, 0
+    for index, result, error in pool.imap_unordered([(c_file,) for c_file in c_files]):
+        if error:
+            result = new_result(c_files[index])
+            result['stage'] = 'worker'
+            result['error_type'], result['error'] = error
+        done[index] = result
+        while next_index in done: # Out-of-order results wait for the files before them
+            yield done.pop(next_index)
+            next_index += 1
+
+
+def extract_file_calls(c_file, c_compiler='gcc', include_paths=None, preprocessor='compiler', cache=None,
+                       recover=True, preprocess_timeout=DEFAULT_PREPROCESS_TIMEOUT):
+    """
+    Reads, preprocesses and parses one C file (see load_c_code) and extracts
+    its call summary (see callgraph.extract_calls). Like process_c_file it
+    never raises: it returns {'file', 'ok', 'stage', 'error', 'error_type', 'skipped', 'summary'}.
+    """
+    result = _new_file_result(c_file, summary=None)
+    try:
+        ast = _load_c_file(c_file, result, c_compiler, include_paths, preprocessor, cache, recover, preprocess_timeout)
+        result['stage'] = 'visit'
+        result['summary'] = callgraph.extract_calls(ast, c_file)
+        result['ok'], result['stage'] = True, None
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+        result['error_type'] = type(e).__name__
+    return result
+
+
+def build_call_graph(c_files, jobs=None, c_compiler='gcc', include_paths=None, preprocessor='compiler', cache=None,
+                     recover=True, preprocess_timeout=DEFAULT_PREPROCESS_TIMEOUT, file_timeout=DEFAULT_FILE_TIMEOUT):
+    """
+    Builds the call graph of a whole program. The C files are parsed by a
+    SupervisedPool of `jobs` worker processes (default: CPU count; see
+    _map_files for file_timeout), which send back call summaries only; these
+    are merged into one callgraph.CallGraph in input order, so symbol ids are
+    stable from run to run. Returns (graph, extract_file_calls results).
+    """
+    graph = callgraph.CallGraph()
+    results = []
+    jobs = jobs or os.cpu_count() or 1
+    extract = functools.partial(extract_file_calls, c_compiler=c_compiler, include_paths=include_paths,
+                                preprocessor=preprocessor, cache=cache, recover=recover,
+                                preprocess_timeout=preprocess_timeout)
+
+    for result in _map_files(extract, c_files, jobs, file_timeout, functools.partial(_new_file_result, summary=None)):
+        results.append(result)
+        if result['ok']:
+            graph.merge(result['summary'])
+            if result['skipped']:
+                print(f"WARNING: {result['file']} does not parse as a whole; "
+                      f"left out {len(result['skipped'])} declaration(s)")
+        else:
+            print(f"WARNING: Skipped {result['file']} ({result['stage']}): {result['error']}")
+    return graph, results
+
+
+def callgraph_to_digraph(graph):
+    """DOT back end of a callgraph.CallGraph: defined functions are boxes, external ones dashed ellipses."""
+    Digraph = _import_graphviz().Digraph
+    dot = Digraph(comment='C Call Graph', strict=True)
+    dot.attr(rankdir='LR')
+    lines = []
+    for symbol_id, (name, key) in enumerate(zip(graph.names, graph.keys)):
+        if not graph.is_defined(symbol_id):
+            style = 'external'
+        else:
+            style = 'main' if key == 'main' else 'defined'
+        label = name if key == name else f"{name}\n({os.path.basename(key[:-len(name) - 1])})"
+        lines.append(f"\tnode{symbol_id}{_dot_attr_list(label, _DOT_CALLGRAPH_ATTRS[style])}\n")
+    lines.extend(f"\tnode{src} -> node{dst}\n" for src, dst in graph.calls())
+    dot.body.extend(lines)
+    return dot
+
+
+def write_call_graph(graph, output_base, image_format='png', max_nodes=DEFAULT_MAX_NODES):
+    """
+    Writes <output_base>.json and <output_base>.dot and renders the image
+    unless image_format is 'dot'/None or the graph has more than max_nodes
+    functions (Graphviz layout would take too long; 0 always renders).
+    Returns the paths written.
+    """
+    out_dir = os.path.dirname(output_base)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    json_path = f"{output_base}.json"
+    _write_text(json_path, graph.to_json())
+    paths = [json_path, render(callgraph_to_digraph(graph), output_base, image_format=None)]
+    if image_format in IMAGE_FORMATS and image_format != 'dot':
+        if max_nodes and len(graph) > max_nodes:
+            print(f"INFO: Call graph has {len(graph)} functions (more than --max-nodes {max_nodes}); image not rendered.")
+        else:
+            paths.append(render_dot_file(paths[1], image_format))
+    return paths
+
+
+def print_call_graph_symbol(graph, name):
+    ids = graph.lookup(name)
+    if not ids:
+        print(f"Function '{name}' is not in the call graph.")
+    for symbol_id in ids:
+        where = ", ".join(f"{file}:{line}" for file, line in graph.definitions.get(symbol_id, [])) or "external"
+        print(f"{graph.keys[symbol_id]} ({where})")
+        print(f"  calls:     {', '.join(graph.keys[i] for i in graph.callees(symbol_id)) or '-'}")
+        print(f"  called by: {', '.join(graph.keys[i] for i in graph.callers(symbol_id)) or '-'}")
+
+
+# --- Static metrics (no rendering) ---
+METRIC_FIELDS = ('file', 'function', 'line', 'complexity', 'max_nesting', 'max_loop_depth', 'exits',
+                 'unreachable', 'nodes', 'edges')
+
+
+class MetricsVisitor(FlowchartVisitor):
+    """
+    FlowchartVisitor that measures each function as it is built, in the same
+    pass: nesting is tracked while the AST is walked, and the rest comes from
+    the function's part of the CFG, which is then drained, so memory stays
+    bounded by the largest function. `functions` holds one dict per function
+    with the METRIC_FIELDS (except 'file') plus 'unreachable_lines':
+      complexity      McCabe's cyclomatic complexity: 1 + the number of
+                      extra branches (each node with k > 1 successors adds k-1)
+      max_nesting     deepest if/switch/loop nesting ('else if' is not deeper)
+      max_loop_depth  deepest while/do/for nesting
+      exits           reachable return statements, plus the end of the body
+                      when control can fall off it
+      unreachable     statements no path from the function entry reaches
+                      (e.g. code after return, break or goto)
+    """
+    def __init__(self, label_renderer=None):
+        super().__init__(label_renderer=label_renderer)
+        self.functions = []
+        self._depths = [0, 0] # Current nesting, loop nesting
+        self._max_depths = [0, 0]
+        self._else_ifs = set() # The If nodes of 'else if' branches, which do not nest deeper
+
+    def _visit_nested(self, visit, node, nesting=1, loop=0):
+        depths, max_depths = self._depths, self._max_depths
+        depths[0] += nesting
+        depths[1] += loop
+        max_depths[0] = max(max_depths[0], depths[0])
+        max_depths[1] = max(max_depths[1], depths[1])
+        try:
+            visit(node)
+        finally:
+            depths[0] -= nesting
+            depths[1] -= loop
+
+    def visit_If(self, node):
+        nesting = 0 if id(node) in self._else_ifs else 1
+        self._else_ifs.discard(id(node))
+        if node.iffalse is not None and node.iffalse.__class__.__name__ == 'If':
+            self._else_ifs.add(id(node.iffalse))
+        self._visit_nested(super().visit_If, node, nesting)
+
+    def visit_Switch(self, node):
+        self._visit_nested(super().visit_Switch, node)
+
+    def visit_While(self, node):
+        self._visit_nested(super().visit_While, node, loop=1)
+
+    def visit_DoWhile(self, node):
+        self._visit_nested(super().visit_DoWhile, node, loop=1)
+
+    def visit_For(self, node):
+        self._visit_nested(super().visit_For, node, loop=1)
+
+    def visit_FuncDef(self, node):
+        self._depths, self._max_depths = [0, 0], [0, 0]
+        entry = len(self.cfg)
+        super().visit_FuncDef(node)
+        first_id, nodes, edges = self.cfg.drain()
+        nodes = nodes[entry - first_id:] # "Start" is drained with the first function
+        successors = [[] for _ in nodes]
+        edge_count = 0
+        for src, dst, _, _ in edges:
+            if src >= entry and dst >= entry: # Not the edges from "Start" or the previous function
+                successors[src - entry].append(dst - entry)
+                edge_count += 1
+        reached = [False] * len(nodes)
+        reached[0] = True
+        stack = [0]
+        while stack:
+            for succ in successors[stack.pop()]:
+                if not reached[succ]:
+                    reached[succ] = True
+                    stack.append(succ)
+        # Join points are bookkeeping rather than code, e.g. after an if whose branches both return
+        unreachable = [n for i, n in enumerate(nodes) if not reached[i] and n.kind != controlflow.MERGE]
+        self.functions.append({
+            'function': node.decl.name,
+            'line': nodes[0].line,
+            'complexity': 1 + sum(len(succ) - 1 for succ in successors if len(succ) > 1),
+            'max_nesting': self._max_depths[0],
+            'max_loop_depth': self._max_depths[1],
+            'exits': sum(1 for exit_node in self.chain_from if reached[exit_node - entry]),
+            'unreachable': len(unreachable),
+            'nodes': len(nodes),
+            'edges': edge_count,
+            'unreachable_lines': sorted({n.line for n in unreachable}),
+        })
+
+
+def compute_metrics(ast):
+    """Returns the per-function metrics of a FileAST (see MetricsVisitor), in source order."""
+    visitor = MetricsVisitor()
+    visitor.visit(ast)
+    return visitor.functions
+
+
+def file_metrics(c_file, c_compiler='gcc', include_paths=None, preprocessor='compiler', cache=None,
+                 recover=True, preprocess_timeout=DEFAULT_PREPROCESS_TIMEOUT):
+    """
+    Reads, preprocesses and parses one C file (see load_c_code) and measures
+    its functions. Never raises: returns {'file', 'ok', 'stage', 'error', 'error_type', 'skipped', 'functions'}.
+    """
+    result = _new_file_result(c_file, functions=[])
+    try:
+        ast = _load_c_file(c_file, result, c_compiler, include_paths, preprocessor, cache, recover, preprocess_timeout)
+        result['stage'] = 'visit'
+        result['functions'] = [dict(file=c_file, **metrics) for metrics in compute_metrics(ast)]
+        result['ok'], result['stage'] = True, None
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+        result['error_type'] = type(e).__name__
+    return result
+
+
+def _init_metrics_worker(fake_libc_path, stdout_to_stderr):
+    # Spawned workers start with the real stdout; keep it clean like the parent's for '--metrics -'
+    set_pycparser_fake_libc_path(fake_libc_path)
+    if stdout_to_stderr:
+        sys.stdout = sys.stderr
+
+
+def run_metrics(c_files, jobs=None, c_compiler='gcc', include_paths=None, preprocessor='compiler', cache=None,
+                recover=True, preprocess_timeout=DEFAULT_PREPROCESS_TIMEOUT, file_timeout=DEFAULT_FILE_TIMEOUT):
+    """
+    Measures every C file over a SupervisedPool of `jobs` worker processes
+    (see _map_files). Returns the file_metrics results in input order.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    measure = functools.partial(file_metrics, c_compiler=c_compiler, include_paths=include_paths,
+                                preprocessor=preprocessor, cache=cache, recover=recover,
+                                preprocess_timeout=preprocess_timeout)
+    return list(_map_files(measure, c_files, jobs, file_timeout, functools.partial(_new_file_result, functions=[]),
+                           _init_metrics_worker, (get_pycparser_fake_libc_path(), sys.stdout is sys.stderr)))
+
+
+def write_metrics_report(path, results):
+    """
+    Writes the per-function metrics of run_metrics results as JSON (path
+    ending in .json, including the failed files) or CSV (otherwise; '-'
+    is stdout).
+    """
+    rows = [metrics for result in results for metrics in result['functions']]
+    if path.endswith('.json'):
+        report = {'functions': rows,
+                  'failed': [{k: r[k] for k in ('file', 'stage', 'error')} for r in results if not r['ok']],
+                  'skipped': [{'file': r['file'], 'skipped': r['skipped']} for r in results if r['skipped']]}
+        _write_text(path, json.dumps(report, indent=1))
+        return
+    import csv
+    out = sys.stdout if path == '-' else open(path, "w", encoding='utf-8', newline='')
+    try:
+        writer = csv.writer(out)
+        writer.writerow(METRIC_FIELDS)
+        writer.writerows([row[field] for field in METRIC_FIELDS] for row in rows)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+# --- Watch mode (incremental per-function re-rendering) ---
+DEFAULT_WATCH_INTERVAL = 0.5 # Seconds between polls of the watched files' mtimes
+
+
+def funcdef_digests(ast):
+    """
+    Returns {function name: digest} for the FuncDefs of an AST, in source order.
+    The digest hashes the function's regenerated C, so it ignores formatting,
+    comments and line shifts but sees macro changes coming from headers.
+    """
+    c_gen = _import_pycparser().c_generator.CGenerator()
+    return {ext.decl.name: hashlib.sha1(c_gen.visit(ext).encode('utf-8')).hexdigest()
+            for ext in ast.ext if ext.__class__.__name__ == 'FuncDef'}
+
+
+class WatchSession:
+    """
+    Keeps the per-function flowcharts of one C file up to date.
+    update() preprocesses and parses the file again, but only rebuilds, writes
+    and renders the functions whose digest changed; the outputs of unchanged
+    functions stay on disk, and those of deleted functions are removed.
+    """
+    def __init__(self, c_file, output_base, c_compiler='gcc', include_paths=None, image_format='png', cache=None,
+                 preprocessor='compiler', max_nodes=DEFAULT_MAX_NODES, max_label_length=DEFAULT_MAX_LABEL_LENGTH,
+                 recover=True, preprocess_timeout=DEFAULT_PREPROCESS_TIMEOUT):
+        self.c_file = c_file
+        self.output_base = output_base
+        self.c_compiler = c_compiler
+        self.include_paths = include_paths
+        self.image_format = image_format
+        self.cache = cache
+        self.preprocessor = preprocessor
+        self.max_nodes = max_nodes
+        self.max_label_length = max_label_length
+        self.recover = recover
+        self.preprocess_timeout = preprocess_timeout
+        self.skipped = [] # Declarations left out by the last update (see parse_recovering)
+        self.functions = {} # name -> (digest, node_count, output bases), in source order
+        self.watched = {os.path.abspath(c_file): None} # path -> st_mtime_ns at the last update
+
+    def changed_files(self):
+        """Returns the watched files modified since the last update (files being replaced are skipped)."""
+        changed = []
+        for path, mtime in self.watched.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime:
+                    changed.append(path)
+            except OSError:
+                pass
+        return changed
+
+    @staticmethod
+    def _snapshot(paths):
+        watched = {}
+        for path in paths:
+            try:
+                watched[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                watched[path] = None
+        return watched
+
+    def _remove_outputs(self, bases):
+        for base in bases:
+            for ext in ('dot', self.image_format):
+                if ext and os.path.exists(f"{base}.{ext}"):
+                    os.remove(f"{base}.{ext}")
+
+    def update(self):
+        """
+        Brings the outputs up to date. Returns (changed function names, removed
+        function names, rendered {dot: (img, error, secs)}). Raises the errors of
+        the pipeline stages (e.g. ParseError); the previous outputs are kept then.
+        """
+        # Watch at least the C file itself, so a file that fails to preprocess is retried once it is saved again.
+        # The mtimes are taken before reading: a save landing while this update runs shows up as a change.
+        c_file = os.path.abspath(self.c_file)
+        self.watched = self._snapshot(set(self.watched) | {c_file})
+        c_code = _read_c_file(self.c_file)
+        load = {}
+        preprocessed, ast = load_c_code(c_code, load, self.c_compiler, self.include_paths, self.preprocessor, self.cache,
+                                        self.recover, self.preprocess_timeout, self.c_file)
+        self.skipped = load['skipped']
+
+        # fake_libc_include headers never change, so only the user's headers are polled
+        fake_libc = get_pycparser_fake_libc_path()
+        headers = [p for p in find_included_files(preprocessed)
+                   if not (fake_libc and p.startswith(os.path.abspath(fake_libc) + os.sep))]
+        # Headers included for the first time could not be snapshotted before reading
+        new_headers = self._snapshot(p for p in headers if p not in self.watched)
+        self.watched = {path: self.watched[path] if path in self.watched else new_headers[path]
+                        for path in [c_file] + headers}
+
+        digests = funcdef_digests(ast)
+        changed_defs = [ext for ext in ast.ext if ext.__class__.__name__ == 'FuncDef'
+                        and self.functions.get(ext.decl.name, (None,))[0] != digests[ext.decl.name]]
+        removed = [name for name in self.functions if name not in digests]
+
+        FileAST = _import_pycparser().c_ast.FileAST
+        charts = build_flowcharts(FileAST(changed_defs), per_function=True, max_nodes=self.max_nodes,
+                                  max_label_length=self.max_label_length)
+        dot_filepaths = []
+        for (name, node_count, parts), bases in zip(charts, flowchart_output_bases(self.output_base, charts)):
+            if name in self.functions:
+                self._remove_outputs(set(self.functions[name][2]) - set(bases)) # e.g. a graph no longer split
+            for dot, base in zip(parts, bases):
+                dot_filepaths.append(render(dot, base, image_format=None))
+            self.functions[name] = (digests[name], node_count, bases)
+        for name in removed:
+            self._remove_outputs(self.functions.pop(name)[2])
+        self.functions = {name: self.functions[name] for name in digests}
+
+        if changed_defs or removed:
+            write_flowchart_index(f"{self.output_base}_index.html",
+                                  [(name, node_count, ()) for name, (_, node_count, _) in self.functions.items()],
+                                  [bases for _, _, bases in self.functions.values()], self.image_format)
+
+        rendered = {}
+        if dot_filepaths and self.image_format not in (None, 'dot'):
+            queue = RenderQueue(self.image_format)
+            for dot_filepath in dot_filepaths:
+                queue.submit(dot_filepath)
+            rendered, _ = queue.close()
+        return [ext.decl.name for ext in changed_defs], removed, rendered
+
+
+def _mtime(path):
+    # None for a file that is gone, e.g. between an editor's atomic-save rename steps
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def watch(c_file, output_base, interval=DEFAULT_WATCH_INTERVAL, **options):
+    """
+    Watch mode: renders the per-function flowcharts of c_file, then polls it
+    and the headers it includes every `interval` seconds and re-renders only
+    the functions that changed, reporting the latency from save to image.
+    Runs until interrupted. options are passed on to WatchSession.
+    """
+    ParseError = _import_pycparser().c_parser.ParseError
+    session = WatchSession(c_file, output_base, **options)
+    print(f"INFO: Watching {c_file} and its headers (Ctrl+C to stop)...")
+    saved_at = time.time()
+    try:
+        while True:
+            try:
+                changed, removed, rendered = session.update()
+            except (ParseError, RuntimeError, OSError, UnicodeDecodeError) as e:
+                print(f"ERROR: [watch] {type(e).__name__}: {e}")
+            else:
+                latency = time.time() - saved_at
+                errors = [error for _, error, _ in rendered.values() if error]
+                if not changed and not removed:
+                    print(f"INFO: [watch] No function changed ({latency:.2f}s after save).")
+                else:
+                    print(f"INFO: [watch] {len(changed)}/{len(session.functions)} function(s) re-rendered"
+                          + (f": {', '.join(changed)}" if changed else "")
+                          + (f"; removed: {', '.join(removed)}" if removed else "")
+                          + f" ({latency:.2f}s after save)")
+                if session.skipped:
+                    print(f"WARNING: [watch] {c_file} does not parse as a whole; "
+                          f"left out {len(session.skipped)} declaration(s)")
+                if errors:
+                    print(f"ERROR: [watch] Graphviz failed for {len(errors)} graph(s): {errors[0].splitlines()[0]}")
+
+            changed_files = []
+            while not changed_files:
+                time.sleep(interval)
+                changed_files = session.changed_files()
+            mtimes = [mtime for mtime in map(_mtime, changed_files) if mtime is not None]
+            saved_at = max(mtimes, default=time.time())
+    except KeyboardInterrupt:
+        print("\nINFO: Watch stopped.")
+
+
+def _is_batch_input(path):
+    return path.startswith('@') or os.path.isdir(path) or glob.has_magic(path)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate a flowchart from C code.")
-    parser.add_argument("c_file", help="Path to the C source file.")
+    parser.add_argument("c_files", nargs='+', metavar="c_file",
+                        help="Path to the C source file. Several files, directories, glob patterns "
+                             "or '@filelist.txt' switch to batch mode.")
     parser.add_argument("-o", "--output", default="flowchart",
-                        help="Output filename base for .dot and .png (e.g., 'my_flowchart'). Default is 'flowchart'.")
+                        help="Output filename base for .dot and the image (e.g., 'my_flowchart'). Default is 'flowchart'.")
+    parser.add_argument("-T", "--format", choices=IMAGE_FORMATS + EXPORT_FORMATS, default='png',
+                        help="Image format to render. 'dot' only writes the DOT source and skips Graphviz; 'json' "
+                             "(compact JSON) and 'cfgb' (binary) export the control-flow graph itself, with source "
+                             "lines and function ranges, for client-side rendering. Default is 'png'.")
     parser.add_argument("--compiler", default="gcc", help="C compiler to use for preprocessing (e.g., gcc, clang). Default is 'gcc'.")
+    parser.add_argument("--preprocessor", choices=PREPROCESSOR_BACKENDS, default='compiler',
+                        help="'compiler' runs the --compiler with -E; 'builtin' preprocesses in-process "
+                             "without spawning a compiler per file. Default is 'compiler'.")
     parser.add_argument("-I", "--include", action="append", default=[],
                         help="Add directory to C include search paths (can be used multiple times).")
     parser.add_argument("--view", action="store_true", help="Attempt to open the generated flowchart image.")
+    parser.add_argument("--per-function", action="store_true",
+                        help="Write one flowchart per function (<output>_<function>) plus an index page.")
+    parser.add_argument("--max-nodes", type=int, default=DEFAULT_MAX_NODES,
+                        help="Split flowcharts with more nodes than this into linked parts to keep "
+                             f"Graphviz layout time bounded (0 disables). Default is {DEFAULT_MAX_NODES}.")
+    parser.add_argument("--max-label-length", type=int, default=DEFAULT_MAX_LABEL_LENGTH,
+                        help="Cut node labels longer than this many characters, ending them in '...' (0 keeps them whole). "
+                             f"Default is {DEFAULT_MAX_LABEL_LENGTH}.")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and re-render the flowcharts of the functions that change whenever the "
+                             "C file or its headers are saved (implies --per-function).")
+    parser.add_argument("--watch-interval", type=float, default=DEFAULT_WATCH_INTERVAL,
+                        help=f"Seconds between checks for changed files in --watch mode. Default is {DEFAULT_WATCH_INTERVAL}.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Write the DOT file while the C file is visited, one function at a time, so memory for "
+                             "the graph stays bounded on very large files (single whole-file flowchart, not split).")
+    parser.add_argument("--call-graph", action="store_true",
+                        help="Build the caller -> callee graph of all the given C files (files, directories, globs or "
+                             "'@filelist.txt') in parallel and write it to <output>.json and <output>.dot (plus the "
+                             "image unless it has more than --max-nodes functions).")
+    parser.add_argument("--symbol", action="append", default=[], metavar="NAME",
+                        help="With --call-graph: print where function NAME is defined, what it calls and what calls it "
+                             "(can be used multiple times).")
+    parser.add_argument("--metrics", metavar="REPORT",
+                        help="Instead of drawing flowcharts, measure every function of the given C files (files, "
+                             "directories, globs or '@filelist.txt') and write the metrics to REPORT: JSON if it ends "
+                             "in .json, else CSV ('-' prints CSV). No images are rendered.")
+    parser.add_argument("--max-complexity", type=int, default=None, metavar="N",
+                        help="With --metrics: list the functions whose cyclomatic complexity exceeds N and exit "
+                             "with status 1 if there are any (for pre-commit hooks).")
+    parser.add_argument("--output-dir", default=None,
+                        help="Batch mode: directory for the per-file outputs (mirrors the input tree). Default is 'flowcharts'.")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Batch mode: number of worker processes. Default is the CPU count.")
+    parser.add_argument("--render-jobs", type=int, default=None,
+                        help="Batch mode: number of concurrent Graphviz 'dot' processes. Default is the CPU count.")
+    parser.add_argument("--profile", nargs='?', const=DEFAULT_PROFILE_FILE, default=None, metavar="JSONL",
+                        help="Record per-stage wall/CPU time and input/graph sizes and append them as JSON lines "
+                             f"to JSONL (default '{DEFAULT_PROFILE_FILE}'), one record per C file.")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="With --profile: also record each stage's peak Python memory (tracemalloc; slower).")
+    parser.add_argument("--profile-cprofile", metavar="DIR", default=None,
+                        help="With --profile: run the stages under cProfile and write the stats of each file's "
+                             "slowest stage to DIR/<file>.<stage>.prof.")
+    parser.add_argument("--strict-parse", action="store_true",
+                        help="Fail on C code that does not parse as a whole instead of charting the top-level "
+                             "declarations and functions that do parse.")
+    parser.add_argument("--preprocess-timeout", type=float, default=DEFAULT_PREPROCESS_TIMEOUT, metavar="SECONDS",
+                        help="Kill the preprocessor after this long (0 for no limit). "
+                             f"Default is {DEFAULT_PREPROCESS_TIMEOUT}.")
+    parser.add_argument("--render-timeout", type=float, default=DEFAULT_RENDER_TIMEOUT, metavar="SECONDS",
+                        help=f"Kill Graphviz 'dot' after this long per graph (0 for no limit). Default is {DEFAULT_RENDER_TIMEOUT}.")
+    parser.add_argument("--file-timeout", type=float, default=DEFAULT_FILE_TIMEOUT, metavar="SECONDS",
+                        help="Batch, --call-graph and --metrics modes: kill and replace a worker that spends longer "
+                             "than this on one file, which then fails on its own (0 for no limit). "
+                             f"Default is {DEFAULT_FILE_TIMEOUT}.")
+    parser.add_argument("--errors", metavar="JSONL", default=None,
+                        help="Batch, --call-graph and --metrics modes: write one JSON line per failed file and per "
+                             "declaration skipped by parse recovery to JSONL.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Do not read or write the preprocessing/AST cache.")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help=f"Directory for the preprocessing/AST cache. Default is '{DEFAULT_CACHE_DIR}'.")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_CACHE_MAX_MB,
+                        help=f"Size limit of the cache in MB; least recently used entries are evicted. Default is {DEFAULT_CACHE_MAX_MB}.")
 
 
     args = parser.parse_args()
 
+    # '--metrics -' writes the CSV report to stdout, so every diagnostic (fake_libc discovery,
+    # visitor warnings, also those of the worker processes) goes to stderr until then
+    report_stdout = sys.stdout
+    if args.metrics == '-':
+        sys.stdout = sys.stderr
+
+    try:
+        _import_pycparser()
+        _import_graphviz()
+    except ImportError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+
+    cache = None if args.no_cache else FlowchartCache(args.cache_dir, args.cache_max_mb)
+    get_pycparser_fake_libc_path(persist_file=None if args.no_cache else os.path.join(args.cache_dir, FAKE_LIBC_PERSIST_FILE))
+
+    if args.call_graph:
+        try:
+            c_files = collect_c_files(args.c_files)
+        except OSError as e:
+            print(f"ERROR: Could not read file list: {e}")
+            sys.exit(1)
+        print(f"INFO: Extracting calls from {len(c_files)} C file(s)...")
+        start = time.perf_counter()
+        graph, results = build_call_graph(c_files, jobs=args.jobs, c_compiler=args.compiler, include_paths=args.include,
+                                          preprocessor=args.preprocessor, cache=cache, recover=not args.strict_parse,
+                                          preprocess_timeout=args.preprocess_timeout, file_timeout=args.file_timeout)
+        failures = [r for r in results if not r['ok']]
+        defined = len(graph.definitions)
+        print(f"INFO: Call graph: {len(graph)} functions ({defined} defined, {len(graph) - defined} external), "
+              f"{graph.call_count} calls, {graph.indirect_calls} indirect calls not resolved; "
+              f"{graph.files} file(s) merged, {len(failures)} failed, in {time.perf_counter() - start:.2f}s")
+        try:
+            for path in write_call_graph(graph, os.path.splitext(args.output)[0], args.format, args.max_nodes):
+                print(f"INFO: Wrote {path}")
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"ERROR: Could not write the call graph: {e}")
+            sys.exit(1)
+        for name in args.symbol:
+            print_call_graph_symbol(graph, name)
+        if args.errors:
+            try:
+                count = write_error_records(args.errors, results)
+                print(f"INFO: {count} error record(s) written to {args.errors}")
+            except OSError as e:
+                print(f"ERROR: Could not write error records: {e}")
+        sys.exit(1 if failures else 0)
+
+    if args.metrics:
+        try:
+            c_files = collect_c_files(args.c_files)
+        except OSError as e:
+            print(f"ERROR: Could not read file list: {e}", file=sys.stderr)
+            sys.exit(1)
+        start = time.perf_counter()
+        results = run_metrics(c_files, jobs=args.jobs, c_compiler=args.compiler, include_paths=args.include,
+                              preprocessor=args.preprocessor, cache=cache, recover=not args.strict_parse,
+                              preprocess_timeout=args.preprocess_timeout, file_timeout=args.file_timeout)
+        sys.stdout = report_stdout
+        try:
+            write_metrics_report(args.metrics, results)
+        except OSError as e:
+            print(f"ERROR: Could not write the metrics report: {e}", file=sys.stderr)
+            sys.exit(1)
+        functions = [m for r in results for m in r['functions']]
+        failures = [r for r in results if not r['ok']]
+        for r in failures:
+            print(f"WARNING: Skipped {r['file']} ({r['stage']}): {r['error']}", file=sys.stderr)
+        for r in results:
+            if r['skipped']:
+                print(f"WARNING: {r['file']} does not parse as a whole; left out {len(r['skipped'])} declaration(s)",
+                      file=sys.stderr)
+        print(f"INFO: Measured {len(functions)} function(s) in {len(results) - len(failures)} file(s) "
+              f"({len(failures)} failed) in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+        if args.errors:
+            try:
+                count = write_error_records(args.errors, results)
+                print(f"INFO: {count} error record(s) written to {args.errors}", file=sys.stderr)
+            except OSError as e:
+                print(f"ERROR: Could not write error records: {e}", file=sys.stderr)
+        too_complex = [m for m in functions if args.max_complexity is not None and m['complexity'] > args.max_complexity]
+        for m in too_complex:
+            print(f"{m['file']}:{m['line']}: {m['function']}() has cyclomatic complexity {m['complexity']} "
+                  f"(limit {args.max_complexity})", file=sys.stderr)
+        sys.exit(1 if failures or too_complex else 0)
+
+    is_batch = len(args.c_files) > 1 or args.output_dir or any(_is_batch_input(p) for p in args.c_files)
+    if is_batch and args.watch:
+        print("ERROR: --watch takes a single C file.")
+        sys.exit(1)
+    if args.stream and (is_batch or args.watch):
+        print("ERROR: --stream takes a single C file and cannot be combined with --watch.")
+        sys.exit(1)
+    if args.format in EXPORT_FORMATS and (args.stream or args.watch):
+        print(f"ERROR: -T {args.format} cannot be combined with --stream or --watch.")
+        sys.exit(1)
+    if args.format in EXPORT_FORMATS and args.per_function:
+        print(f"INFO: -T {args.format} exports one whole-file graph with its function ranges; --per-function is ignored.")
+    if args.stream and args.per_function:
+        print("INFO: --stream writes one whole-file flowchart; --per-function is ignored.")
+    if is_batch:
+        try:
+            c_files = collect_c_files(args.c_files)
+        except OSError as e:
+            print(f"ERROR: Could not read file list: {e}")
+            sys.exit(1)
+        results = run_batch(c_files,
+                            output_dir=args.output_dir or "flowcharts",
+                            jobs=args.jobs,
+                            c_compiler=args.compiler,
+                            preprocessor=args.preprocessor,
+                            include_paths=args.include,
+                            image_format=args.format,
+                            render_jobs=args.render_jobs,
+                            per_function=args.per_function,
+                            max_nodes=args.max_nodes,
+                            profile=bool(args.profile),
+                            profile_memory=args.profile_memory,
+                            cprofile_dir=args.profile_cprofile,
+                            max_label_length=args.max_label_length,
+                            recover=not args.strict_parse,
+                            preprocess_timeout=args.preprocess_timeout,
+                            render_timeout=args.render_timeout,
+                            file_timeout=args.file_timeout,
+                            cache=cache)
+        if args.errors:
+            try:
+                count = write_error_records(args.errors, results)
+                print(f"INFO: {count} error record(s) written to {args.errors}")
+            except OSError as e:
+                print(f"ERROR: Could not write error records: {e}")
+        if args.profile:
+            write_profile_records(args.profile, [dict(r['profile'], ok=r['ok']) for r in results], 'batch')
+            print(f"INFO: Profile of {len(results)} file(s) appended to {args.profile}")
+        sys.exit(0 if all(r['ok'] for r in results) else 1)
+
+    args.c_file = args.c_files[0]
+    profiler = StageProfiler(args.c_file, memory=args.profile_memory, cprofile=bool(args.profile_cprofile)) \
+        if args.profile else None
+
     try:
-        with open(args.c_file, "r", encoding='utf-8') as f:
-            c_code_content = f.read()
+        with _profiled(profiler, 'read'):
+            with open(args.c_file, "r", encoding='utf-8') as f:
+                c_code_content = f.read()
     except FileNotFoundError:
         print(f"ERROR: C file not found: {args.c_file}")
         sys.exit(1)
@@ -489,9 +2985,43 @@ if __name__ == "__main__":
     if c_file_dir not in args.include: # Avoid duplicates if user already specified it
         args.include.insert(0, c_file_dir)
 
+    if args.watch:
+        watch(args.c_file, os.path.splitext(args.output)[0],
+              interval=args.watch_interval,
+              c_compiler=args.compiler,
+              preprocessor=args.preprocessor,
+              include_paths=args.include,
+              image_format=args.format,
+              max_nodes=args.max_nodes,
+              max_label_length=args.max_label_length,
+              recover=not args.strict_parse,
+              preprocess_timeout=args.preprocess_timeout,
+              cache=cache)
+        sys.exit(0)
 
     create_flowchart(c_code_content,
                      output_filename=args.output,
                      c_compiler=args.compiler,
+                     preprocessor=args.preprocessor,
                      include_paths=args.include,
-                     view_image=args.view)
\ No newline at end of file
+                     view_image=args.view,
+                     image_format=args.format,
+                     per_function=args.per_function,
+                     max_nodes=args.max_nodes,
+                     profiler=profiler,
+                     stream=args.stream,
+                     max_label_length=args.max_label_length,
+                     recover=not args.strict_parse,
+                     preprocess_timeout=args.preprocess_timeout,
+                     render_timeout=args.render_timeout,
+                     cache=cache)
+
+    if profiler:
+        profiler.add(source_bytes=len(c_code_content.encode('utf-8')))
+        record = profiler.record()
+        print_profile(record)
+        if args.profile_cprofile:
+            record['cprofile'] = profiler.dump_hottest(args.profile_cprofile)
+            print(f"INFO: cProfile stats of the slowest stage ({record['hottest_stage']}) written to {record['cprofile']}")
+        write_profile_records(args.profile, [record], 'single')
+        print(f"INFO: Profile appended to {args.profile}")
\ No newline at end of file
@@ -0,0 +1,399 @@
+"""
+Local HTTP flowchart service for the web front end (index.html).
+
+Unlike one c2flow.py run per request, the service starts its worker
+processes once: each resolves fake_libc_include, builds pycparser's CParser
+and sets up the preprocessor when it starts, so a request only pays for the
+preprocessing, parsing, flowchart building and Graphviz layout of its own
+source. Results come back in the response body; nothing is written to the
+working directory. Identical requests that arrive while one is being
+computed share its result instead of being computed again.
+
+Endpoints:
+  POST /flowchart?format=svg|dot|json|cfgb  body: the C source (UTF-8)
+       format defaults to svg; json and cfgb are the control-flow graph
+       itself as compact JSON or binary (ControlFlowGraph.to_compact_dict
+       and to_bytes in controlflow.py), for rendering in the browser
+  GET  /health                          worker count and in-flight requests
+
+Posted sources may only include headers from fake_libc_include and the -I
+directories, and errors quote the preprocessor only about the posted source,
+so a request cannot read other files back. Browsers are refused unless
+their page's origin is given with --allow-origin (which also enables CORS
+for it).
+
+    python c2flow_server.py --port 8765 --preprocessor builtin
+    curl --data-binary @example.c 'http://127.0.0.1:8765/flowchart?format=dot'
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qs, urlsplit
+
+import c2flow
+
+RESPONSE_FORMATS = {
+    'svg': 'image/svg+xml',
+    'dot': 'text/vnd.graphviz; charset=utf-8',
+    'json': 'application/json',
+    'cfgb': 'application/octet-stream',
+}
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BODY = 1 << 20 # 1 MiB of C source per request
+WARM_UP_TIMEOUT = 60 # Seconds for every worker to start and initialise
+REASONS = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed',
+           413: 'Payload Too Large', 422: 'Unprocessable Entity', 500: 'Internal Server Error'}
+
+
+class FlowchartError(Exception):
+    """A request that cannot be turned into a flowchart; carries the HTTP status."""
+    def __init__(self, status, message):
+        super().__init__(status, message) # Both in args, so it survives pickling back from a worker
+        self.status = status
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+# --- Worker processes ---
+_worker_options = {}
+_worker_cache = None
+_worker_include_dirs = () # The only directories posted sources may include from, each ending in os.sep
+_warm_up_barrier = None
+
+def _init_worker(fake_libc_path, options, cache_dir, warm_up_barrier):
+    # Runs once per worker process: everything expensive that does not depend on the request
+    global _worker_cache, _worker_include_dirs, _warm_up_barrier
+    _worker_options.update(options)
+    c2flow.set_pycparser_fake_libc_path(fake_libc_path)
+    _worker_include_dirs = tuple(os.path.join(os.path.abspath(path), '')
+                                 for path in ([fake_libc_path] if fake_libc_path else []) + options['include_paths'])
+    c2flow._get_parser()
+    c2flow.get_preprocessor(options['c_compiler'], options['include_paths'], options['preprocessor'],
+                            options['preprocess_timeout'])
+    if cache_dir:
+        _worker_cache = c2flow.FlowchartCache(cache_dir)
+    _warm_up_barrier = warm_up_barrier
+
+
+def _warm_up():
+    # Every worker blocks here until all of them have initialised, so the warm-up
+    # tasks cannot all be taken by the first worker that starts
+    _warm_up_barrier.wait(WARM_UP_TIMEOUT)
+    return os.getpid()
+
+
+def _check_includes(preprocessed):
+    # The linemarkers name every file the preprocessor read. gcc reads stdc-predef.h for its
+    # command line before the source starts; everything after that came from the posted source.
+    names = [name.replace('\\\\', '\\') for name in c2flow._LINEMARKER_RE.findall(preprocessed)]
+    start = 0
+    if names[1:3] == ['<built-in>', '<command-line>']:
+        start = names.index(names[0], 3) if names[0] in names[3:] else len(names)
+    for name in names[start:]:
+        if name not in (names[0], '<built-in>', '<command-line>') \
+                and not os.path.abspath(name).startswith(_worker_include_dirs):
+            raise FlowchartError(403, "Only headers from fake_libc_include and the server's -I directories "
+                                      "can be included")
+
+
+def _source_diagnostic(error):
+    # Only what the preprocessor said about the posted source itself: its output and its
+    # diagnostics about other files can quote the contents of files on this machine
+    text = getattr(error, 'stderr', None) or str(error)
+    for line in text.splitlines():
+        if line.startswith('<stdin>:') and ': warning:' not in line and ': note:' not in line:
+            return line
+    return "the source could not be preprocessed"
+
+
+def flowchart_job(c_code, response_format):
+    """
+    Runs in a worker: C source -> (content bytes, {stage: seconds}).
+    Raises FlowchartError for errors in the submitted source.
+    """
+    ParseError = c2flow._import_pycparser().c_parser.ParseError
+    options = _worker_options
+    times = {}
+
+    def timed(stage, func, *args, **kwargs):
+        return c2flow._timed(times, stage, func, *args, **kwargs)
+
+    try:
+        _, ast = c2flow.load_c_code(c_code, {}, options['c_compiler'], options['include_paths'], options['preprocessor'],
+                                    _worker_cache, options['recover'], options['preprocess_timeout'], '<request>', timed,
+                                    verify=_check_includes)
+    except (ParseError, c2flow.StageTimeout) as e:
+        raise FlowchartError(422, f"{type(e).__name__}: {e}")
+    except RuntimeError as e: # PreprocessError, or the builtin preprocessor's PreprocessorError
+        raise FlowchartError(422, f"{type(e).__name__}: {_source_diagnostic(e)}")
+
+    cfg = c2flow._timed(times, 'visit', c2flow.build_cfg, ast)
+    if response_format == 'json':
+        return cfg.to_compact_json().encode('utf-8'), times
+    if response_format == 'cfgb':
+        return cfg.to_bytes(), times
+    source = c2flow.cfg_to_digraph(cfg).source.encode('utf-8')
+    if response_format == 'dot':
+        return source, times
+
+    # dot is run directly rather than through graphviz.pipe, which has no time limit
+    render_timeout = options['render_timeout']
+    try:
+        proc = c2flow._timed(times, 'render', subprocess.run, ['dot', f'-T{response_format}'], input=source,
+                             capture_output=True, check=True, timeout=render_timeout or None)
+    except FileNotFoundError:
+        raise FlowchartError(500, "Graphviz is not installed: 'dot' not found in PATH")
+    except subprocess.TimeoutExpired:
+        raise FlowchartError(422, f"Graphviz did not finish within {render_timeout}s; the flowchart is too large")
+    except subprocess.CalledProcessError as e:
+        raise FlowchartError(500, f"Graphviz failed: {(e.stderr or b'').decode(errors='ignore').strip()}")
+    return proc.stdout, times
+
+
+# --- HTTP front end ---
+class FlowchartServer:
+    """
+    asyncio HTTP/1.1 server (keep-alive, CORS for the allowed_origins only;
+    requests from any other browser origin are refused).
+    CPU work goes to a ProcessPoolExecutor; requests with the same source
+    and format while one is in flight await the same future. If a worker
+    dies, the requests it breaks fail with 500 and the pool is replaced by a
+    new one, so later requests are served again.
+    """
+    def __init__(self, workers=None, c_compiler='gcc', include_paths=None, preprocessor='compiler', cache_dir=None,
+                 max_body=DEFAULT_MAX_BODY, preprocess_timeout=c2flow.DEFAULT_PREPROCESS_TIMEOUT,
+                 render_timeout=c2flow.DEFAULT_RENDER_TIMEOUT, recover=True, allowed_origins=()):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_body = max_body
+        self.allowed_origins = set(allowed_origins)
+        self.options = {'c_compiler': c_compiler, 'include_paths': include_paths or [], 'preprocessor': preprocessor,
+                        'preprocess_timeout': preprocess_timeout, 'render_timeout': render_timeout, 'recover': recover}
+        self.cache_dir = cache_dir
+        self.pool = self._new_pool()
+        self.inflight = {} # request key -> asyncio.Future
+        self.stats = {'requests': 0, 'computed': 0, 'coalesced': 0, 'pool_restarts': 0}
+
+    def _new_pool(self):
+        context = multiprocessing.get_context()
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_worker,
+                                   initargs=(c2flow.get_pycparser_fake_libc_path(), self.options, self.cache_dir,
+                                             context.Barrier(self.workers)))
+
+    def _replace_pool(self, broken):
+        # Several requests can fail on the same broken pool; only the first replaces it
+        if self.pool is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.pool = self._new_pool()
+            self.stats['pool_restarts'] += 1
+            print("WARNING: A worker process died; the worker pool was restarted.")
+
+    async def warm_up(self):
+        """
+        Starts and initialises every worker now rather than on the first
+        requests. Returns the number of workers, which all took part.
+        """
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*(loop.run_in_executor(self.pool, _warm_up) for _ in range(self.workers)))
+        return len(set(pids))
+
+    async def flowchart(self, c_code, response_format):
+        key = hashlib.sha256(f"{response_format}\0{c_code}".encode('utf-8')).hexdigest()
+        future = self.inflight.get(key)
+        if future is not None:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(future)
+
+        loop = asyncio.get_running_loop()
+        pool = self.pool
+        try:
+            future = loop.run_in_executor(pool, flowchart_job, c_code, response_format)
+        except BrokenProcessPool: # Broken while idle or by an earlier request; this one has not run yet
+            self._replace_pool(pool)
+            pool = self.pool
+            future = loop.run_in_executor(pool, flowchart_job, c_code, response_format)
+        self.inflight[key] = future
+        self.stats['computed'] += 1
+        try:
+            return await asyncio.shield(future)
+        except BrokenProcessPool:
+            self._replace_pool(pool)
+            raise FlowchartError(500, "The worker process died while handling this source")
+        finally:
+            self.inflight.pop(key, None)
+
+    async def handle(self, method, target, body, origin=None):
+        """Returns (status, content type, body bytes, extra headers)."""
+        # Browsers send the Origin of cross-origin requests: any page the user visits could post here
+        if origin is not None and origin not in self.allowed_origins:
+            raise FlowchartError(403, f"Requests from {origin} are not allowed (see --allow-origin)")
+        url = urlsplit(target)
+        if method == 'OPTIONS':
+            return 204, None, b'', {'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                                    'Access-Control-Allow-Headers': 'Content-Type'}
+        if url.path == '/health':
+            payload = dict(self.stats, status='ok', workers=self.workers, inflight=len(self.inflight))
+            return 200, 'application/json', json.dumps(payload).encode('utf-8'), {}
+        if url.path != '/flowchart':
+            raise FlowchartError(404, f"Unknown path {url.path}")
+        if method != 'POST':
+            raise FlowchartError(405, "POST the C source to /flowchart")
+
+        response_format = parse_qs(url.query).get('format', ['svg'])[0]
+        if response_format not in RESPONSE_FORMATS:
+            raise FlowchartError(400, f"format must be one of {', '.join(RESPONSE_FORMATS)}")
+        try:
+            c_code = body.decode('utf-8')
+        except UnicodeDecodeError:
+            raise FlowchartError(400, "The C source must be UTF-8")
+
+        self.stats['requests'] += 1
+        start = time.perf_counter()
+        content, times = await self.flowchart(c_code, response_format)
+        timing = ', '.join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in times.items())
+        timing += f", total;dur={(time.perf_counter() - start) * 1000:.1f}"
+        return 200, RESPONSE_FORMATS[response_format], content, {'Server-Timing': timing}
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, 'application/json', b'{"error": "Malformed request line"}', {}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                origin = headers.get('origin')
+
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0: # The body cannot be delimited, so the connection cannot be reused
+                    await self._respond(writer, 400, 'application/json',
+                                        b'{"error": "Invalid Content-Length header"}', {}, False)
+                    break
+                if length > self.max_body:
+                    await self._respond(writer, 413, 'application/json',
+                                        json.dumps({'error': f"Source larger than {self.max_body} bytes"}).encode(), {}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                try:
+                    status, content_type, content, extra = await self.handle(method.upper(), target, body, origin)
+                except FlowchartError as e:
+                    status, content_type, content, extra = e.status, 'application/json', \
+                        json.dumps({'error': str(e)}).encode('utf-8'), {}
+                except Exception as e:
+                    print(f"ERROR: {method} {target}: {type(e).__name__}: {e}")
+                    status, content_type, content, extra = 500, 'application/json', \
+                        json.dumps({'error': f"{type(e).__name__}: {e}"}).encode('utf-8'), {}
+                await self._respond(writer, status, content_type, content, extra, keep_alive, origin)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, content_type, content, extra_headers, keep_alive, origin=None):
+        headers = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+                   f"Content-Length: {len(content)}",
+                   f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if origin in self.allowed_origins:
+            headers += [f"Access-Control-Allow-Origin: {origin}", "Vary: Origin"]
+        if content_type:
+            headers.append(f"Content-Type: {content_type}")
+        headers += [f"{name}: {value}" for name, value in extra_headers.items()]
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode('latin-1') + content)
+        await writer.drain()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+async def serve(host='127.0.0.1', port=DEFAULT_PORT, **options):
+    server = FlowchartServer(**options)
+    started = await server.warm_up()
+    listener = await asyncio.start_server(server.serve_connection, host, port)
+    print(f"INFO: {started} warm worker(s); serving flowcharts on http://{host}:{port}/flowchart")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve C-to-flowchart conversion over HTTP with warm worker processes.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on. Default is 127.0.0.1.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on. Default is {DEFAULT_PORT}.")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes. Default is the CPU count.")
+    parser.add_argument("--compiler", default="gcc", help="C compiler to use for preprocessing. Default is 'gcc'.")
+    parser.add_argument("--preprocessor", choices=c2flow.PREPROCESSOR_BACKENDS, default='compiler',
+                        help="'compiler' runs the --compiler with -E; 'builtin' preprocesses in-process. Default is 'compiler'.")
+    parser.add_argument("-I", "--include", action="append", default=[],
+                        help="Add directory to C include search paths (can be used multiple times).")
+    parser.add_argument("--max-body", type=int, default=DEFAULT_MAX_BODY,
+                        help=f"Largest accepted C source in bytes. Default is {DEFAULT_MAX_BODY}.")
+    parser.add_argument("--preprocess-timeout", type=float, default=c2flow.DEFAULT_PREPROCESS_TIMEOUT, metavar="SECONDS",
+                        help="Kill the preprocessor after this long (0 for no limit). "
+                             f"Default is {c2flow.DEFAULT_PREPROCESS_TIMEOUT}.")
+    parser.add_argument("--render-timeout", type=float, default=c2flow.DEFAULT_RENDER_TIMEOUT, metavar="SECONDS",
+                        help="Kill Graphviz 'dot' after this long (0 for no limit). "
+                             f"Default is {c2flow.DEFAULT_RENDER_TIMEOUT}.")
+    parser.add_argument("--allow-origin", action="append", default=[], metavar="ORIGIN",
+                        help="Accept browser requests from this origin, e.g. http://localhost:8000 ('null' for "
+                             "pages opened from files), and allow it to read the responses (CORS). "
+                             "Can be used multiple times. Default: no browser origin is accepted.")
+    parser.add_argument("--strict-parse", action="store_true",
+                        help="Reject C code that does not parse as a whole instead of charting the top-level "
+                             "declarations and functions that do parse.")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the preprocessing/AST cache.")
+    parser.add_argument("--cache-dir", default=c2flow.DEFAULT_CACHE_DIR,
+                        help=f"Directory for the preprocessing/AST cache. Default is '{c2flow.DEFAULT_CACHE_DIR}'.")
+    args = parser.parse_args()
+
+    try:
+        c2flow._import_pycparser()
+        c2flow._import_graphviz()
+    except ImportError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+    c2flow.get_pycparser_fake_libc_path(
+        persist_file=None if args.no_cache else os.path.join(args.cache_dir, c2flow.FAKE_LIBC_PERSIST_FILE))
+
+    try:
+        asyncio.run(serve(args.host, args.port,
+                          workers=args.jobs,
+                          c_compiler=args.compiler,
+                          include_paths=[os.path.abspath(p) for p in args.include],
+                          preprocessor=args.preprocessor,
+                          cache_dir=None if args.no_cache else args.cache_dir,
+                          max_body=args.max_body,
+                          preprocess_timeout=args.preprocess_timeout,
+                          render_timeout=args.render_timeout,
+                          recover=not args.strict_parse,
+                          allowed_origins=args.allow_origin))
+    except KeyboardInterrupt:
+        print("\nINFO: Server stopped.")
@@ -0,0 +1,195 @@
+"""
+Whole-program call graph used by c2flow.py.
+
+extract_calls() reduces one parsed translation unit to a small picklable
+summary (its function definitions and the functions each of them calls), so
+batch workers send summaries rather than ASTs. CallGraph.merge() folds the
+summaries into one graph: symbols are looked up in a dict index and calls
+are deduplicated in a set, so merging costs time linear in the number of
+calls, however many translation units there are.
+
+Functions with external linkage are one symbol program-wide, keyed by name.
+Static functions are keyed 'file:name', and calls inside their translation
+unit resolve to them. Called functions that no summary defines (library
+functions, code outside the inputs) are external symbols. Like
+FlowchartVisitor, this module works on pycparser class names and does not
+import pycparser itself.
+"""
+import json
+from array import array
+
+__version__ = '1'
+
+
+def _declared_variables(decls):
+    # Names of the declarations that are not functions: calls through them are calls through pointers
+    return {decl.name for decl in decls
+            if decl.__class__.__name__ == 'Decl' and decl.name and decl.type.__class__.__name__ != 'FuncDecl'}
+
+
+def extract_calls(ast, filename):
+    """
+    Returns the call summary of a FileAST:
+    {'file': filename, 'functions': [(name, line, [callee, ...]), ...],
+     'statics': [name, ...], 'indirect_calls': count}
+    Callees are listed once each, in order of their first call. Calls through
+    function pointers (variables, parameters, or other expressions) cannot be
+    resolved statically and are only counted.
+    """
+    functions = []
+    statics = set()
+    global_variables = _declared_variables(ast.ext)
+    indirect = 0
+    for ext in ast.ext:
+        node_type = ext.__class__.__name__
+        decl = ext.decl if node_type == 'FuncDef' else ext
+        if node_type in ('FuncDef', 'Decl') and 'static' in (decl.storage or ()) \
+                and (node_type == 'FuncDef' or decl.type.__class__.__name__ == 'FuncDecl'):
+            statics.add(decl.name)
+        if node_type != 'FuncDef':
+            continue
+        params = getattr(decl.type, 'args', None)
+        local_decls = list(params.params) if params else []
+        callees = {} # Name -> number of call sites, in order of the first call
+        stack = [ext.body]
+        while stack:
+            node = stack.pop()
+            walked_type = node.__class__.__name__
+            if walked_type == 'FuncCall':
+                if node.name.__class__.__name__ == 'ID':
+                    callees[node.name.name] = callees.get(node.name.name, 0) + 1
+                else:
+                    indirect += 1
+            elif walked_type == 'Decl':
+                local_decls.append(node)
+            # Reversed, so the walk (and the callee order) follows the source
+            stack.extend(child for _, child in reversed(node.children()))
+        variables = _declared_variables(local_decls) | global_variables
+        indirect += sum(count for name, count in callees.items() if name in variables)
+        functions.append((decl.name, decl.coord.line if decl.coord else 0,
+                          [name for name in callees if name not in variables]))
+    return {'file': filename, 'functions': functions, 'statics': sorted(statics), 'indirect_calls': indirect}
+
+
+class CallGraph:
+    """
+    Symbols are numbered 0..len(graph)-1 in the order they are first seen.
+    names[i] is the function name of symbol i and keys[i] its unique key (the
+    name, or 'file:name' for a static function); definitions maps the ids of
+    defined symbols to their [(file, line), ...] (several when the inputs
+    hold more than one program). Call i goes from call_src[i] to call_dst[i].
+    """
+    def __init__(self):
+        self.names = []
+        self.keys = []
+        self.index = {} # key -> id
+        self.static_ids = {} # name -> ids of the static functions of that name
+        self.definitions = {}
+        self.call_src = array('i')
+        self.call_dst = array('i')
+        self._calls = set() # src << 32 | dst, for deduplication
+        self.files = 0
+        self.indirect_calls = 0
+        self._adjacency = None
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def call_count(self):
+        return len(self.call_src)
+
+    def symbol(self, name, file=None):
+        """Returns the id of function name (the static one of file when file is given), adding it if new."""
+        key = f"{file}:{name}" if file else name
+        symbol_id = self.index.get(key)
+        if symbol_id is None:
+            symbol_id = self.index[key] = len(self.names)
+            self.names.append(name)
+            self.keys.append(key)
+            if file:
+                self.static_ids.setdefault(name, []).append(symbol_id)
+        return symbol_id
+
+    def add_call(self, caller, callee):
+        key = caller << 32 | callee
+        if key not in self._calls:
+            self._calls.add(key)
+            self.call_src.append(caller)
+            self.call_dst.append(callee)
+            self._adjacency = None
+
+    def merge(self, summary):
+        """Adds the functions and calls of an extract_calls() summary."""
+        file = summary['file']
+        statics = set(summary['statics'])
+        symbol = self.symbol
+        for name, line, callees in summary['functions']:
+            caller = symbol(name, file if name in statics else None)
+            self.definitions.setdefault(caller, []).append((file, line))
+            for callee in callees:
+                self.add_call(caller, symbol(callee, file if callee in statics else None))
+        self.files += 1
+        self.indirect_calls += summary['indirect_calls']
+
+    def lookup(self, name):
+        """Returns the ids of the functions called name: the external one, if any, then the static ones."""
+        ids = [self.index[name]] if name in self.index else []
+        return ids + self.static_ids.get(name, [])
+
+    def is_defined(self, symbol_id):
+        return symbol_id in self.definitions
+
+    def _get_adjacency(self):
+        if self._adjacency is None:
+            callees = [[] for _ in self.names]
+            callers = [[] for _ in self.names]
+            for src, dst in zip(self.call_src, self.call_dst):
+                callees[src].append(dst)
+                callers[dst].append(src)
+            self._adjacency = callees, callers
+        return self._adjacency
+
+    def callees(self, symbol_id):
+        return self._get_adjacency()[0][symbol_id]
+
+    def callers(self, symbol_id):
+        return self._get_adjacency()[1][symbol_id]
+
+    def calls(self):
+        """Yields (caller id, callee id) for every call, in the order they were merged."""
+        return zip(self.call_src, self.call_dst)
+
+    # --- JSON back end ---
+    def to_dict(self):
+        functions = []
+        for symbol_id, (name, key) in enumerate(zip(self.names, self.keys)):
+            function = {'id': symbol_id, 'name': name}
+            if key != name:
+                function['key'] = key # 'file:name' of a static function
+            if symbol_id in self.definitions:
+                function['defined'] = [list(site) for site in self.definitions[symbol_id]]
+            functions.append(function)
+        return {
+            'functions': functions,
+            'calls': [[src, dst] for src, dst in self.calls()],
+            'files': self.files,
+            'indirect_calls': self.indirect_calls,
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    @classmethod
+    def from_dict(cls, data):
+        graph = cls()
+        for function in data['functions']:
+            key = function.get('key')
+            symbol_id = graph.symbol(function['name'], key.rsplit(':', 1)[0] if key else None)
+            if 'defined' in function:
+                graph.definitions[symbol_id] = [tuple(site) for site in function['defined']]
+        for src, dst in data['calls']:
+            graph.add_call(src, dst)
+        graph.files = data.get('files', 0)
+        graph.indirect_calls = data.get('indirect_calls', 0)
+        return graph
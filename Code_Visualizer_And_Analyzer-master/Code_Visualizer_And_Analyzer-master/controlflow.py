@@ -0,0 +1,269 @@
+"""
+Compact control-flow graph used by c2flow.py.
+
+FlowchartVisitor records the flowchart here instead of building a
+graphviz.Digraph, so analyses can walk the graph and each output format is a
+separate back end (DOT lives in c2flow.py, which owns the graphviz import;
+JSON is below). Nodes are __slots__ records addressed by integer id (their
+index in `nodes`), labels are interned, and edges are parallel arrays of
+machine integers. Presentation (shapes, colours) is derived from the node
+and edge kinds by the back ends, so it is not stored per node.
+
+Besides the readable JSON of to_dict(), a graph can be exported for the
+browser front end as compact JSON (to_compact_dict: a label table and flat
+integer arrays) or as the equivalent binary (to_bytes), both with the node
+ranges of the functions so a viewer can expand one function at a time.
+"""
+import json
+import struct
+import sys
+from array import array
+
+__version__ = '1'
+
+# Node kinds
+START = 'start'
+END = 'end'
+FUNCTION = 'function'
+MAIN = 'main'             # Entry of main(); drawn differently from other functions
+STATEMENT = 'statement'
+DECL = 'decl'
+CONDITION = 'condition'   # if/while/do-while/for condition and switch expression
+STEP = 'step'             # for-loop init and increment
+MERGE = 'merge'           # Join point after an if, a loop or a switch, and the top of a do-while
+CASE = 'case'             # case/default label of a switch
+LABEL = 'label'           # goto target
+RETURN = 'return'
+BREAK = 'break'
+CONTINUE = 'continue'
+GOTO = 'goto'
+NODE_KINDS = (START, END, FUNCTION, MAIN, STATEMENT, DECL, CONDITION, STEP, MERGE, CASE, LABEL,
+              RETURN, BREAK, CONTINUE, GOTO)
+
+# Edge kinds, stored as one byte per edge
+EDGE_FLOW, EDGE_TRUE, EDGE_FALSE, EDGE_LOOP, EDGE_BREAK, EDGE_CONTINUE, EDGE_CASE, EDGE_GOTO = range(8)
+EDGE_KINDS = ('flow', 'true', 'false', 'loop', 'break', 'continue', 'case', 'goto')
+
+_BINARY_MAGIC = b'C2FG'
+
+
+class Node:
+    __slots__ = ('kind', 'label', 'line')
+
+    def __init__(self, kind, label, line=0):
+        self.kind = kind
+        self.label = label
+        self.line = line # Source line (pycparser coord) of the statement, 0 if unknown
+
+    def __repr__(self):
+        return f"Node({self.kind!r}, {self.label!r}, {self.line!r})"
+
+
+class ControlFlowGraph:
+    """
+    Nodes are numbered 0..len(cfg)-1 in creation order, which follows the
+    source. Edge i goes from edge_src[i] to edge_dst[i] and has kind
+    edge_kind[i]; the rare edges with a label of their own keep it in the
+    sparse edge_labels dict.
+    A streaming writer can drain() what has been recorded so far; ids keep
+    counting from first_id, and nodes[i] then holds node first_id + i.
+    """
+    def __init__(self):
+        self.first_id = 0
+        self.nodes = []
+        self.edge_src = array('i')
+        self.edge_dst = array('i')
+        self.edge_kind = array('B')
+        self.edge_labels = {}
+
+    def __len__(self):
+        return self.first_id + len(self.nodes)
+
+    @property
+    def edge_count(self):
+        return len(self.edge_src)
+
+    def add_node(self, kind, label='', line=0):
+        self.nodes.append(Node(kind, sys.intern(str(label)), line))
+        return self.first_id + len(self.nodes) - 1
+
+    def node(self, node_id):
+        return self.nodes[node_id - self.first_id]
+
+    def add_edge(self, src, dst, kind=EDGE_FLOW, label=None):
+        if label is not None:
+            self.edge_labels[len(self.edge_src)] = sys.intern(str(label))
+        self.edge_src.append(src)
+        self.edge_dst.append(dst)
+        self.edge_kind.append(kind)
+
+    def edges(self):
+        """Yields (src, dst, kind, label) for every edge, in creation order."""
+        labels = self.edge_labels
+        for i, (src, dst, kind) in enumerate(zip(self.edge_src, self.edge_dst, self.edge_kind)):
+            yield src, dst, kind, labels.get(i)
+
+    def drain(self):
+        """
+        Removes and returns what was recorded since the last drain as
+        (first node id, [Node, ...], [(src, dst, kind, label), ...]).
+        Edges may still refer to nodes drained earlier.
+        """
+        chunk = (self.first_id, self.nodes, list(self.edges()))
+        self.first_id += len(self.nodes)
+        self.nodes = []
+        self.edge_src = array('i')
+        self.edge_dst = array('i')
+        self.edge_kind = array('B')
+        self.edge_labels = {}
+        return chunk
+
+    def split_ranges(self, max_nodes):
+        """
+        Partitions the node ids still held (first_id..len(cfg)-1) into
+        consecutive (lo, hi) ranges of at most max_nodes nodes each; a single
+        range when max_nodes is 0/None.
+        """
+        if not max_nodes or len(self.nodes) <= max_nodes:
+            return [(self.first_id, len(self))]
+        return [(lo, min(lo + max_nodes, len(self))) for lo in range(self.first_id, len(self), max_nodes)]
+
+    def function_ranges(self):
+        """
+        Returns the (first, end) node id range of each function: from its entry
+        node up to the next function's entry (or the final End node).
+        """
+        entries = [i for i, node in enumerate(self.nodes, self.first_id) if node.kind in (FUNCTION, MAIN)]
+        last = len(self) - 1 if self.nodes and self.nodes[-1].kind == END else len(self)
+        return list(zip(entries, entries[1:] + [last]))
+
+    # --- JSON back end ---
+    def to_dict(self):
+        return {
+            'nodes': [dict({'id': i, 'kind': node.kind, 'label': node.label}, **({'line': node.line} if node.line else {}))
+                      for i, node in enumerate(self.nodes, self.first_id)],
+            'edges': [dict({'src': src, 'dst': dst, 'kind': EDGE_KINDS[kind]}, **({'label': label} if label else {}))
+                      for src, dst, kind, label in self.edges()],
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    @classmethod
+    def from_dict(cls, data):
+        cfg = cls()
+        for node in data['nodes']:
+            cfg.add_node(node['kind'], node['label'], node.get('line', 0))
+        for edge in data['edges']:
+            cfg.add_edge(edge['src'], edge['dst'], EDGE_KINDS.index(edge['kind']), edge.get('label'))
+        return cfg
+
+    # --- Compact JSON and binary back ends (for the browser front end) ---
+    def _tables(self):
+        # Label table (each distinct label once) plus the node/edge columns that index into it
+        labels, label_ids = [], {}
+
+        def label_id(label):
+            i = label_ids.get(label)
+            if i is None:
+                i = label_ids[label] = len(labels)
+                labels.append(label)
+            return i
+        kind_ids = {kind: i for i, kind in enumerate(NODE_KINDS)}
+        node_kinds = array('B', (kind_ids[node.kind] for node in self.nodes))
+        node_labels = array('i', (label_id(node.label) for node in self.nodes))
+        node_lines = array('i', (node.line for node in self.nodes))
+        edge_labels = array('i')
+        for i, label in sorted(self.edge_labels.items()):
+            edge_labels.extend((i, label_id(label)))
+        functions = array('i', (i for pair in self.function_ranges() for i in pair))
+        return labels, node_kinds, node_labels, node_lines, edge_labels, functions
+
+    def to_compact_dict(self):
+        """
+        Compact JSON form: labels is the label table; nodes is flat
+        [kind, label, line, ...] (kind indexes node_kinds, label indexes
+        labels); edges is flat [src, dst, kind, ...]; edge_labels is flat
+        [edge index, label, ...]; functions is flat [first, end, ...].
+        """
+        labels, node_kinds, node_labels, node_lines, edge_labels, functions = self._tables()
+        nodes = [0] * (3 * len(self.nodes))
+        nodes[0::3], nodes[1::3], nodes[2::3] = node_kinds, node_labels, node_lines
+        edges = [0] * (3 * self.edge_count)
+        edges[0::3], edges[1::3], edges[2::3] = self.edge_src, self.edge_dst, self.edge_kind
+        return {
+            'format': 'c2flow-cfg', 'version': int(__version__), 'first_id': self.first_id,
+            'node_kinds': list(NODE_KINDS), 'edge_kinds': list(EDGE_KINDS),
+            'labels': labels, 'nodes': nodes, 'edges': edges,
+            'edge_labels': edge_labels.tolist(), 'functions': functions.tolist(),
+        }
+
+    def to_compact_json(self):
+        return json.dumps(self.to_compact_dict(), separators=(',', ':'), ensure_ascii=False)
+
+    @classmethod
+    def from_compact_dict(cls, data):
+        cfg = cls()
+        cfg.first_id = data.get('first_id', 0)
+        labels, node_kinds, nodes, edges = data['labels'], data['node_kinds'], data['nodes'], data['edges']
+        for i in range(0, len(nodes), 3):
+            cfg.add_node(node_kinds[nodes[i]], labels[nodes[i + 1]], nodes[i + 2])
+        edge_labels = dict(zip(data['edge_labels'][0::2], data['edge_labels'][1::2]))
+        for i in range(0, len(edges), 3):
+            label = edge_labels.get(i // 3)
+            cfg.add_edge(edges[i], edges[i + 1], edges[i + 2], None if label is None else labels[label])
+        return cfg
+
+    def to_bytes(self):
+        """
+        Binary form, little-endian and 4-byte aligned so a browser can map
+        each column straight onto a typed array:
+          header   b'C2FG', u8 version, 3 pad bytes, then u32 counts: nodes,
+                   edges, edge labels, labels, functions, label bytes, first_id
+          labels   UTF-8 labels separated by NUL ('label bytes' long), padded to 4 bytes
+          int32    node label, node line, edge src, edge dst,
+                   edge labels (edge index, label) pairs, functions (first, end) pairs
+          uint8    node kind, edge kind (indexes into NODE_KINDS / EDGE_KINDS)
+        """
+        labels, node_kinds, node_labels, node_lines, edge_labels, functions = self._tables()
+        label_bytes = '\0'.join(labels).encode('utf-8')
+        columns = [node_labels, node_lines, array('i', self.edge_src), array('i', self.edge_dst), edge_labels, functions]
+        if sys.byteorder == 'big':
+            for column in columns:
+                column.byteswap()
+        header = _BINARY_MAGIC + struct.pack('<B3x7I', int(__version__), len(self.nodes), self.edge_count,
+                                             len(edge_labels) // 2, len(labels), len(functions) // 2,
+                                             len(label_bytes), self.first_id)
+        return b''.join([header, label_bytes, b'\0' * (-len(label_bytes) % 4)] + [column.tobytes() for column in columns]
+                        + [node_kinds.tobytes(), self.edge_kind.tobytes()])
+
+    @classmethod
+    def from_bytes(cls, data):
+        if data[:4] != _BINARY_MAGIC:
+            raise ValueError("Not a c2flow binary CFG")
+        version, n_nodes, n_edges, n_edge_labels, n_labels, n_functions, n_label_bytes, first_id = \
+            struct.unpack_from('<B3x7I', data, 4)
+        if version != int(__version__):
+            raise ValueError(f"Unsupported c2flow binary CFG version {version}")
+        offset = 4 + struct.calcsize('<B3x7I')
+        labels = data[offset:offset + n_label_bytes].decode('utf-8').split('\0') if n_labels else []
+        offset += n_label_bytes + (-n_label_bytes % 4)
+
+        def column(typecode, count):
+            nonlocal offset
+            values = array(typecode)
+            values.frombytes(data[offset:offset + count * values.itemsize])
+            if typecode != 'B' and sys.byteorder == 'big':
+                values.byteswap()
+            offset += count * values.itemsize
+            return values
+        node_labels, node_lines = column('i', n_nodes), column('i', n_nodes)
+        edge_src, edge_dst = column('i', n_edges), column('i', n_edges)
+        edge_labels = column('i', 2 * n_edge_labels)
+        column('i', 2 * n_functions) # Derived from the node kinds again
+        node_kinds, edge_kinds = column('B', n_nodes), column('B', n_edges)
+        return cls.from_compact_dict({
+            'first_id': first_id, 'labels': labels, 'node_kinds': NODE_KINDS, 'edge_labels': edge_labels.tolist(),
+            'nodes': [v for triple in zip(node_kinds, node_labels, node_lines) for v in triple],
+            'edges': [v for triple in zip(edge_src, edge_dst, edge_kinds) for v in triple],
+        })
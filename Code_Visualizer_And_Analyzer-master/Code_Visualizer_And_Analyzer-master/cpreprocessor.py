@@ -0,0 +1,732 @@
+"""
+Pure-Python C preprocessor, used by c2flow.py's `--preprocessor=builtin` backend.
+
+It covers what pycparser's input needs: #include against the user and
+fake_libc_include paths, object- and function-like #define (with #, ## and
+__VA_ARGS__), #undef, #if/#ifdef/#ifndef/#elif/#else/#endif and #error.
+The output carries gcc-style linemarkers, so AST coordinates and header
+tracking work the same as with `gcc -E`. Prepared (comment-stripped and
+tokenized) files are cached per process, so a batch reads and tokenizes
+each header only once.
+"""
+import ast as _py_ast
+import os
+import re
+import time
+
+__version__ = '1'
+
+MAX_INCLUDE_DEPTH = 200
+
+PREDEFINED_MACROS = {
+    '__STDC__': '1',
+    '__STDC_VERSION__': '199901L',
+    '__STDC_HOSTED__': '1',
+}
+
+
+class PreprocessorError(RuntimeError):
+    """Raised for #error, missing include files and malformed directives."""
+
+
+class PreprocessorTimeout(PreprocessorError):
+    """Raised when a run takes longer than the preprocessor's timeout (e.g. exponential macro expansion)."""
+
+
+class _NeedMoreInput(Exception):
+    # A function-like macro invocation continues on the next source line
+    pass
+
+
+# --- Tokens ---
+_EMPTY_SET = frozenset()
+
+class Token:
+    __slots__ = ('kind', 'text', 'ws', 'hs')
+
+    def __init__(self, kind, text, ws=False, hs=_EMPTY_SET):
+        self.kind = kind # 'id', 'num', 'str', 'chr', 'punct', 'paste', 'placemarker' or 'other'
+        self.text = text
+        self.ws = ws     # Preceded by whitespace
+        self.hs = hs     # Hide set: macros that must not expand this token again
+
+    def copy(self, ws=None, hs=None):
+        return Token(self.kind, self.text, self.ws if ws is None else ws, self.hs if hs is None else hs)
+
+    def __repr__(self):
+        return f"Token({self.kind!r}, {self.text!r})"
+
+
+_TOKEN_RE = re.compile(r'''
+    (?P<ws>[ \t\f\v\r]+)
+  | (?P<str>(?:u8|[LuU])?"(?:[^"\\\n]|\\.)*")
+  | (?P<chr>[LuU]?'(?:[^'\\\n]|\\.)*')
+  | (?P<id>[A-Za-z_$][A-Za-z0-9_$]*)
+  | (?P<num>\.?[0-9](?:[eEpP][+-]|[A-Za-z0-9_.])*)
+  | (?P<punct>\.\.\.|<<=|>>=|->|\+\+|--|<<|>>|<=|>=|==|!=|&&|\|\||[-+*/%&|^]=|\#\#|[][(){}.,;:?~!<>=+\-*/%&|^\#])
+  | (?P<other>.)
+''', re.VERBOSE)
+
+
+def tokenize(text):
+    tokens = []
+    ws = False
+    for m in _TOKEN_RE.finditer(text):
+        kind = m.lastgroup
+        if kind == 'ws':
+            ws = True
+            continue
+        tokens.append(Token(kind, m.group(), ws))
+        ws = False
+    return tokens
+
+
+def render_tokens(tokens):
+    parts = []
+    for tok in tokens:
+        if tok.kind == 'placemarker':
+            continue
+        if tok.ws and parts:
+            parts.append(' ')
+        parts.append(tok.text)
+    return ''.join(parts)
+
+
+# --- Prepared files (cached across preprocessor runs) ---
+_COMMENT_RE = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.DOTALL)
+_DIRECTIVE_RE = re.compile(r'\s*#\s*([A-Za-z_]\w*)?(.*)', re.DOTALL)
+
+
+def _strip_comment(match):
+    text = match.group()
+    if text[0] in '"\'':
+        return text
+    # Keep the newlines of block comments so line numbers stay right
+    return ' ' + '\n' * text.count('\n')
+
+
+class PreparedFile:
+    """
+    A source file split into logical lines: (line_no, directive, tokens, raw).
+    directive is None for text lines; raw is the text after the directive name.
+    guard is the include-guard macro when the whole file is wrapped in
+    #ifndef X / #define X ... #endif.
+    """
+    __slots__ = ('lines', 'guard')
+
+    def __init__(self, text):
+        text = _COMMENT_RE.sub(_strip_comment, text.replace('\r\n', '\n'))
+        lines = []
+        physical = text.split('\n')
+        i = 0
+        while i < len(physical):
+            line_no = i + 1
+            line = physical[i]
+            i += 1
+            while line.endswith('\\') and i < len(physical): # Line splicing
+                line = line[:-1] + physical[i]
+                i += 1
+            if not line.strip():
+                continue
+            m = _DIRECTIVE_RE.match(line)
+            if m:
+                name, rest = m.group(1), m.group(2)
+                if name is None: # Null directive '#'
+                    continue
+                lines.append((line_no, name, tokenize(rest), rest))
+            else:
+                lines.append((line_no, None, tokenize(line), line))
+        self.lines = lines
+        self.guard = self._find_include_guard()
+
+    def _find_include_guard(self):
+        lines = self.lines
+        if (len(lines) < 3 or lines[0][1] != 'ifndef' or lines[1][1] != 'define'
+                or lines[-1][1] != 'endif' or not lines[0][2] or not lines[1][2]
+                or lines[0][2][0].text != lines[1][2][0].text):
+            return None
+        depth = 0
+        for index, (_, directive, _, _) in enumerate(lines):
+            if directive in ('if', 'ifdef', 'ifndef'):
+                depth += 1
+            elif directive == 'endif':
+                depth -= 1
+                if depth == 0:
+                    return lines[0][2][0].text if index == len(lines) - 1 else None
+        return None
+
+
+_prepared_files = {} # path -> (mtime_ns, size, PreparedFile)
+
+def prepare_file(path):
+    """Returns the PreparedFile for path, reusing it while the file is unchanged."""
+    st = os.stat(path)
+    cached = _prepared_files.get(path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    with open(path, "r", encoding='utf-8', errors='replace') as f:
+        prepared = PreparedFile(f.read())
+    _prepared_files[path] = (st.st_mtime_ns, st.st_size, prepared)
+    return prepared
+
+
+def clear_file_cache():
+    _prepared_files.clear()
+
+
+# --- Macros ---
+class Macro:
+    __slots__ = ('name', 'params', 'variadic', 'body', 'index')
+
+    def __init__(self, name, params, variadic, body):
+        self.name = name
+        self.params = params # None for object-like macros
+        self.variadic = variadic
+        self.body = body
+        self.index = {p: i for i, p in enumerate(params)} if params else {}
+
+
+def _parse_define(tokens, where):
+    if not tokens or tokens[0].kind != 'id':
+        raise PreprocessorError(f"{where}: macro names must be identifiers")
+    name = tokens[0].text
+    params = None
+    variadic = False
+    pos = 1
+    if len(tokens) > 1 and tokens[1].text == '(' and not tokens[1].ws:
+        params = []
+        pos = 2
+        while True:
+            if pos >= len(tokens):
+                raise PreprocessorError(f"{where}: missing ')' in parameter list of macro '{name}'")
+            tok = tokens[pos]
+            pos += 1
+            if tok.text == ')' and not params:
+                break
+            if tok.text == '...':
+                params.append('__VA_ARGS__')
+                variadic = True
+            elif tok.kind == 'id':
+                params.append(tok.text)
+                if pos < len(tokens) and tokens[pos].text == '...': # GNU named variadic: args...
+                    variadic = True
+                    pos += 1
+            else:
+                raise PreprocessorError(f"{where}: unexpected '{tok.text}' in parameter list of macro '{name}'")
+            sep = tokens[pos].text if pos < len(tokens) else None
+            pos += 1
+            if sep == ')':
+                break
+            if sep != ',' or variadic:
+                raise PreprocessorError(f"{where}: expected ',' or ')' in parameter list of macro '{name}'")
+    body = []
+    for tok in tokens[pos:]:
+        # Only '##' written in the macro body is the paste operator, not one passed as an argument
+        body.append(Token('paste', '##', tok.ws) if tok.text == '##' else tok)
+    if body:
+        body[0] = body[0].copy(ws=False)
+    return Macro(name, params, variadic, body)
+
+
+def _stringify(tokens):
+    parts = []
+    for tok in tokens:
+        if tok.kind == 'placemarker':
+            continue
+        if tok.ws and parts:
+            parts.append(' ')
+        text = tok.text
+        if tok.kind in ('str', 'chr'):
+            text = text.replace('\\', '\\\\').replace('"', '\\"')
+        parts.append(text)
+    return '"' + ''.join(parts) + '"'
+
+
+# --- #if expression evaluation ---
+_BINARY_PRECEDENCE = {
+    '||': 1, '&&': 2, '|': 3, '^': 4, '&': 5,
+    '==': 6, '!=': 6, '<': 7, '>': 7, '<=': 7, '>=': 7,
+    '<<': 8, '>>': 8, '+': 9, '-': 9, '*': 10, '/': 10, '%': 10,
+}
+
+
+# #if arithmetic is done in intmax_t/uintmax_t; values are (int, is_unsigned) pairs
+_INTMAX_BITS = 64
+_UINTMAX_MASK = (1 << _INTMAX_BITS) - 1
+
+
+def _wrap(value, unsigned):
+    value &= _UINTMAX_MASK
+    if not unsigned and value >> (_INTMAX_BITS - 1):
+        value -= 1 << _INTMAX_BITS
+    return value, unsigned
+
+
+def _c_int(text):
+    digits = text.rstrip('uUlL')
+    if len(digits) > 1 and digits[0] == '0' and digits[1] not in 'xXbB':
+        value = int(digits, 8)
+    else:
+        value = int(digits, 0)
+    # A 'u' suffix, or a value only uintmax_t can hold, makes the constant unsigned
+    return _wrap(value, 'u' in text[len(digits):].lower() or value >> (_INTMAX_BITS - 1) != 0)
+
+
+def _c_char(text):
+    value = _py_ast.literal_eval(text.lstrip('LuU'))
+    return (ord(value[0]) if value else 0), False
+
+
+class _IfExpression:
+    def __init__(self, tokens, where):
+        self.tokens = tokens
+        self.pos = 0
+        self.where = where
+        self.skipping = 0 # > 0 inside an operand that is not evaluated (after 0 &&, 1 ||, the other ?: branch)
+
+    def _error(self, message):
+        raise PreprocessorError(f"{self.where}: {message} in #if expression")
+
+    def _peek(self):
+        return self.tokens[self.pos].text if self.pos < len(self.tokens) else None
+
+    def evaluate(self):
+        if not self.tokens:
+            self._error("missing expression")
+        value, _ = self._comma()
+        if self.pos != len(self.tokens):
+            self._error(f"unexpected '{self._peek()}'")
+        return value
+
+    def _skipped(self, skip, parse):
+        self.skipping += skip
+        try:
+            return parse()
+        finally:
+            self.skipping -= skip
+
+    def _comma(self):
+        # As in gcc, which only warns about it: the value of the last operand
+        value = self._ternary()
+        while self._peek() == ',':
+            self.pos += 1
+            value = self._ternary()
+        return value
+
+    def _ternary(self):
+        cond = self._binary(1)
+        if self._peek() != '?':
+            return cond
+        self.pos += 1
+        if_true = self._skipped(not cond[0], self._comma)
+        if self._peek() != ':':
+            self._error("expected ':'")
+        self.pos += 1
+        if_false = self._skipped(bool(cond[0]), self._ternary)
+        # Like the arithmetic operators, the result is unsigned if either branch is
+        return _wrap((if_true if cond[0] else if_false)[0], if_true[1] or if_false[1])
+
+    def _binary(self, min_prec):
+        lhs = self._unary()
+        while True:
+            op = self._peek()
+            prec = _BINARY_PRECEDENCE.get(op)
+            if prec is None or prec < min_prec:
+                return lhs
+            self.pos += 1
+            skip = (op == '&&' and not lhs[0]) or (op == '||' and lhs[0])
+            rhs = self._skipped(skip, lambda: self._binary(prec + 1))
+            lhs = self._apply(op, lhs, rhs)
+
+    def _apply(self, op, lhs, rhs):
+        if op == '||': return int(bool(lhs[0] or rhs[0])), False
+        if op == '&&': return int(bool(lhs[0] and rhs[0])), False
+        if op in ('<<', '>>'): # The result has the type of the left operand
+            value, shift = lhs[0], rhs[0]
+            if op == '>>':
+                shift = -shift
+            if lhs[1]:
+                value &= _UINTMAX_MASK
+            return _wrap(value << shift if shift >= 0 else value >> -shift, lhs[1])
+        # The usual arithmetic conversions: if either operand is unsigned, both are
+        unsigned = lhs[1] or rhs[1]
+        a, b = (lhs[0] & _UINTMAX_MASK, rhs[0] & _UINTMAX_MASK) if unsigned else (lhs[0], rhs[0])
+        if op == '==': return int(a == b), False
+        if op == '!=': return int(a != b), False
+        if op == '<': return int(a < b), False
+        if op == '>': return int(a > b), False
+        if op == '<=': return int(a <= b), False
+        if op == '>=': return int(a >= b), False
+        if op == '|': return _wrap(a | b, unsigned)
+        if op == '^': return _wrap(a ^ b, unsigned)
+        if op == '&': return _wrap(a & b, unsigned)
+        if op == '+': return _wrap(a + b, unsigned)
+        if op == '-': return _wrap(a - b, unsigned)
+        if op == '*': return _wrap(a * b, unsigned)
+        if op in ('/', '%'):
+            if not b:
+                if self.skipping: # As in gcc, only an evaluated division by zero is an error
+                    return 0, unsigned
+                self._error("division by zero")
+            quotient = abs(a) // abs(b) # C division truncates toward zero
+            if (a < 0) != (b < 0):
+                quotient = -quotient
+            return _wrap(quotient if op == '/' else a - quotient * b, unsigned)
+        raise AssertionError(op)
+
+    def _unary(self):
+        if self.pos >= len(self.tokens):
+            self._error("unexpected end")
+        tok = self.tokens[self.pos]
+        self.pos += 1
+        if tok.text == '(':
+            value = self._comma()
+            if self._peek() != ')':
+                self._error("missing ')'")
+            self.pos += 1
+            return value
+        if tok.text == '!': return int(not self._unary()[0]), False
+        if tok.text == '~':
+            value, unsigned = self._unary()
+            return _wrap(~value, unsigned)
+        if tok.text == '-':
+            value, unsigned = self._unary()
+            return _wrap(-value, unsigned)
+        if tok.text == '+': return self._unary()
+        try:
+            if tok.kind == 'num':
+                return _c_int(tok.text)
+            if tok.kind == 'chr':
+                return _c_char(tok.text)
+        except (ValueError, SyntaxError):
+            self._error(f"invalid constant '{tok.text}'")
+        if tok.kind == 'id': # Identifiers left after macro expansion evaluate to 0
+            return 0, False
+        self._error(f"unexpected '{tok.text}'")
+
+
+# --- The preprocessor ---
+class BuiltinPreprocessor:
+    """
+    In-process replacement for `cc -E`. include_paths are searched in order
+    for both "..." and <...> includes ("..." first tries the including file's
+    directory, or the working directory for source given as a string).
+    Calling the instance preprocesses one translation unit and returns the text.
+    A run longer than `timeout` seconds raises PreprocessorTimeout.
+    """
+    def __init__(self, include_paths=None, defines=None, timeout=None):
+        self.include_paths = [os.path.abspath(p) for p in (include_paths or [])]
+        self.defines = dict(PREDEFINED_MACROS)
+        self.defines.update(defines or {})
+        self.timeout = timeout or None
+
+    def __call__(self, c_code_string, filename='<stdin>'):
+        return _Run(self).run(c_code_string, filename)
+
+
+class _Run:
+    """State of one preprocessor invocation (macro table, output, #pragma once set)."""
+
+    def __init__(self, config):
+        self.include_paths = config.include_paths
+        self.timeout = config.timeout
+        self.deadline = time.monotonic() + config.timeout if config.timeout else None
+        self.work = 0 # Lines read and macro tokens produced, metered against the deadline
+        self.macros = {}
+        for name, value in config.defines.items():
+            self.macros[name] = _parse_define(tokenize(f"{name} {value}"), '<predefined>')
+        self.once = set()
+        self.out = []
+        self.file = None
+        self.line = 0
+
+    def run(self, c_code_string, filename):
+        base_dir = os.getcwd() if filename.startswith('<') else os.path.dirname(os.path.abspath(filename))
+        self._process(PreparedFile(c_code_string), filename, base_dir, 0)
+        self.out.append('')
+        return '\n'.join(self.out)
+
+    def _spend(self, work):
+        # Looks at the clock every 1024 units of work; macros can expand exponentially
+        before = self.work
+        self.work += work
+        if self.deadline is not None and (before ^ self.work) >> 10 and time.monotonic() > self.deadline:
+            raise PreprocessorTimeout(f"The builtin preprocessor did not finish within {self.timeout}s")
+
+    # --- Files and directives ---
+    def _marker(self, line_no, filename, flag=None):
+        self.out.append(f'# {line_no} "{filename}"' + (f' {flag}' if flag else ''))
+
+    def _process(self, prepared, filename, base_dir, depth):
+        self._marker(1, filename, 1 if depth else None)
+        next_out_line = 1 # Source line the next output line corresponds to
+        stack = [] # [parent_active, taken, seen_else] per open conditional
+        active = True
+        lines = prepared.lines
+        i = 0
+        while i < len(lines):
+            line_no, directive, tokens, raw = lines[i]
+            i += 1
+            where = f"{filename}:{line_no}"
+            self._spend(1)
+
+            if directive is not None:
+                if directive in ('if', 'ifdef', 'ifndef'):
+                    if active:
+                        taken = self._condition(directive, tokens, where)
+                        stack.append([True, taken, False])
+                        active = taken
+                    else:
+                        stack.append([False, True, False])
+                elif directive in ('elif', 'else', 'endif'):
+                    if not stack:
+                        raise PreprocessorError(f"{where}: #{directive} without #if")
+                    entry = stack[-1]
+                    if directive == 'endif':
+                        stack.pop()
+                        active = entry[0]
+                    elif entry[2]:
+                        raise PreprocessorError(f"{where}: #{directive} after #else")
+                    elif directive == 'else':
+                        active = entry[0] and not entry[1]
+                        entry[1] = entry[2] = True
+                    else:
+                        active = entry[0] and not entry[1] and self._condition('if', tokens, where)
+                        entry[1] = entry[1] or active
+                elif not active:
+                    pass
+                elif directive == 'define':
+                    macro = _parse_define(tokens, where)
+                    self.macros[macro.name] = macro
+                elif directive == 'undef':
+                    if tokens:
+                        self.macros.pop(tokens[0].text, None)
+                elif directive in ('include', 'include_next'):
+                    if self._include(tokens, raw, base_dir, where, depth):
+                        self._marker(line_no + 1, filename, 2)
+                        next_out_line = line_no + 1
+                elif directive == 'error':
+                    raise PreprocessorError(f"{where}: #error {raw.strip()}")
+                elif directive == 'pragma':
+                    if tokens and tokens[0].text == 'once':
+                        self.once.add(filename)
+                    else:
+                        next_out_line = self._emit(f"#pragma {raw.strip()}", line_no, next_out_line, filename)
+                # #line, #warning, #ident and unknown directives are ignored
+                continue
+
+            if not active:
+                continue
+
+            # Text line, possibly joined with following lines for a multi-line macro invocation
+            self.file, self.line = filename, line_no
+            while True:
+                has_more = i < len(lines) and lines[i][1] is None
+                try:
+                    expanded = self._expand(tokens, final=not has_more)
+                    break
+                except _NeedMoreInput:
+                    tokens = tokens + [lines[i][2][0].copy(ws=True)] + lines[i][2][1:]
+                    i += 1
+            next_out_line = self._emit(render_tokens(expanded), line_no, next_out_line, filename)
+
+        if stack:
+            raise PreprocessorError(f"{filename}: unterminated #if")
+
+    def _emit(self, text, line_no, next_out_line, filename):
+        gap = line_no - next_out_line
+        if 0 <= gap <= 8:
+            self.out.extend([''] * gap)
+        else:
+            self._marker(line_no, filename)
+        self.out.append(text)
+        return line_no + 1
+
+    def _condition(self, directive, tokens, where):
+        if directive == 'if':
+            expanded = self._expand(tokens, final=True, in_if=True)
+            return bool(_IfExpression(expanded, where).evaluate())
+        if not tokens or tokens[0].kind != 'id':
+            raise PreprocessorError(f"{where}: #{directive} needs a macro name")
+        defined = tokens[0].text in self.macros
+        return defined if directive == 'ifdef' else not defined
+
+    def _include(self, tokens, raw, base_dir, where, depth):
+        spec = raw.strip()
+        if not spec.startswith(('"', '<')): # Computed include: #include MACRO
+            spec = render_tokens(self._expand(tokens, final=True)).strip()
+        m = re.match(r'"([^"]*)"|<([^>]*)>', spec)
+        if not m:
+            raise PreprocessorError(f"{where}: #include expects \"FILENAME\" or <FILENAME>")
+        quoted = m.group(1) is not None
+        name = m.group(1) if quoted else m.group(2)
+
+        search = ([base_dir] if quoted else []) + self.include_paths
+        for directory in search:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                break
+        else:
+            raise PreprocessorError(f"{where}: {name}: No such file or directory")
+
+        path = os.path.normpath(os.path.abspath(path))
+        prepared = prepare_file(path)
+        if path in self.once or (prepared.guard and prepared.guard in self.macros):
+            return False
+        if depth >= MAX_INCLUDE_DEPTH:
+            raise PreprocessorError(f"{where}: #include nested too deeply")
+        self._process(prepared, path, os.path.dirname(path), depth + 1)
+        return True
+
+    # --- Macro expansion (Prosser's algorithm, with hide sets on tokens) ---
+    def _expand(self, tokens, final=True, in_if=False):
+        macros = self.macros
+        out = []
+        pending = tokens[::-1] # Stack: the next token is at the end
+        while pending:
+            tok = pending.pop()
+            if tok.kind != 'id':
+                out.append(tok)
+                continue
+            name = tok.text
+            if in_if and name == 'defined':
+                out.append(self._defined(pending, tok))
+                continue
+            macro = macros.get(name)
+            if macro is None or name in tok.hs:
+                if name == '__LINE__':
+                    tok = Token('num', str(self.line), tok.ws)
+                elif name == '__FILE__':
+                    tok = Token('str', '"' + (self.file or '').replace('\\', '\\\\') + '"', tok.ws)
+                out.append(tok)
+                continue
+
+            self._spend(1)
+            if macro.params is None:
+                body = self._substitute(macro, None, tok.hs | {name})
+            else:
+                if not pending:
+                    if not final:
+                        raise _NeedMoreInput()
+                    out.append(tok)
+                    continue
+                if pending[-1].text != '(': # A function-like macro name without arguments
+                    out.append(tok)
+                    continue
+                args, rparen = self._collect_args(pending, macro, final)
+                body = self._substitute(macro, args, (tok.hs & rparen.hs) | {name})
+            if body:
+                body[0] = body[0].copy(ws=True)
+            self._spend(len(body)) # Rescanned below
+            pending.extend(reversed(body))
+        return out
+
+    def _defined(self, pending, tok):
+        parens = bool(pending) and pending[-1].text == '('
+        if parens:
+            pending.pop()
+        if not pending or pending[-1].kind != 'id':
+            raise PreprocessorError("operator 'defined' requires an identifier")
+        name = pending.pop()
+        if parens:
+            if not pending or pending[-1].text != ')':
+                raise PreprocessorError("missing ')' after 'defined'")
+            pending.pop()
+        return Token('num', '1' if name.text in self.macros else '0', tok.ws)
+
+    def _collect_args(self, pending, macro, final):
+        pending.pop() # '('
+        args = [[]]
+        depth = 0
+        nparams = len(macro.params)
+        while True:
+            if not pending:
+                if not final:
+                    raise _NeedMoreInput()
+                raise PreprocessorError(f"unterminated argument list invoking macro '{macro.name}'")
+            tok = pending.pop()
+            if tok.text == '(':
+                depth += 1
+            elif tok.text == ')':
+                if depth == 0:
+                    break
+                depth -= 1
+            elif tok.text == ',' and depth == 0 and not (macro.variadic and len(args) == nparams):
+                args.append([])
+                continue
+            args[-1].append(tok)
+
+        if nparams == 0 and args == [[]]:
+            args = []
+        elif macro.variadic and len(args) == nparams - 1:
+            args.append([]) # Variadic part left out
+        if len(args) != nparams:
+            raise PreprocessorError(
+                f"macro '{macro.name}' requires {nparams} argument(s), but {len(args)} given")
+        return args, tok
+
+    def _substitute(self, macro, args, hs):
+        body = macro.body
+        index = macro.index
+        result = []
+        expanded_args = {}
+        n = len(body)
+        i = 0
+        while i < n:
+            tok = body[i]
+            if (tok.text == '#' and tok.kind == 'punct' and args is not None
+                    and i + 1 < n and body[i + 1].text in index):
+                result.append(Token('str', _stringify(args[index[body[i + 1].text]]), tok.ws))
+                i += 2
+                continue
+            if tok.kind == 'id' and tok.text in index:
+                arg_index = index[tok.text]
+                next_is_paste = i + 1 < n and body[i + 1].kind == 'paste'
+                prev_is_paste = i > 0 and body[i - 1].kind == 'paste'
+                if next_is_paste or prev_is_paste:
+                    segment = args[arg_index] or [Token('placemarker', '', tok.ws)]
+                else:
+                    if arg_index not in expanded_args:
+                        expanded_args[arg_index] = self._expand(args[arg_index], final=True)
+                    segment = expanded_args[arg_index]
+                if segment:
+                    result.append(segment[0].copy(ws=tok.ws))
+                    result.extend(segment[1:])
+                    self._spend(len(segment))
+                i += 1
+                continue
+            result.append(tok)
+            i += 1
+
+        if any(tok.kind == 'paste' for tok in body):
+            result = self._paste(result, macro)
+        copied = []
+        for start in range(0, len(result), 1024):
+            copied.extend(tok.copy(hs=tok.hs | hs) for tok in result[start:start + 1024] if tok.kind != 'placemarker')
+            self._spend(1024)
+        return copied
+
+    @staticmethod
+    def _paste(tokens, macro):
+        result = []
+        i = 0
+        while i < len(tokens):
+            tok = tokens[i]
+            if tok.kind != 'paste' or not result or i + 1 >= len(tokens):
+                result.append(tok)
+                i += 1
+                continue
+            lhs = result.pop()
+            rhs = tokens[i + 1]
+            i += 2
+            if rhs.kind == 'placemarker' and lhs.text == ',' and macro.variadic:
+                continue # GNU: ', ## __VA_ARGS__' drops the comma when no variadic arguments are given
+            text = lhs.text + rhs.text
+            pasted = tokenize(text)
+            if len(pasted) == 1:
+                result.append(pasted[0].copy(ws=lhs.ws))
+            elif not text:
+                result.append(Token('placemarker', '', lhs.ws))
+            else:
+                result.append(Token('other', text, lhs.ws))
+        return result
@@ -0,0 +1,72 @@
+int classify(int c) {
+    int kind = 0;
+    switch (c) {
+    case 1:
+    case 2:
+        kind = 1;
+        break;
+    case 3:
+        kind = 3;
+    case 4:
+        kind += 4;
+        break;
+    default:
+        kind = -1;
+    }
+    return kind;
+}
+
+int nodefault(int c) {
+    switch (c) {
+    case 0: return 10;
+    case 1: c++; break;
+    }
+    return c;
+}
+
+int count_down(int n) {
+    int steps = 0;
+    do {
+        if (n % 7 == 0) continue;
+        steps++;
+    } while (--n > 0);
+    return steps;
+}
+
+int find(int *a, int n, int key) {
+    int i = 0;
+retry:
+    for (i = 0; i < n; i++) {
+        if (a[i] == key) goto found;
+        if (a[i] < 0) { key = -key; goto retry; }
+    }
+    return -1;
+found:
+    return i;
+}
+
+int duff(int *to, int *from, int count) {
+    int n = (count + 7) / 8;
+    switch (count % 8) {
+    case 0: do { *to = *from++;
+    case 7:      *to = *from++;
+    case 1:      *to = *from++;
+            } while (--n > 0);
+    }
+    for (;;) { if (n) break; }
+    goto missing;
+}
+
+int first_match(int rows, int cols, int key) {
+    int found = -1;
+    for (int r = 0; r < rows; r++) {
+        int c = 0;
+        while (c < cols) {
+            c++;
+            if (c == key) continue;
+            if (c > key) break;
+        }
+        if (c == key) { found = r; break; }
+    }
+    return found;
+}
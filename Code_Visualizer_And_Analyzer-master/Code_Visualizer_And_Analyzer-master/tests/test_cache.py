@@ -0,0 +1,58 @@
+"""FlowchartCache keys: a hit must be what preprocessing would produce now."""
+import shutil
+
+import pytest
+
+import c2flow
+
+BACKENDS = ['builtin', pytest.param('compiler', marks=pytest.mark.skipif(not shutil.which('gcc'), reason="needs gcc"))]
+
+SOURCE = '#include "value.h"\nint f(void) { return VALUE; }\n'
+
+
+def returned(ast):
+    return c2flow.build_cfg(ast).nodes[-2].label # The return statement, before End
+
+
+def load(cache, backend):
+    result = {}
+    _, ast = c2flow.load_c_code(SOURCE, result, preprocessor=backend, cache=cache)
+    return returned(ast), result['cached']
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_working_directory_is_part_of_the_key(tmp_path, monkeypatch, backend):
+    # Quote includes of source fed on stdin resolve against the working directory
+    for name, value in (('a', 111), ('b', 222)):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / 'value.h').write_text(f"#define VALUE {value}\n")
+    cache = c2flow.FlowchartCache(str(tmp_path / 'cache'))
+    monkeypatch.chdir(tmp_path / 'a')
+    assert load(cache, backend) == ('Return 111', False)
+    monkeypatch.chdir(tmp_path / 'b')
+    assert load(cache, backend) == ('Return 222', False)
+    monkeypatch.chdir(tmp_path / 'a')
+    assert load(cache, backend) == ('Return 111', True)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_editing_a_header_invalidates_the_entry(tmp_path, monkeypatch, backend):
+    monkeypatch.chdir(tmp_path)
+    header = tmp_path / 'value.h'
+    header.write_text("#define VALUE 1\n")
+    cache = c2flow.FlowchartCache(str(tmp_path / 'cache'))
+    assert load(cache, backend) == ('Return 1', False)
+    assert load(cache, backend) == ('Return 1', True)
+    header.write_text("#define VALUE 22\n")
+    assert load(cache, backend) == ('Return 22', False)
+
+
+def test_include_paths_are_part_of_the_key(tmp_path):
+    for name, value in (('a', 1), ('b', 2)):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / 'value.h').write_text(f"#define VALUE {value}\n")
+    cache = c2flow.FlowchartCache(str(tmp_path / 'cache'))
+    for name, label in (('a', 'Return 1'), ('b', 'Return 2'), ('a', 'Return 1')):
+        _, ast = c2flow.load_c_code(SOURCE.replace('"value.h"', '<value.h>'), {}, include_paths=[str(tmp_path / name)],
+                                    preprocessor='builtin', cache=cache)
+        assert returned(ast) == label
@@ -0,0 +1,108 @@
+"""Tests for the control flow FlowchartVisitor builds, on example_control_flow.c."""
+import os
+
+import pytest
+
+import c2flow
+import controlflow
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE = os.path.join(ROOT, 'example_control_flow.c')
+
+
+@pytest.fixture(scope='module')
+def cfg():
+    with open(EXAMPLE, encoding='utf-8') as f:
+        return c2flow.build_cfg(c2flow.parse(f.read(), EXAMPLE))
+
+
+def node(cfg, label, line):
+    matches = [i for i, n in enumerate(cfg.nodes) if n.label == label and n.line == line]
+    assert len(matches) == 1, f"{label!r} at line {line}: {matches}"
+    return matches[0]
+
+
+def out_edges(cfg, src):
+    """{(dst, edge kind name)} of the edges leaving src."""
+    return {(dst, controlflow.EDGE_KINDS[kind]) for s, dst, kind, _ in cfg.edges() if s == src}
+
+
+def target(cfg, src, kind):
+    dsts = [dst for dst, edge_kind in out_edges(cfg, src) if edge_kind == kind]
+    assert len(dsts) == 1, f"{cfg.node(src)} has {len(dsts)} {kind} edges"
+    return dsts[0]
+
+
+def test_switch_cases_fallthrough_and_break(cfg):
+    switch = node(cfg, 'Switch (c)', 3)
+    cases = [node(cfg, label, line) for label, line in
+             (('Case 1', 4), ('Case 2', 5), ('Case 3', 8), ('Case 4', 10), ('Default', 13))]
+    assert {dst for dst, kind in out_edges(cfg, switch) if kind == 'case'} == set(cases)
+    # An empty case and a case without break fall through to the next one
+    assert out_edges(cfg, cases[0]) == {(cases[1], 'flow')}
+    assert out_edges(cfg, node(cfg, 'kind = 3', 9)) == {(cases[3], 'flow')}
+    # Both breaks and the end of the default branch meet after the switch
+    join = target(cfg, node(cfg, 'Break', 7), 'break')
+    assert out_edges(cfg, node(cfg, 'Break', 12)) == {(join, 'break')}
+    assert out_edges(cfg, node(cfg, 'kind = -1', 14)) == {(join, 'flow')}
+    assert out_edges(cfg, join) == {(node(cfg, 'Return kind', 16), 'flow')}
+
+
+def test_switch_without_default_can_skip_every_case(cfg):
+    switch = node(cfg, 'Switch (c)', 20)
+    join = target(cfg, node(cfg, 'Break', 22), 'break')
+    assert out_edges(cfg, switch) == {(node(cfg, 'Case 0', 21), 'case'), (node(cfg, 'Case 1', 22), 'case'),
+                                      (join, 'case')}
+    assert out_edges(cfg, join) == {(node(cfg, 'Return c', 24), 'flow')}
+
+
+def test_do_while_loops_back_after_the_body(cfg):
+    condition = node(cfg, 'While ((--n) > 0)', 29)
+    top = target(cfg, condition, 'loop')
+    # The body runs before the condition is first tested
+    assert out_edges(cfg, top) == {(node(cfg, 'If ((n % 7) == 0)', 30), 'flow')}
+    assert out_edges(cfg, node(cfg, 'steps++', 31)) == {(condition, 'flow')}
+    # continue in a do-while goes to the condition, not to the top
+    assert out_edges(cfg, node(cfg, 'Continue', 30)) == {(condition, 'continue')}
+    exit_join = target(cfg, condition, 'false')
+    assert out_edges(cfg, exit_join) == {(node(cfg, 'Return steps', 33), 'flow')}
+
+
+def test_do_while_interleaved_with_switch_cases(cfg):
+    # Duff's device: the loop edge re-enters the body at its first statement, above "case 7"
+    condition = node(cfg, 'While ((--n) > 0)', 51)
+    top = target(cfg, condition, 'loop')
+    first = node(cfg, '*to = *(from++)', 51)
+    assert out_edges(cfg, top) == {(first, 'flow')}
+    assert out_edges(cfg, first) == {(node(cfg, 'Case 7', 52), 'flow')}
+    assert out_edges(cfg, node(cfg, '*to = *(from++)', 53)) == {(condition, 'flow')}
+
+
+def test_goto_jumps_to_its_label(cfg):
+    found, retry = node(cfg, 'found:', 40), node(cfg, 'retry:', 38)
+    assert out_edges(cfg, node(cfg, 'Goto found', 40)) == {(found, 'goto')}
+    assert out_edges(cfg, node(cfg, 'Goto retry', 41)) == {(retry, 'goto')} # Backwards, out of the loop
+    assert out_edges(cfg, found) == {(node(cfg, 'Return i', 45), 'flow')}
+    assert out_edges(cfg, retry) == {(node(cfg, 'i = 0', 39), 'flow')}
+
+
+def test_goto_to_undefined_label_is_reported(capsys):
+    ast = c2flow.parse("int f(void) { goto nowhere; }")
+    cfg = c2flow.build_cfg(ast)
+    assert "goto to undefined label 'nowhere' in f()" in capsys.readouterr().out
+    assert out_edges(cfg, node(cfg, 'Goto nowhere', 1)) == {(node(cfg, 'nowhere:', 1), 'goto')}
+
+
+def test_break_and_continue_in_nested_loops(cfg):
+    outer, inner = node(cfg, 'For (r < rows)', 62), node(cfg, 'While (c < cols)', 64)
+    inner_exit, outer_exit = target(cfg, inner, 'false'), target(cfg, outer, 'false')
+    # The inner loop's continue and break leave the inner loop only
+    assert out_edges(cfg, node(cfg, 'Continue', 66)) == {(inner, 'continue')}
+    assert out_edges(cfg, node(cfg, 'Break', 67)) == {(inner_exit, 'break')}
+    assert out_edges(cfg, inner_exit) == {(node(cfg, 'If (c == key)', 69), 'flow')}
+    # The outer break leaves the for loop, skipping its increment
+    assert out_edges(cfg, node(cfg, 'Break', 69)) == {(outer_exit, 'break')}
+    assert out_edges(cfg, outer_exit) == {(node(cfg, 'Return found', 71), 'flow')}
+    increment = node(cfg, 'r++', 62)
+    assert out_edges(cfg, increment) == {(outer, 'flow')}
+    assert (increment, 'flow') in out_edges(cfg, target(cfg, node(cfg, 'If (c == key)', 69), 'false'))
@@ -0,0 +1,189 @@
+"""The builtin preprocessor must expand macros and evaluate #if like gcc -E."""
+import re
+import shutil
+import subprocess
+
+import pytest
+
+import cpreprocessor
+
+needs_gcc = pytest.mark.skipif(not shutil.which('gcc'), reason="needs gcc")
+
+# (name, source, expected output); the examples are those of C99 6.10.3.5
+MACRO_CASES = [
+    ('object_and_function_like', '#define N 10\n#define SQ(x) ((x) * (x))\nint a = SQ(N + 1);\n',
+     'int a = ((10 + 1) * (10 + 1));'),
+    ('c99_example_3', r'''#define x 3
+#define f(a) f(x * (a))
+#undef x
+#define x 2
+#define g f
+#define z z[0]
+#define h g(~
+#define m(a) a(w)
+#define w 0,1
+#define t(a) a
+#define p() int
+#define q(x) x
+#define r(x,y) x ## y
+#define str(x) # x
+f(y+1) + f(f(z)) % t(t(g)(0) + t)(1);
+g(x+(3,4)-w) | h 5) & m
+(f)^m(m);
+p() i[q()] = { q(1), r(2,3), r(4,), r(,5), r(,) };
+char c[2][6] = { str(hello), str() };
+''', 'f(2 * (y+1)) + f(2 * (f(2 * (z[0])))) % f(2 * (0)) + t(1); f(2 * (2+(3,4)-0,1)) | f(2 * (~ 5)) & '
+     'f(2 * (0,1))^m(0,1); int i[] = { 1, 23, 4, 5, }; char c[2][6] = { "hello", "" };'),
+    ('c99_example_4', r'''#define str(s) # s
+#define xstr(s) str(s)
+#define debug(s, t) printf("x" # s "= %d, x" # t "= %s", \
+ x ## s, x ## t)
+#define INCFILE(n) vers ## n
+#define glue(a, b) a ## b
+#define xglue(a, b) glue(a, b)
+#define HIGHLOW "hello"
+#define LOW LOW ", world"
+debug(1, 2);
+fputs(str(strncmp("abc\0d", "abc", '\4') // this goes away
+ == 0) str(: @\n), s);
+xstr(INCFILE(2).h)
+glue(HIGH, LOW);
+xglue(HIGH, LOW)
+''', r'''printf("x" "1" "= %d, x" "2" "= %s", x1, x2); fputs("strncmp(\"abc\\0d\", \"abc\", '\\4') == 0" ": @\n", s);'''
+     r''' "vers2.h" "hello"; "hello" ", world"'''),
+    ('c99_example_5', '#define t(x,y,z) x ## y ## z\n'
+     'int j[] = { t(1,2,3), t(,4,5), t(6,,7), t(8,9,),\n t(10,,), t(,11,), t(,,12), t(,,) };\n',
+     'int j[] = { 123, 45, 67, 89, 10, 11, 12, };'),
+    ('c99_example_6_hash_hash', '#define hash_hash # ## #\n#define mkstr(a) # a\n#define in_between(a) mkstr(a)\n'
+     '#define join(c, d) in_between(c hash_hash d)\nchar p[] = join(x, y);\n', 'char p[] = "x ## y";'),
+    ('c99_example_7_variadic', r'''#define debug(...) fprintf(stderr, __VA_ARGS__)
+#define showlist(...) puts(#__VA_ARGS__)
+#define report(test, ...) ((test)?puts(#test):\
+ printf(__VA_ARGS__))
+debug("Flag");
+debug("X = %d\n", x);
+showlist(The first, second, and third items.);
+report(x>y, "x is %d but y is %d", x, y);
+''', r'''fprintf(stderr, "Flag"); fprintf(stderr, "X = %d\n", x); puts("The first, second, and third items.");'''
+     r''' ((x>y)?puts("x>y"): printf("x is %d but y is %d", x, y));'''),
+    ('self_reference', '#define foo foo\n#define a b\n#define b a\nfoo a b;\n#define EXP 1 + EXP\nint e = EXP;\n',
+     'foo a b; int e = 1 + EXP;'),
+    ('name_without_arguments', '#define f(x) (x + 1)\nint f = f;\nint g = f\n(2);\n', 'int f = f; int g = (2 + 1);'),
+    ('arguments_across_lines', '#define ADD(a, b) ((a) + (b))\nint s = ADD(1,\n  2) + ADD(\n3, 4);\nint t;\n',
+     'int s = ((1) + (2)) + ((3) + (4)); int t;'),
+    ('undef_and_redefine', '#define V 1\nint a = V;\n#undef V\nint b = V;\n#define V 3\nint c = V;\n',
+     'int a = 1; int b = V; int c = 3;'),
+    ('line_macro', 'int a = __LINE__;\n\nint b = __LINE__;\n', 'int a = 1; int b = 3;'),
+    ('conditionals', '''#define A 2
+#ifdef A
+int a;
+#endif
+#ifndef B
+int nb;
+#else
+int b;
+#endif
+#if A == 1
+int one;
+#elif A == 2
+int two;
+#else
+int other;
+#endif
+#if defined(A) && !defined B
+int ab;
+#endif
+#if 0
+#error not taken
+#endif
+''', 'int a; int nb; int two; int ab;'),
+]
+
+# (#if expression, whether it is true): intmax_t/uintmax_t conversions, C division, unevaluated operands
+IF_CASES = [
+    ('-1 < 0u', False), ('-1 > 0u', True), ('0u - 1 == 18446744073709551615', True),
+    ('0xFFFFFFFFFFFFFFFF == -1', True), ('18446744073709551615 > 0', True), ('9223372036854775807 > 0', True),
+    ('-1 >> 63 == -1', True), ('(0u - 1) >> 63 == 1', True), ('1 << 63 < 0', True),
+    ('7 / 2 == 3', True), ('-7 / 2 == -3', True), ('-7 % 2 == -1', True), ('7 % -2 == 1', True),
+    ('-7 / 2u > 0', True), ('(1 ? -1 : 0u) > 0', True), ('(2 || 1u) - 3 < 0', True), ('(1u < 2) - 2 < 0', True),
+    ('0 && 1 / 0', False), ('1 || 1 % 0', True), ('1 ? 2 : 1 / 0', True), ('0 ? 1 / 0 : 0', False),
+    ('~0u == 0xffffffffffffffff', True), ('-(-9223372036854775807 - 1) < 0', True),
+    ("'a' == 97", True), ("'\\n' == 10", True), ('010 == 8 && 0x10 == 16', True),
+    ('UNDEFINED_NAME == 0', True), ('defined(X) || defined Y', False),
+    ('(3, 4) == 4', True), ('3, 0', False), ('(0, 1) ? 1, 1 : 0', True),
+]
+
+IF_ERRORS = ['1 / 0', '1 % 0', '1 +', '(1', 'defined']
+
+
+def tokens(output):
+    return [tok.text for line in output.splitlines() if not line.startswith('#')
+            for tok in cpreprocessor.tokenize(line)]
+
+
+def gcc_e(source, *options):
+    return subprocess.run(['gcc', '-E', '-std=c99', *options, '-x', 'c', '-'], input=source,
+                          capture_output=True, text=True)
+
+
+def if_source(expr):
+    return f"#if {expr}\nyes\n#else\nno\n#endif\n"
+
+
+@pytest.mark.parametrize('name, source, expected', MACRO_CASES, ids=[case[0] for case in MACRO_CASES])
+def test_macro_expansion(name, source, expected):
+    assert tokens(cpreprocessor.BuiltinPreprocessor()(source)) == tokens(expected)
+
+
+@needs_gcc
+@pytest.mark.parametrize('name, source, expected', MACRO_CASES, ids=[case[0] for case in MACRO_CASES])
+def test_macro_expansion_matches_gcc(name, source, expected):
+    result = gcc_e(source, '-P')
+    assert result.returncode == 0, result.stderr
+    assert tokens(cpreprocessor.BuiltinPreprocessor()(source)) == tokens(result.stdout)
+
+
+@pytest.mark.parametrize('expr, value', IF_CASES)
+def test_if_expression(expr, value):
+    assert tokens(cpreprocessor.BuiltinPreprocessor()(if_source(expr))) == ['yes' if value else 'no']
+
+
+@needs_gcc
+@pytest.mark.parametrize('expr, value', IF_CASES)
+def test_if_expression_matches_gcc(expr, value):
+    result = gcc_e(if_source(expr), '-P')
+    assert result.returncode == 0, result.stderr
+    assert tokens(result.stdout) == tokens(cpreprocessor.BuiltinPreprocessor()(if_source(expr)))
+
+
+@pytest.mark.parametrize('expr', IF_ERRORS)
+def test_if_expression_errors(expr):
+    if shutil.which('gcc'):
+        assert gcc_e(if_source(expr)).returncode != 0
+    with pytest.raises(cpreprocessor.PreprocessorError):
+        cpreprocessor.BuiltinPreprocessor()(if_source(expr))
+
+
+def statement_lines(output):
+    # Source line of each 'int <name>' declaration, following the linemarkers
+    lines, line, current = {}, 0, None
+    for text in output.splitlines():
+        marker = re.match(r'# (\d+) "([^"]*)"', text)
+        if marker:
+            line, current = int(marker.group(1)), marker.group(2)
+            continue
+        words = [tok.text for tok in cpreprocessor.tokenize(text)]
+        if current == '<stdin>' and words[:1] == ['int']:
+            lines[words[1]] = line
+        line += 1
+    return lines
+
+
+def test_statements_keep_their_source_line():
+    # AST coordinates come from these: blank lines stand in for directives and joined macro arguments
+    source = ('#define ADD(a, b) ((a) + (b))\nint s = ADD(1,\n  2) + ADD(\n3, 4);\nint t;\n'
+              '#if 1\nint u;\n#endif\nint v = 1 /\n2;\n')
+    output = cpreprocessor.BuiltinPreprocessor()(source)
+    assert statement_lines(output) == {'s': 2, 't': 5, 'u': 7, 'v': 9}
+    if shutil.which('gcc'):
+        assert statement_lines(gcc_e(source).stdout) == statement_lines(output)
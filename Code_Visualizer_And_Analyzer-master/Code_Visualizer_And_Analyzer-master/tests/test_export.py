@@ -0,0 +1,114 @@
+"""Round trips of the compact JSON and binary CFG exports, and the DOT export split into parts."""
+import json
+import os
+
+import pytest
+
+import c2flow
+from controlflow import ControlFlowGraph
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE = os.path.join(ROOT, 'example_control_flow.c')
+
+UNICODE = """\
+int greet(int n) {
+    puts("héllo, wörld ✓");
+    if (n) return 1;
+    return 0;
+}
+"""
+
+
+def cfg_of(c_code):
+    return c2flow.build_cfg(c2flow.parse(c_code))
+
+
+@pytest.fixture(scope='module')
+def example_cfg():
+    with open(EXAMPLE, encoding='utf-8') as f:
+        return cfg_of(f.read())
+
+
+def compact_round_trip(cfg):
+    return ControlFlowGraph.from_compact_dict(json.loads(cfg.to_compact_json()))
+
+
+def binary_round_trip(cfg):
+    return ControlFlowGraph.from_bytes(cfg.to_bytes())
+
+
+@pytest.mark.parametrize('round_trip', [compact_round_trip, binary_round_trip])
+def test_round_trip_keeps_nodes_edges_and_labels(example_cfg, round_trip):
+    copy = round_trip(example_cfg)
+    assert copy.to_dict() == example_cfg.to_dict()
+    assert copy.function_ranges() == example_cfg.function_ranges()
+    assert 'no match' in copy.edge_labels.values() # The edge to the end of a switch without default
+
+
+@pytest.mark.parametrize('round_trip', [compact_round_trip, binary_round_trip])
+def test_round_trip_of_non_ascii_labels(round_trip):
+    cfg = cfg_of(UNICODE)
+    assert round_trip(cfg).to_dict() == cfg.to_dict()
+
+
+@pytest.mark.parametrize('round_trip', [compact_round_trip, binary_round_trip])
+def test_round_trip_after_drain_keeps_node_ids(round_trip):
+    cfg = ControlFlowGraph()
+    start = cfg.add_node('start', 'Start')
+    cfg.drain() # As a streaming writer leaves it
+    function = cfg.add_node('function', 'Function: f()', 1)
+    ret = cfg.add_node('return', 'Return 0', 2)
+    cfg.add_edge(start, function)
+    cfg.add_edge(function, ret)
+    copy = round_trip(cfg)
+    assert copy.first_id == 1
+    assert copy.to_dict() == cfg.to_dict()
+
+
+@pytest.mark.parametrize('round_trip', [compact_round_trip, binary_round_trip])
+def test_round_trip_of_empty_graph(round_trip):
+    assert round_trip(ControlFlowGraph()).to_dict() == {'nodes': [], 'edges': []}
+
+
+def test_compact_layout(example_cfg):
+    data = json.loads(example_cfg.to_compact_json())
+    assert data['format'] == 'c2flow-cfg'
+    assert len(data['nodes']) == 3 * len(example_cfg)
+    assert len(data['edges']) == 3 * example_cfg.edge_count
+    assert len(data['labels']) == len(set(data['labels'])) # Each label stored once
+    assert data['functions'] == [i for pair in example_cfg.function_ranges() for i in pair]
+
+
+def test_binary_columns_are_aligned(example_cfg):
+    data = example_cfg.to_bytes()
+    # Header, padded labels and the int32 columns keep the uint8 kind columns at a multiple of 4
+    assert (len(data) - len(example_cfg) - example_cfg.edge_count) % 4 == 0
+    with pytest.raises(ValueError):
+        ControlFlowGraph.from_bytes(b'XXXX' + data[4:])
+
+
+@pytest.mark.parametrize('export_format', ['json', 'cfgb'])
+def test_export_cfg_writes_a_loadable_file(tmp_path, example_cfg, export_format):
+    path = c2flow.export_cfg(example_cfg, str(tmp_path / 'out' / 'example'), export_format)
+    assert path == str(tmp_path / 'out' / f'example.{export_format}')
+    if export_format == 'json':
+        with open(path, encoding='utf-8') as f:
+            copy = ControlFlowGraph.from_compact_dict(json.load(f))
+    else:
+        with open(path, 'rb') as f:
+            copy = ControlFlowGraph.from_bytes(f.read())
+    assert copy.to_dict() == example_cfg.to_dict()
+
+
+@pytest.mark.parametrize('max_nodes', [7, 50, 0])
+def test_split_dot_parts_match_scanning_every_edge(example_cfg, max_nodes):
+    parts = c2flow.cfg_to_digraphs(example_cfg, max_nodes)
+    ranges = example_cfg.split_ranges(max_nodes)
+    assert len(parts) == len(ranges)
+    for dot, (lo, hi) in zip(parts, ranges):
+        assert dot.source == c2flow.cfg_to_digraph(example_cfg, lo, hi, max_nodes).source
+    # Every edge is drawn once, or twice (leaving one part, entering the other) when it crosses parts
+    arrows = sum(dot.source.count(' -> ') for dot in parts)
+    crossing = sum((src - example_cfg.first_id) // max_nodes != (dst - example_cfg.first_id) // max_nodes
+                   for src, dst, _, _ in example_cfg.edges()) if max_nodes else 0
+    assert arrows == example_cfg.edge_count + crossing
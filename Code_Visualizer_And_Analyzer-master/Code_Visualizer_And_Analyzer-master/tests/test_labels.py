@@ -0,0 +1,103 @@
+"""LabelRenderer must print what pycparser's CGenerator prints, minus the ';'."""
+import io
+import os
+
+import pytest
+
+import c2flow
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE = os.path.join(ROOT, 'example_control_flow.c')
+
+EXPRESSIONS = r"""
+struct P { int x; int *y; struct P *next; };
+int f(int a, int b);
+int g(void);
+int expr(struct P *p, struct P q, int a, int b, int *v, char **argv) {
+    int t[3] = {1, 2, 3};
+    a = b = a + b * 2;
+    a += (b, a);
+    a = -a + !b - ~a + *v + *v++ + (*v)++ + -(-a) + - -a;
+    a = sizeof(int) + sizeof a + sizeof(*p) + sizeof(struct P);
+    a = (int) b + (char) *v + (long) (a + b);
+    a = p->x + q.x + p->next->y[a] + (*p).x + argv[a][b] + (&q)->x;
+    a = a ? b : a ? a : b;
+    a = (a, b) ? f(a, b) : g();
+    a = (a > b && b < a || !a) + (a << 2 >> 1) + (a - (b - a)) + (a - b - a);
+    a = "str" "ing"[0] + 'c' + 1.5e3 + 0x1fu;
+    v[a++] = --b, a--;
+    p->x = q.x = *v = a;
+    a = (struct P){1, 0, 0}.x;
+    a = ((int (*)(int, int)) f)(a, b);
+    return a == b ? (a = b) : -1;
+}
+"""
+
+# Declarations share their declarator text by structure, so each repeats with another initializer
+DECLARATIONS = r"""
+typedef unsigned long size_t;
+struct S { int a; };
+int h(int);
+void decls(int n) {
+    int x = n; int x = n + 1; int y; int y = h(n);
+    static const unsigned long long z = 1; static const unsigned long long z = 2;
+    const char * const volatile p = 0; const char * const volatile p = (char *) 0; char **pp = 0;
+    extern int e; register size_t r = sizeof(r); volatile int *const *q;
+    int a[3] = {1, 2, 3}; int (*fp)(int) = h; struct S s = {1}; struct S *sp = &s;
+    for (int i = 0, j = 1; i < n; i++) { int i = 2; }
+}
+"""
+
+# Declarator and type nodes are never labels on their own
+_NOT_LABELS = ('FileAST', 'FuncDef', 'Compound', 'TypeDecl', 'IdentifierType', 'PtrDecl', 'FuncDecl', 'ParamList',
+               'Struct', 'Typename', 'ArrayDecl')
+
+
+def label_nodes(ast):
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        if node.__class__.__name__ not in _NOT_LABELS:
+            yield node
+        stack.extend(child for _, child in node.children())
+
+
+@pytest.mark.parametrize('source', ['example', 'expressions', 'declarations'])
+def test_labels_match_cgenerator(source):
+    if source == 'example':
+        with open(EXAMPLE, encoding='utf-8') as f:
+            c_code = f.read()
+    else:
+        c_code = EXPRESSIONS if source == 'expressions' else DECLARATIONS
+    c_gen = c2flow._import_pycparser().c_generator.CGenerator()
+    renderer = c2flow.LabelRenderer(max_length=0)
+    nodes = list(label_nodes(c2flow.parse(c_code)))
+    assert len(nodes) > 50
+    mismatches = [(node.__class__.__name__, renderer.label(node), c_gen.visit(node).replace(';', '').strip())
+                  for node in nodes]
+    assert [m for m in mismatches if m[1] != m[2]] == []
+
+
+def test_labels_are_cut_and_shared():
+    ast = c2flow.parse("void f(int i) { i++; i++; i = i + 100000 * 100000; }")
+    renderer = c2flow.LabelRenderer(max_length=12)
+    first, second, long_one = ast.ext[0].body.block_items
+    assert renderer.label(first) == 'i++'
+    assert renderer.label(second) is renderer.label(first) # Memoized and interned
+    assert renderer.label(long_one) == 'i = i + (...'
+    assert len(renderer.label(long_one)) == 12
+
+
+def test_stream_mode_keeps_one_function_of_labels(monkeypatch):
+    held = []
+    clear = c2flow.LabelRenderer.clear
+
+    def spy(renderer):
+        held.append(len(renderer._labels))
+        clear(renderer)
+    monkeypatch.setattr(c2flow.LabelRenderer, 'clear', spy)
+    ast = c2flow.parse(''.join(f"int f{i}(int a) {{ a = a + {i}; return a * {i}; }}\n" for i in range(50)))
+    out = io.StringIO()
+    c2flow.stream_flowchart(ast, out)
+    assert max(held) == 2 # 'a = a + i' and 'a * i' of one function, not of all 50
+    assert sorted(out.getvalue().splitlines()) == sorted(c2flow.build_flowchart(ast).source.splitlines())
@@ -0,0 +1,94 @@
+"""Tests for the --metrics mode: the MetricsVisitor values and the CSV report."""
+import csv
+import io
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+import c2flow
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE = os.path.join(ROOT, 'example_control_flow.c')
+
+NESTED = """\
+int f(int n) {
+    while (n > 0) {
+        if (n > 10) {
+            n -= 2;
+        } else if (n > 5) {
+            n--;
+        } else {
+            return n;
+        }
+    }
+    return 0;
+    n = 1;
+}
+
+void g(int *a) {
+    int i, j;
+    for (i = 0; i < 4; i++)
+        for (j = 0; j < 4; j++)
+            a[j] += i;
+}
+"""
+
+
+def metrics_of(c_code):
+    return {m['function']: m for m in c2flow.compute_metrics(c2flow.parse(c_code))}
+
+
+def test_nesting_exits_and_unreachable_code():
+    metrics = metrics_of(NESTED)
+    # 'else if' is not deeper than its if; the statement after the last return is unreachable
+    assert metrics['f'] == {'function': 'f', 'line': 1, 'complexity': 4, 'max_nesting': 2, 'max_loop_depth': 1,
+                            'exits': 2, 'unreachable': 1, 'nodes': 12, 'edges': 12, 'unreachable_lines': [12]}
+    # A void function falls off the end of its body
+    assert metrics['g']['complexity'] == 3
+    assert metrics['g']['max_loop_depth'] == 2
+    assert metrics['g']['exits'] == 1
+    assert metrics['g']['unreachable'] == 0
+
+
+def test_example_control_flow_metrics():
+    with open(EXAMPLE, encoding='utf-8') as f:
+        metrics = metrics_of(f.read())
+    assert list(metrics) == ['classify', 'nodefault', 'count_down', 'find', 'duff', 'first_match']
+    # A switch adds a branch per case label, plus one when there is no default
+    assert metrics['classify']['complexity'] == 5
+    assert metrics['nodefault']['complexity'] == 3
+    assert metrics['nodefault']['exits'] == 2
+    assert metrics['count_down']['complexity'] == 3
+    assert metrics['count_down']['max_nesting'] == 2
+    assert metrics['find']['complexity'] == 4
+    assert metrics['find']['exits'] == 2
+    # duff() ends in a goto to an undefined label, so it never returns
+    assert metrics['duff']['exits'] == 0
+    assert metrics['first_match']['max_loop_depth'] == 2
+    assert metrics['first_match']['max_nesting'] == 3
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_metrics_to_stdout_is_clean_csv(tmp_path, jobs):
+    # Without PYCPARSER_FAKE_LIBC_PATH the fake_libc discovery reports its search, and duff()
+    # makes the visitor warn about its undefined label; neither may end up in the CSV
+    c_files = []
+    for name in ('a.c', 'b.c'):
+        shutil.copy(EXAMPLE, tmp_path / name)
+        c_files.append(name)
+    env = {k: v for k, v in os.environ.items() if k != 'PYCPARSER_FAKE_LIBC_PATH'}
+    proc = subprocess.run([sys.executable, os.path.join(ROOT, 'c2flow.py'), '--metrics', '-', '-j', str(jobs),
+                           '--preprocessor', 'builtin', '--no-cache'] + c_files,
+                          cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 0, proc.stderr
+    assert 'undefined label' in proc.stderr
+    rows = list(csv.reader(io.StringIO(proc.stdout)))
+    assert tuple(rows[0]) == c2flow.METRIC_FIELDS
+    assert len(rows) == 1 + 2 * 6
+    for row in rows[1:]:
+        record = dict(zip(c2flow.METRIC_FIELDS, row))
+        assert record['file'] in c_files
+        assert all(record[field].isdigit() for field in c2flow.METRIC_FIELDS[2:])
@@ -0,0 +1,92 @@
+"""Parse recovery: split_top_level and parse_recovering, which chart what parses of a broken file."""
+import pytest
+
+import c2flow
+
+ParseError = c2flow._import_pycparser().c_parser.ParseError
+
+BROKEN = """\
+# 1 "rec.c"
+typedef struct { int x; } point_t;
+typedef __builtin_weird wtype;
+static const char *s = "}{;";
+int good1(point_t p) {
+    if (p.x > 0) return 1;
+    return 0;
+}
+int bad(int a) {
+    return a +* ;
+}
+wtype uses_guess(wtype w) { return w; }
+struct S { int a; char c; };
+# 1 "other.h" 1
+int in_header(int n) { char c = '}'; return n; }
+# 15 "rec.c" 2
+int good2(int n) {
+    while (n--) { n -= 1; }
+    return n;
+}
+"""
+
+KNR = """\
+int add(a, b)
+int a;
+char *b;
+{
+    return a + *b;
+}
+int after(x) register int x; { return x; }
+int broken(void) { return 1 +; }
+int last(void) { return 2; }
+"""
+
+
+def names(ext):
+    return [node.decl.name if node.__class__.__name__ == 'FuncDef' else node.name for node in ext]
+
+
+def test_split_keeps_strings_structs_and_source_lines():
+    chunks = c2flow.split_top_level(BROKEN, 'rec.c')
+    assert [(line, is_function) for line, is_function, _ in chunks] == [
+        (1, False), (2, False), (3, False), (4, True), (8, True), (11, True), (12, False), (1, True), (15, True)]
+    assert chunks[2][2] == '# 3 "rec.c"\nstatic const char *s = "}{;";\n'
+    assert chunks[7][2].startswith('# 1 "other.h"\nint in_header')
+
+
+def test_split_keeps_knr_definitions_whole():
+    chunks = c2flow.split_top_level(KNR)
+    assert [(line, is_function) for line, is_function, _ in chunks] == [(1, True), (7, True), (8, True), (9, True)]
+    assert chunks[0][2].endswith('char *b;\n{\n    return a + *b;\n}\n')
+
+
+def test_split_of_declarations_that_only_look_like_knr_headers():
+    # An unexpanded macro before a declaration, with no body after it, is left as it was
+    chunks = c2flow.split_top_level("DECLARE(x) int y;\nint z;\nint f(void) { return 0; }\n")
+    assert [(line, is_function) for line, is_function, _ in chunks] == [(1, False), (2, False), (3, True)]
+
+
+def test_recovery_skips_what_does_not_parse():
+    ast, skipped = c2flow.parse_recovering(BROKEN, 'rec.c')
+    assert names(ast.ext) == ['point_t', 's', 'good1', 'uses_guess', None, 'in_header', 'good2'] # None: struct S
+    assert [(s['line'], s['function']) for s in skipped] == [(2, None), (8, 'bad')]
+    coords = {node.decl.name: (node.coord.file, node.coord.line) for node in ast.ext
+              if node.__class__.__name__ == 'FuncDef'}
+    assert coords['in_header'] == ('other.h', 1)
+    assert coords['good2'] == ('rec.c', 15)
+
+
+def test_recovery_keeps_knr_definitions():
+    ast, skipped = c2flow.parse_recovering(KNR)
+    assert names(ast.ext) == ['add', 'after', 'last']
+    assert [(s['line'], s['function']) for s in skipped] == [(8, 'broken')]
+    assert [p.name for p in ast.ext[0].param_decls] == ['a', 'b']
+
+
+def test_clean_code_parses_as_a_whole():
+    ast, skipped = c2flow.parse_recovering("int f(void) { return 0; }\n")
+    assert names(ast.ext) == ['f'] and skipped == []
+
+
+def test_no_function_parsing_raises_the_original_error():
+    with pytest.raises(ParseError):
+        c2flow.parse_recovering("int x = ;\nint f(void) { return 1 +; }\n")
@@ -0,0 +1,49 @@
+"""WatchSession must not lose a save that lands while an update is running."""
+import os
+
+import c2flow
+
+
+def save(path, text):
+    # A later mtime than any taken so far, whatever the file system's timestamp resolution
+    st = os.stat(path)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def session(tmp_path):
+    (tmp_path / 'value.h').write_text("#define VALUE 1\n")
+    (tmp_path / 'main.c').write_text('#include "value.h"\nint f(void) { return VALUE; }\n')
+    return c2flow.WatchSession(str(tmp_path / 'main.c'), str(tmp_path / 'out'), include_paths=[str(tmp_path)],
+                               image_format=None, preprocessor='builtin')
+
+
+def save_after_reading(monkeypatch, path, text):
+    # Saves path once the update has preprocessed everything, before it looks at the included files
+    find_included_files = c2flow.find_included_files
+
+    def save_then_find(preprocessed):
+        save(path, text)
+        return find_included_files(preprocessed)
+    monkeypatch.setattr(c2flow, 'find_included_files', save_then_find)
+
+
+def test_save_of_the_c_file_during_an_update_is_seen(tmp_path, monkeypatch):
+    watch = session(tmp_path)
+    c_file = str(tmp_path / 'main.c')
+    save_after_reading(monkeypatch, c_file, '#include "value.h"\nint f(void) { return VALUE + 1; }\n')
+    assert watch.update()[0] == ['f']
+    assert watch.changed_files() == [c_file]
+
+
+def test_save_of_a_known_header_during_an_update_is_seen(tmp_path, monkeypatch):
+    watch = session(tmp_path)
+    header = str(tmp_path / 'value.h')
+    watch.update()
+    assert sorted(watch.watched) == sorted([str(tmp_path / 'main.c'), header])
+    assert watch.changed_files() == []
+    save(str(tmp_path / 'main.c'), '#include "value.h"\nint f(void) { return VALUE; }\nint g(void) { return 0; }\n')
+    save_after_reading(monkeypatch, header, "#define VALUE 2\n")
+    assert watch.update()[0] == ['g'] # f still sees VALUE 1
+    assert watch.changed_files() == [header]